@@ -31,4 +31,19 @@ class ABCBrowser(abc.ABC):
 
     @abc.abstractmethod
     def scroll_to_element(self, element):
-        pass
\ No newline at end of file
+        pass
+
+    def extract_fields(self, batch):
+        """
+        Reads all fields of the batch from the current page
+        :param batch: selector_plan.FieldBatch
+        :return: {'fields': {name: value}, 'variants': [{name: value}]}
+        """
+        return batch.read(self)
+
+    def read_structured_product(self) -> dict or None:
+        """
+        Reads the schema.org Product of the current page from its JSON-LD or microdata
+        :return: like extract_fields() for SelectorPlan.product_batch, None if the page has no such Product
+        """
+        return None
@@ -0,0 +1,129 @@
+import abc
+
+
+class LinkRecord(object):
+    """
+    Link of the crawl, read like a dict of the link columns (record['url']) but without a dict per link
+    """
+    __slots__ = ('url', 'url_type_id', 'depth', 'record_id', 'retrieved', 'parent_id')
+
+    def __init__(self, url: str, url_type_id: int, depth: int, record_id: int, retrieved=None, parent_id=None):
+        self.url = url
+        self.url_type_id = url_type_id
+        self.depth = depth
+        self.record_id = record_id
+        self.retrieved = retrieved
+        # record_id of the page the link was found on, None for the initial and sitemap links
+        self.parent_id = parent_id
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __repr__(self):
+        return repr({k: getattr(self, k) for k in self.__slots__})
+
+
+class ABCCrawlStorage(abc.ABC):
+    """
+    Storage of the crawl state: links to scrape and extracted products, variants and images.
+    Records are returned as dicts with the same keys as the table columns, links as LinkRecord.
+    """
+
+    def __init__(self, **kvargs):
+        pass
+
+    def close(self):
+        pass
+
+    def checkpoint(self):
+        """Makes everything written so far survive a crash"""
+        pass
+
+    @abc.abstractmethod
+    def clear(self):
+        """
+        Removes the state of the previous crawl, a fresh crawl starts with it.
+        The pages cache is kept for incremental crawls, pages not seen since then are counted as gone.
+        """
+        pass
+
+    @abc.abstractmethod
+    def insert_link(self, url: str, url_type_id: int, depth: int, parent_id: int = None) -> LinkRecord or None:
+        """:return: the new link record or None if the link is already known"""
+        pass
+
+    @abc.abstractmethod
+    def mark_link_retrieved(self, record_id: int, retrieved):
+        pass
+
+    @abc.abstractmethod
+    def select_links(self):
+        """:return: iterator over all link records"""
+        pass
+
+    @abc.abstractmethod
+    def insert_product(self, name: str, description: str or None, category_1: str or None,
+                       category_2: str or None, category_3: str or None, url: str) -> int or None:
+        """:return: record id of the new product or None if the URL is already known"""
+        pass
+
+    @abc.abstractmethod
+    def select_product_id_where_url(self, url: str) -> int or None:
+        pass
+
+    @abc.abstractmethod
+    def select_products(self):
+        """:return: iterator over all product records"""
+        pass
+
+    @abc.abstractmethod
+    def insert_variant(self, sku: str, additional: dict, product_record_id: int) -> int or None:
+        """:return: record id of the new variant or None if the SKU is already known for the product"""
+        pass
+
+    @abc.abstractmethod
+    def select_variants_where_product_key(self, product_key: int) -> list:
+        pass
+
+    @abc.abstractmethod
+    def insert_image(self, url: str, variant_id: int) -> int or None:
+        """:return: record id of the new image or None if the image is already known for the variant"""
+        pass
+
+    @abc.abstractmethod
+    def update_image_url(self, record_id: int, url: str):
+        """Replaces the image URL, e.g. with the name of the downloaded file"""
+        pass
+
+    @abc.abstractmethod
+    def select_images_where_variant_id(self, variant_id: int) -> list:
+        pass
+
+    def select_image_url_where_variant_id(self, variant_id: int) -> str or None:
+        images = self.select_images_where_variant_id(variant_id)
+        return images[0]['url'] if images else None
+
+    @abc.abstractmethod
+    def select_page_cache(self, url: str) -> dict or None:
+        """:return: etag, last_modified, body_hash and result saved for the page by a previous crawl"""
+        pass
+
+    @abc.abstractmethod
+    def save_page_cache(self, url: str, etag: str or None, last_modified: str or None, body_hash: str or None,
+                        result):
+        """Saves the page validators and the extraction result, the page is marked as seen by the current crawl"""
+        pass
+
+    @abc.abstractmethod
+    def purge_page_cache(self) -> int:
+        """
+        Removes pages not seen by the current crawl
+        :return: number of removed pages
+        """
+        pass
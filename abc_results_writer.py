@@ -0,0 +1,53 @@
+import abc
+
+PRODUCT_COLUMNS = ['name', 'sku', 'description', 'category_1', 'category_2', 'category_3', 'url', 'image_url']
+
+
+class ABCResultsWriter(abc.ABC):
+    """
+    Writes scraping results row by row, one row per product variant, so rows can be written as soon as a product
+    is extracted. Columns are PRODUCT_COLUMNS followed by the additional fields.
+    """
+
+    def __init__(self, file_name: str, additional_fields: list, **kvargs):
+        self.file_name = file_name
+        self.additional_fields = list(additional_fields)
+        self.columns = PRODUCT_COLUMNS + self.additional_fields
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write_product(self, product: dict, variants: list):
+        """
+        :param product: product record (name, description, category_1..3, url)
+        :param variants: variant records with sku, additional and image_url
+        """
+        for variant in variants:
+            row = [product['name'],
+                   variant['sku'],
+                   product['description'],
+                   product['category_1'],
+                   product['category_2'],
+                   product['category_3'],
+                   product['url'],
+                   variant['image_url']]
+            row.extend(variant['additional'].get(s) for s in self.additional_fields)
+            self.write_row(row)
+            self.rows_written += 1
+        self.flush()
+
+    @abc.abstractmethod
+    def write_row(self, values: list):
+        pass
+
+    def flush(self):
+        """Makes the rows written so far readable by others"""
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        pass
@@ -0,0 +1,162 @@
+"""
+Full crawl of the synthetic website of fixture_site.py with config.json and the export of the results.
+Reports pages/sec, peak RSS and the time per stage (CrawlMetrics), optionally compared to a saved baseline:
+
+    python benchmarks/bench_crawl.py --products 10000 --latency 0.02 --concurrency 8 --save baseline.json
+    python benchmarks/bench_crawl.py --products 10000 --latency 0.02 --concurrency 8 --baseline baseline.json
+    python benchmarks/bench_crawl.py --products 10000 --latency 0.02 --concurrency 8 --sitemap --structured-data
+    python benchmarks/bench_crawl.py --products 2000 --facets --prune-low-yield
+
+Exits with 1 if pages/sec fell more than --tolerance below the baseline or rows are missing.
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+from fixture_site import FixtureSite, SiteOptions  # noqa: E402
+from selenium_scraper import Scraper  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss / 1048576 if sys.platform == 'darwin' else max_rss / 1024
+
+
+def benchmark_config(site_url: str, args) -> dict:
+    with open(os.path.join(PACKAGE_DIR, 'config.json')) as config_file:
+        config = json.load(config_file)
+    config = copy.deepcopy(config)
+    config['initial_url'] = f'{site_url}/au/en/professional/'
+    for links in ('links', 'products'):
+        config['config_links'][links]['regexps'] = [f'{site_url}/au/en/.*']
+    config_products = config['config_products']
+    if '-additional_selectors' in config_products:
+        config_products['additional_selectors'] = config_products.pop('-additional_selectors')
+    config['scraper'].update(browser=args.browser, concurrency=args.concurrency, processes=args.processes,
+                             storage=args.storage, download_product_images=args.images, incremental=False,
+                             output=dict(format=args.format, stream=False, file_name=''),
+                             metrics=dict(enabled=True, progress_interval=args.progress, file_name=''),
+                             per_host_rate=args.max_rate,
+                             structured_data=args.structured_data,
+                             sitemaps=dict(config['scraper'].get('sitemaps', {}), enabled=args.sitemap,
+                                           skip_catalogues=True),
+                             budget=dict(config['scraper'].get('budget', {}), max_depth=args.max_depth,
+                                         low_yield=dict(config['scraper'].get('budget', {}).get('low_yield', {}),
+                                                        enabled=args.prune_low_yield)),
+                             politeness=dict(config['scraper'].get('politeness', {}), max_rate=args.max_rate))
+    return config
+
+
+def run(args) -> dict:
+    options = SiteOptions(products=args.products, latency=args.latency, json_ld=args.structured_data,
+                          facets=args.facets)
+    work_dir = tempfile.mkdtemp(prefix='bench_crawl_')
+    current_dir = os.getcwd()
+    try:
+        with FixtureSite(options) as site:
+            os.chdir(work_dir)
+            scraper = Scraper(benchmark_config(site.url, args))
+            started = perf_counter()
+            scraper.scrape(get_interval=0)
+            crawl_time = perf_counter() - started
+
+            started = perf_counter()
+            with scraper.open_results_writer() as results_writer:
+                scraper.export_results(results_writer)
+            rows = results_writer.rows_written
+            export_time = perf_counter() - started
+            scraper.storage.close()
+            scraper.http_client.close()
+
+        metrics = scraper.metrics.to_dict()
+        return {'products': args.products,
+                'pages': metrics['counters'].get('pages', 0),
+                'rows': rows,
+                'crawl_s': round(crawl_time, 3),
+                'pages_per_s': round(metrics['counters'].get('pages', 0) / crawl_time, 2),
+                'export_s': round(export_time, 3),
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+                'bytes_fetched': metrics['counters'].get('bytes', 0),
+                'stages': {stage: {'total_s': values['total_s'], 'count': values['count'],
+                                   'mean_ms': values['mean_ms'], 'p99_ms': values['p99_ms']}
+                           for stage, values in metrics['stages'].items()}}
+    finally:
+        os.chdir(current_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_report(report: dict):
+    print(f"{report['pages']} pages, {report['rows']} rows of {report['products']} products")
+    print(f"Crawl:  {report['crawl_s']:.2f} s, {report['pages_per_s']:.1f} pages/s, "
+          f"{report['bytes_fetched'] / 1048576:.1f} MB fetched")
+    print(f"Export: {report['export_s']:.2f} s")
+    print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+    print(f"{'stage':<24}{'total s':>10}{'count':>10}{'mean ms':>10}{'p99 ms':>10}")
+    for stage, values in sorted(report['stages'].items(), key=lambda item: item[1]['total_s'], reverse=True):
+        print(f"{stage:<24}{values['total_s']:>10.3f}{values['count']:>10}{values['mean_ms']:>10.3f}"
+              f"{values['p99_ms']:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks a full crawl of a synthetic website')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--browser', default='lxml', choices=['lxml', 'hybrid'])
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--storage', default='memory', choices=['memory', 'sqlite'])
+    parser.add_argument('--format', default='xlsx', choices=sorted(Scraper.results_writers))
+    parser.add_argument('--images', action='store_true', help='download product images')
+    parser.add_argument('--max-rate', type=float, default=0,
+                        help='max requests per second, 0 - unlimited, otherwise the rate adapts up to it')
+    parser.add_argument('--sitemap', action='store_true',
+                        help='discover the products from the sitemaps instead of the catalogue pages')
+    parser.add_argument('--structured-data', action='store_true',
+                        help='product pages have JSON-LD, read instead of the product selectors')
+    parser.add_argument('--facets', action='store_true',
+                        help='catalogue pages link their sort orders and filters, listing the same products')
+    parser.add_argument('--max-depth', type=int, default=0, help='deepest catalogue page followed, 0 - no limit')
+    parser.add_argument('--prune-low-yield', action='store_true',
+                        help='stop following URL families whose pages yield no new products')
+    parser.add_argument('--progress', type=float, default=0, help='seconds between progress lines, 0 - none')
+    parser.add_argument('--save', help='write the report to this JSON file')
+    parser.add_argument('--baseline', help='JSON report to compare pages/sec with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed pages/sec drop, 0.1 - 10%%')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s',
+                        level=logging.INFO if args.progress else logging.ERROR)
+    report = run(args)
+    print_report(report)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if report['rows'] != args.products:
+        print(f"FAIL: {report['rows']} rows exported, {args.products} expected")
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        change = report['pages_per_s'] / baseline['pages_per_s'] - 1
+        print(f"Baseline: {baseline['pages_per_s']:.1f} pages/s, change {change:+.1%}")
+        if change < -args.tolerance:
+            print(f'FAIL: pages/sec fell more than {args.tolerance:.0%}')
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Compares HtmlSanitizer with prettify_description on product descriptions the way the browsers return them:
+lxml serialization of the element (RequestsLxmlBrowser) and innerHTML (SeleniumChromeBrowser).
+Fails if the outputs differ.
+
+    python benchmarks/bench_description_sanitizer.py [--products 2000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+from lxml import html
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from html_sanitizer import HtmlSanitizer, prettify_description  # noqa: E402
+
+WORDS = ['drill', 'battery', 'Li-Ion', '18 V', 'torque', '&', 'Nm', 'chuck', 'brushless', 'motor', 'LED',
+         'case', '<2 kg', 'x > y', 'Bosch™', 'Professional®', '—', 'café', 'ø 13 mm']
+
+
+def random_text(rnd: random.Random, words: int) -> str:
+    return ' '.join(rnd.choice(WORDS) for _ in range(words))
+
+
+def random_description(rnd: random.Random) -> str:
+    """Description block as found on product pages: paragraphs, feature lists, tables, links, images, scripts"""
+    parts = [f'<div class="description" id="d{rnd.randint(0, 999)}">',
+             f'<h2 class="title">{random_text(rnd, 4)}</h2>']
+    for _ in range(rnd.randint(1, 4)):
+        parts.append(f'<p style="margin:0">{random_text(rnd, 12)} <strong>{random_text(rnd, 2)}</strong> '
+                     f'<a href="/p/{rnd.randint(0, 99)}">{random_text(rnd, 2)}</a>{random_text(rnd, 5)}<br></p>')
+    parts.append('<ul class="features">')
+    for _ in range(rnd.randint(2, 8)):
+        parts.append(f'<li><span class="icon"></span> {random_text(rnd, 6)}</li>')
+    parts.append('</ul>')
+    if rnd.random() < 0.5:
+        parts.append('<table class="specs"><tbody>')
+        for _ in range(rnd.randint(2, 6)):
+            parts.append(f'<tr><td>{random_text(rnd, 2)}</td><td>{random_text(rnd, 1)}&nbsp;mm</td></tr>')
+        parts.append('</tbody></table>')
+    parts.append(f'<img src="/img/{rnd.randint(0, 99)}.jpg" alt="{random_text(rnd, 2)}">')
+    parts.append('<script>window.dataLayer = window.dataLayer || [];</script><!-- teaser -->')
+    parts.append('<div class="empty"><span></span></div></div>')
+    return '\n'.join(parts)
+
+
+def build_corpus(products: int) -> list:
+    rnd = random.Random(42)
+    corpus = list()
+    for i in range(products):
+        element = html.fragment_fromstring(random_description(rnd))
+        if i % 2:
+            # RequestsLxmlBrowser
+            corpus.append(html.etree.tostring(element, pretty_print=True))
+        else:
+            # innerHTML of the browser
+            corpus.append(''.join(html.tostring(child, encoding='unicode') for child in element))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.products)
+    sanitizer = HtmlSanitizer()
+
+    mismatches = [value for value in corpus if sanitizer(value) != prettify_description(value)]
+    if mismatches:
+        print(f'{len(mismatches)} of {len(corpus)} descriptions differ, first one:\n{mismatches[0]}')
+        sys.exit(1)
+    sanitizer.legacy_calls = 0
+
+    legacy = min(timeit.repeat(lambda: [prettify_description(value) for value in corpus], number=1,
+                               repeat=args.repeat))
+    fast = min(timeit.repeat(lambda: [sanitizer(value) for value in corpus], number=1, repeat=args.repeat))
+    print(f'{len(corpus)} descriptions, identical output')
+    print(f'prettify_description: {legacy:.3f} s ({legacy / len(corpus) * 1e6:.0f} us per description)')
+    print(f'HtmlSanitizer:        {fast:.3f} s ({fast / len(corpus) * 1e6:.0f} us per description), '
+          f'{sanitizer.legacy_calls // args.repeat} fell back to prettify_description')
+    print(f'Speed-up: {legacy / fast:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
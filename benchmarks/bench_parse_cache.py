@@ -0,0 +1,81 @@
+"""
+Loads product pages of fixture_site.py reached via several URLs each (a product listed under several categories)
+into RequestsLxmlBrowser and extracts the product fields of config.json, with and without the parse cache.
+Duplicates are --products pages apart, they are parsed again when that is over --max-entries.
+Fails if the extracted fields differ.
+
+    python benchmarks/bench_parse_cache.py [--products 100] [--urls-per-product 3] [--max-entries 128]
+"""
+import argparse
+import json
+import os
+import sys
+from time import perf_counter
+
+import requests
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+from fixture_site import SiteOptions, product_page  # noqa: E402
+from parse_cache import ParseCache  # noqa: E402
+from requests_lxml_browser import RequestsLxmlBrowser  # noqa: E402
+from selector_plan import SelectorPlan  # noqa: E402
+
+
+def make_response(body: bytes, content_type='text/html; charset=utf-8') -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.headers['Content-Type'] = content_type
+    return response
+
+
+def crawl(pages: list, batch, parse_cache: ParseCache) -> tuple:
+    """
+    :return: seconds spent and the extracted fields of every page
+    """
+    browser = RequestsLxmlBrowser(no_session=True, parse_cache=parse_cache)
+    results = list()
+    started = perf_counter()
+    for url, response in pages:
+        browser.load(url, response)
+        results.append(browser.extract_fields(batch))
+    return perf_counter() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the parse cache of RequestsLxmlBrowser')
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--urls-per-product', type=int, default=3)
+    parser.add_argument('--max-entries', type=int, default=128)
+    args = parser.parse_args()
+
+    with open(os.path.join(PACKAGE_DIR, 'config.json')) as config_file:
+        batch = SelectorPlan(json.load(config_file)).product_batch
+
+    options = SiteOptions(products=args.products)
+    bodies = [product_page(options, p).encode('utf-8') for p in range(args.products)]
+    # Every category lists a slice of the products, the same product page comes back under another URL
+    pages = [(f'http://127.0.0.1/au/en/category{c}/product/{p}.html', make_response(bodies[p]))
+             for c in range(args.urls_per_product) for p in range(args.products)]
+    image = make_response(b'\xff\xd8\xff\xe0' * 5000, 'image/jpeg')
+
+    uncached_time, uncached = crawl(pages, batch, ParseCache(max_entries=0))
+    parse_cache = ParseCache(max_entries=args.max_entries)
+    cached_time, cached = crawl(pages, batch, parse_cache)
+    image_time, _ = crawl([('http://127.0.0.1/images/0.jpg', image)] * len(pages), batch, parse_cache)
+
+    print(f'{len(pages)} pages, {args.products} distinct, LRU of {args.max_entries} pages, '
+          f'{parse_cache.hits} hits')
+    print(f'No cache:   {uncached_time:.3f} s, {uncached_time / len(pages) * 1e3:.3f} ms/page')
+    print(f'Parse cache: {cached_time:.3f} s, {cached_time / len(pages) * 1e3:.3f} ms/page, '
+          f'x{uncached_time / cached_time:.1f}')
+    print(f'Non-HTML:   {image_time / len(pages) * 1e3:.3f} ms/page')
+    if cached != uncached:
+        print('FAIL: the cached pages give other fields')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
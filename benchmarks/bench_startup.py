@@ -0,0 +1,111 @@
+"""
+Startup of a short crawl: import of selenium_scraper and Scraper(config) with the lxml browser and CSV export, each
+measured in a fresh interpreter, and the compilation of the selector plan reused by crawls launched one after
+another in the same process. Fails if the crawl loads a dependency it does not use (selenium, bs4, htmlmin,
+xlsxwriter).
+
+    python benchmarks/bench_startup.py [--runs 10] [--launches 100]
+"""
+import argparse
+import copy
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+HEAVY_MODULES = ('selenium', 'bs4', 'htmlmin', 'xlsxwriter')
+
+# Run by a fresh interpreter in a temporary directory, prints the timings as JSON
+CHILD_SCRIPT = '''
+import json, sys
+from time import perf_counter
+started = perf_counter()
+import selenium_scraper
+imported = perf_counter()
+with open(sys.argv[1]) as config_file:
+    config = json.load(config_file)
+scraper = selenium_scraper.Scraper(config)
+initialized = perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1e3, 'init_ms': (initialized - imported) * 1e3,
+                  'modules': [m for m in sys.argv[2:] if m in sys.modules]}))
+'''
+
+
+def crawl_config() -> dict:
+    with open(os.path.join(PACKAGE_DIR, 'config.json')) as config_file:
+        config = json.load(config_file)
+    config = copy.deepcopy(config)
+    config_products = config['config_products']
+    if '-additional_selectors' in config_products:
+        config_products['additional_selectors'] = config_products.pop('-additional_selectors')
+    config['scraper'].update(browser='lxml', storage='memory', download_product_images=False, processes=1,
+                             output=dict(format='csv', stream=False, file_name=''),
+                             metrics=dict(enabled=True, progress_interval=0, file_name=''))
+    return config
+
+
+def fresh_interpreter_startup(config: dict, runs: int) -> list:
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    config_file_name = os.path.join(work_dir, 'config.json')
+    with open(config_file_name, 'w') as config_file:
+        json.dump(config, config_file)
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(PACKAGE_DIR))
+    results = list()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, config_file_name, *HEAVY_MODULES],
+                                cwd=work_dir, env=env, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    os.remove(config_file_name)
+    os.rmdir(work_dir)
+    return results
+
+
+def plan_compilation(config: dict, launches: int) -> tuple:
+    """
+    :return: seconds compiling the selector plan for every launch and getting the cached one
+    """
+    from selector_plan import SelectorPlan, cached_selector_plan
+
+    started = perf_counter()
+    for _ in range(launches):
+        SelectorPlan(config)
+    compiled_time = perf_counter() - started
+
+    started = perf_counter()
+    for _ in range(launches):
+        cached_selector_plan(config)
+    cached_time = perf_counter() - started
+    return compiled_time, cached_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the startup of a crawl')
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters started')
+    parser.add_argument('--launches', type=int, default=100, help='crawls launched in the same process')
+    args = parser.parse_args()
+
+    config = crawl_config()
+    results = fresh_interpreter_startup(config, args.runs)
+    import_ms = statistics.median(r['import_ms'] for r in results)
+    init_ms = statistics.median(r['init_ms'] for r in results)
+    loaded = sorted(set(m for r in results for m in r['modules']))
+    print(f'Fresh interpreter, median of {args.runs}: import {import_ms:.1f} ms, Scraper() {init_ms:.1f} ms')
+    print(f'Unused dependencies loaded: {", ".join(loaded) or "none"}')
+
+    compiled_time, cached_time = plan_compilation(config, args.launches)
+    print(f'Selector plan for {args.launches} launches: compiled {compiled_time * 1e3:.1f} ms, '
+          f'cached {cached_time * 1e3:.1f} ms')
+
+    if loaded:
+        print('FAIL: the lxml crawl with CSV export loads dependencies it does not use')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Synthetic supplier website shaped like the Bosch layout of config.json, served on 127.0.0.1 for offline benchmarks:
+home page -> catalogues (paginated listings) -> product pages with breadcrumbs, description, image and part number
+table, optionally with a JSON-LD Product. robots.txt points to a sitemap index of gzipped sitemaps of the products.
+Catalogue pages may link faceted views of themselves (sort orders and filters) listing the same products.
+Pages are generated from the URL, so any size of catalogue costs no memory.
+
+    python benchmarks/fixture_site.py --products 10000 --latency 0.05 --port 8765
+"""
+import argparse
+import gzip
+import json
+import multiprocessing
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+# Facets of the catalogue pages and their values, a faceted view lists the same products as the page
+FACETS = {'sort': ['name', 'price', 'new'], 'color': ['blue', 'green', 'red'], 'voltage': ['12', '18', '36']}
+
+WORDS = ['drill', 'battery', 'Li-Ion', 'torque', 'chuck', 'brushless', 'motor', 'LED', 'carrying', 'case',
+         'hammer', 'impact', 'rotary', 'cordless', 'ergonomic', 'grip', 'vibration', 'control', 'speed', 'gear']
+
+
+class SiteOptions(object):
+    __slots__ = ('products', 'products_per_page', 'pages_per_catalogue', 'latency', 'image_size', 'json_ld',
+                 'urls_per_sitemap', 'facets')
+
+    def __init__(self, products=1000, products_per_page=24, pages_per_catalogue=5, latency=0.0, image_size=20000,
+                 json_ld=False, urls_per_sitemap=1000, facets=False):
+        """
+        :param products: total number of products
+        :param products_per_page: products listed on a catalogue page
+        :param pages_per_catalogue: listing pages of a catalogue, linked one to another
+        :param latency: seconds added to every response
+        :param image_size: bytes of a product image
+        :param json_ld: product pages describe the product in JSON-LD too
+        :param urls_per_sitemap: product URLs in a sitemap of the sitemap index
+        :param facets: catalogue pages link their views with one more facet of FACETS set
+        """
+        self.products = products
+        self.products_per_page = products_per_page
+        self.pages_per_catalogue = pages_per_catalogue
+        self.latency = latency
+        self.image_size = image_size
+        self.json_ld = json_ld
+        self.urls_per_sitemap = urls_per_sitemap
+        self.facets = facets
+
+    @property
+    def catalogues(self) -> int:
+        per_catalogue = self.products_per_page * self.pages_per_catalogue
+        return (self.products + per_catalogue - 1) // per_catalogue
+
+
+def text(rnd: random.Random, words: int) -> str:
+    return ' '.join(rnd.choice(WORDS) for _ in range(words))
+
+
+def home_page(options: SiteOptions) -> str:
+    items = ''.join(f'<li><h3>{text(random.Random(c), 2)}</h3>'
+                    f'<a href="/au/en/catalogue{c}/page0/">Find out more</a></li>' for c in range(options.catalogues))
+    return f'<html><head><title>Home</title></head><body><div id="Products"><ul>{items}</ul></div></body></html>'
+
+
+def catalogue_page(options: SiteOptions, catalogue: int, page: int, query: str = '') -> str or None:
+    if catalogue >= options.catalogues or page >= options.pages_per_catalogue:
+        return None
+    first = (catalogue * options.pages_per_catalogue + page) * options.products_per_page
+    products = range(first, min(first + options.products_per_page, options.products))
+    tiles = ''.join(f'<div class="tile"><a href="/au/en/product/{p}.html" title="View product {p}">'
+                    f'<img src="/images/{p}.jpg" alt=""/></a><span>{text(random.Random(p), 3)}</span></div>'
+                    for p in products)
+    pagination = ''
+    if page + 1 < options.pages_per_catalogue:
+        pagination = (f'<div class="asListing"><div class="asRow"><div class="asRowL">'
+                      f'<a href="/au/en/catalogue{catalogue}/page{page + 1}/">Next</a></div></div></div>')
+    if options.facets:
+        params = dict(parse_qsl(query))
+        base = f'/au/en/catalogue{catalogue}/page{page}/'
+        links = ''.join(f'<a href="{base}?{urlencode(dict(params, **{facet: value}))}">{facet}: {value}</a>'
+                        for facet, values in FACETS.items() if facet not in params for value in values)
+        if links:
+            pagination += f'<div class="asListing"><div class="asRow"><div class="asRowL">{links}</div></div></div>'
+    return (f'<html><head><title>Catalogue {catalogue}</title><script>var page = {page};</script></head><body>'
+            f'<div id="mainContent"><h1>Catalogue {catalogue}</h1>{tiles}{pagination}</div></body></html>')
+
+
+def product_page(options: SiteOptions, product: int) -> str or None:
+    if product >= options.products:
+        return None
+    rnd = random.Random(product)
+    catalogue = product // (options.products_per_page * options.pages_per_catalogue)
+    paragraphs = ''.join(f'<p style="margin:0">{text(rnd, 25)} <strong>{text(rnd, 2)}</strong> '
+                         f'<a href="/au/en/product/{rnd.randrange(options.products)}.html">{text(rnd, 2)}</a></p>'
+                         for _ in range(rnd.randint(1, 4)))
+    features = ''.join(f'<li><span class="icon"></span>{text(rnd, 6)}</li>' for _ in range(rnd.randint(3, 8)))
+    specs = ''.join(f'<tr><td>{text(rnd, 2)}</td><td>{rnd.randint(1, 999)}&nbsp;mm</td><td>{text(rnd, 1)}</td>'
+                    f'<td>{rnd.randint(1, 99)}</td><td>{text(rnd, 1)}</td></tr>' for _ in range(rnd.randint(2, 6)))
+    category = text(rnd, 2)
+    title = text(rnd, 2)
+    sku = f'{rnd.randint(0, 9)} {product:03d} {rnd.randint(100, 999)}'
+    json_ld = ''
+    if options.json_ld:
+        json_ld = '<script type="application/ld+json">' + json.dumps({
+            '@context': 'https://schema.org',
+            '@graph': [{'@type': 'BreadcrumbList',
+                        'itemListElement': [{'@type': 'ListItem', 'position': i + 1, 'name': name}
+                                            for i, name in enumerate(['Home', f'Catalogue {catalogue} & accessories',
+                                                                      category, f'Product {product}'])]},
+                       {'@type': 'Product', 'name': f'GSB {product} Professional\u00ae {title}',
+                        'description': f'{text(random.Random(-product), 40)}', 'sku': f'SKU-{product}',
+                        'image': f'/images/{product}.jpg'}]}) + '</script>'
+    return f'''<html><head><title>Product {product}</title><script>var product = {product};</script>{json_ld}</head><body>
+<div id="breadcrumb"><ul><li><a href="/au/en/professional/">Home</a></li>
+<li><a href="/au/en/catalogue{catalogue}/page0/">Catalogue {catalogue} &amp; accessories</a></li>
+<li><a href="#">{category}</a></li><li>Product {product}</li></ul></div>
+<div id="mainContent"><h1>GSB {product} Professional&#174; {title}</h1>
+<div class="detContainer"><div class="accProdImg">
+<a href="/images/{product}.jpg"><img src="/images/{product}.jpg"/></a></div></div>
+<div class="detail"><div class="asRight">{paragraphs}<ul class="features">{features}</ul>
+<img src="/images/{product}.jpg"/><script>track({product});</script><div class="empty"><span></span></div></div></div>
+<table id="skuTable"><tr><th>Part number</th><th>{sku}</th></tr>
+</table><table class="specs">
+<tr><td>Part number</td><td>SKU-{product}</td><td>18 V</td><td>2.0 Ah</td><td>1.3 kg</td></tr>
+{specs}</table></div></body></html>'''
+
+
+def robots_txt(host: str) -> str:
+    return f'User-agent: *\nDisallow: /cart/\nSitemap: http://{host}/sitemap.xml\n'
+
+
+def sitemap_index(options: SiteOptions, host: str) -> str:
+    sitemaps = (options.products + options.urls_per_sitemap - 1) // options.urls_per_sitemap
+    entries = ''.join(f'<sitemap><loc>http://{host}/sitemap-{s}.xml.gz</loc></sitemap>' for s in range(sitemaps))
+    return (f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</sitemapindex>')
+
+
+def sitemap(options: SiteOptions, host: str, number: int) -> bytes or None:
+    first = number * options.urls_per_sitemap
+    if first >= options.products:
+        return None
+    entries = ''.join(f'<url><loc>http://{host}/au/en/product/{p}.html</loc><changefreq>weekly</changefreq></url>'
+                      for p in range(first, min(first + options.urls_per_sitemap, options.products)))
+    return gzip.compress(f'<?xml version="1.0" encoding="UTF-8"?>'
+                         f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</urlset>'
+                         .encode('utf-8'), compresslevel=1)
+
+
+def make_handler(options: SiteOptions):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately, Nagle's algorithm would delay keep-alive responses by 40 ms
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if options.latency:
+                time.sleep(options.latency)
+            url = urlparse(self.path)
+            path = url.path
+            parts = path.strip('/').split('/')
+            body, content_type = None, 'text/html; charset=utf-8'
+            host = self.headers.get('Host', '127.0.0.1')
+            try:
+                if path == '/robots.txt':
+                    body, content_type = robots_txt(host), 'text/plain'
+                elif path == '/sitemap.xml':
+                    body, content_type = sitemap_index(options, host), 'application/xml'
+                elif path.startswith('/sitemap-') and path.endswith('.xml.gz'):
+                    body, content_type = sitemap(options, host, int(path[len('/sitemap-'):-len('.xml.gz')])), \
+                                         'application/gzip'
+                elif path == '/au/en/professional/':
+                    body = home_page(options)
+                elif len(parts) == 4 and parts[2].startswith('catalogue') and parts[3].startswith('page'):
+                    body = catalogue_page(options, int(parts[2][len('catalogue'):]), int(parts[3][len('page'):]),
+                                          url.query)
+                elif len(parts) == 4 and parts[2] == 'product' and parts[3].endswith('.html'):
+                    body = product_page(options, int(parts[3][:-len('.html')]))
+                elif len(parts) == 2 and parts[0] == 'images' and parts[1].endswith('.jpg'):
+                    body, content_type = self.image(int(parts[1][:-len('.jpg')])), 'image/jpeg'
+            except ValueError:
+                body = None
+
+            if body is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        @staticmethod
+        def image(product: int) -> bytes:
+            return b'\xff\xd8\xff\xe0' + product.to_bytes(4, 'big') * (options.image_size // 4)
+
+    return Handler
+
+
+def serve(options: SiteOptions, port: int = 0, ready=None):
+    """
+    Serves the site until the process is terminated
+    :param ready: queue getting the port the server listens on
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(options))
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+class FixtureSite(object):
+    """
+    The site served by a separate process, so that it does not share CPU time and memory with the measured crawl
+    """
+
+    def __init__(self, options: SiteOptions):
+        self.options = options
+        self.port = None
+        self._process = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context('spawn')
+        ready = context.Queue()
+        self._process = context.Process(target=serve, args=(self.options, 0, ready), daemon=True)
+        self._process.start()
+        self.port = ready.get(timeout=30)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._process.terminate()
+        self._process.join()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves the synthetic benchmark website')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--facets', action='store_true', help='catalogue pages link their faceted views')
+    args = parser.parse_args()
+
+    site_options = SiteOptions(products=args.products, latency=args.latency, facets=args.facets)
+    print(f'Serving {site_options.products} products in {site_options.catalogues} catalogues on '
+          f'http://127.0.0.1:{args.port}/au/en/professional/')
+    threading.Thread(target=serve, args=(site_options, args.port), daemon=True).start()
+    threading.Event().wait()
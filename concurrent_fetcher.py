@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from politeness import HostLimiter
+
+
+class ConcurrentFetcher(object):
+    """
+    Keeps several page downloads in flight on a thread pool.
+    Only the network I/O runs in the pool, the responses are handed back to the caller to be parsed in order of completion.
+    """
+
+    def __init__(self, fetch, max_workers: int, host_limiter: HostLimiter = None):
+        """
+        :param fetch: thread-safe function (url, headers) -> response
+        :param max_workers: max number of requests in flight
+        :param host_limiter: per-host politeness limits
+        """
+        self._fetch = fetch
+        self._host_limiter = host_limiter or HostLimiter()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetcher')
+
+    def submit(self, url: str, headers: dict = None) -> Future:
+        return self._executor.submit(self._fetch_politely, url, headers)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _fetch_politely(self, url, headers):
+        return self._host_limiter.call(url, lambda: self._fetch(url, headers))
@@ -0,0 +1,152 @@
+import logging
+import re
+import threading
+from time import perf_counter
+from urllib.parse import urlsplit, parse_qsl
+
+_digits = re.compile(r'\d+')
+
+
+def url_family(url: str) -> str or None:
+    """
+    Family of a URL with a query: host, path with the numbers replaced by "*" and the sorted names of the query
+    parameters, e.g. "example.com/c/*/shoes?color&sort". Facet and sorting permutations of a catalogue fall in
+    the same family whatever the parameter values are.
+    :return: None for URLs without a query, which are never pruned
+    """
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    if not parts.query:
+        return None
+    names = sorted(set(name for name, _ in parse_qsl(parts.query, keep_blank_values=True)))
+    if not names:
+        return None
+    return f'{parts.netloc.lower()}{_digits.sub("*", parts.path)}?{"&".join(names)}'
+
+
+class _FamilyYield(object):
+    __slots__ = ('pages', 'new_products', 'pruned')
+
+    def __init__(self):
+        self.pages = 0
+        self.new_products = 0
+        self.pruned = False
+
+
+class CrawlBudget(object):
+    """
+    Limits of the crawl: max catalogue depth, max number of pages, max duration, excluded URL patterns and
+    pruning of low-yield URL families. A family of catalogue URLs (see url_family) is pruned once `min_pages` of its
+    pages have yielded no more than `min_yield` new product links per page: its pending links are dropped and its
+    new links are not queued any more. Thread-safe.
+    """
+
+    def __init__(self, **kvargs):
+        """
+        :param kvargs: max_depth (deepest catalogue followed, products found on it are still scraped, 0 - no limit),
+                       max_pages (pages scraped, 0 - no limit), max_seconds (0 - no limit),
+                       exclude_regexps (links never queued),
+                       low_yield (dict: enabled, min_pages, min_yield),
+                       metrics (CrawlMetrics getting the links_too_deep, links_excluded, links_pruned and
+                       families_pruned counters)
+        """
+        self.max_depth = kvargs.get('max_depth', 0)
+        self.max_pages = kvargs.get('max_pages', 0)
+        self.max_seconds = kvargs.get('max_seconds', 0)
+        self.exclude_regexps = [re.compile(regex) for regex in kvargs.get('exclude_regexps', [])]
+        low_yield = kvargs.get('low_yield', {})
+        self.prune_low_yield = low_yield.get('enabled', False)
+        self.min_pages = low_yield.get('min_pages', 10)
+        self.min_yield = low_yield.get('min_yield', 0)
+        self.metrics = kvargs.get('metrics')
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        """Restarts the page count and the clock, forgets the families"""
+        with self._lock:
+            self.pages = 0
+            self._started = perf_counter()
+            self._families = dict()
+            self._exhausted = None
+
+    @property
+    def pruned_families(self) -> list:
+        return [family for family, family_yield in self._families.items() if family_yield.pruned]
+
+    def exhausted(self) -> str or None:
+        """
+        :return: reason why no more pages may be scraped, None while the budget lasts
+        """
+        if self._exhausted is None:
+            if self.max_pages and self.pages >= self.max_pages:
+                self._exhausted = f'{self.max_pages} pages scraped'
+            elif self.max_seconds and perf_counter() - self._started >= self.max_seconds:
+                self._exhausted = f'{self.max_seconds} s elapsed'
+            if self._exhausted is not None:
+                logging.info(f'Crawl budget is exhausted: {self._exhausted}, the pending links are not scraped')
+        return self._exhausted
+
+    def allows_link(self, url: str, is_catalogue: bool, depth: int) -> bool:
+        """
+        :return: False if the link must not be queued
+        """
+        if is_catalogue and self.max_depth and depth > self.max_depth:
+            self._increment('links_too_deep')
+            return False
+        if self.exclude_regexps and any(regex.match(url) for regex in self.exclude_regexps):
+            self._increment('links_excluded')
+            return False
+        if is_catalogue and self.is_pruned(url):
+            self._increment('links_pruned')
+            return False
+        return True
+
+    def take(self, url: str, is_catalogue: bool) -> bool:
+        """
+        Counts the link popped from the frontier as a scraped page
+        :return: False if the link belongs to a family pruned since it was queued, it is not counted then
+        """
+        if is_catalogue and self.is_pruned(url):
+            self._increment('links_pruned')
+            return False
+        with self._lock:
+            self.pages += 1
+        return True
+
+    def is_pruned(self, url: str) -> bool:
+        if not self.prune_low_yield:
+            return False
+        family = url_family(url)
+        family_yield = self._families.get(family) if family is not None else None
+        return family_yield is not None and family_yield.pruned
+
+    def record_yield(self, url: str, new_products: int):
+        """
+        Registers the number of new product links found on a scraped catalogue page, prunes its family if the
+        family does not pay off
+        """
+        if not self.prune_low_yield:
+            return
+        family = url_family(url)
+        if family is None:
+            return
+        with self._lock:
+            family_yield = self._families.get(family)
+            if family_yield is None:
+                family_yield = self._families[family] = _FamilyYield()
+            family_yield.pages += 1
+            family_yield.new_products += new_products
+            if (family_yield.pruned or family_yield.pages < self.min_pages or
+                    family_yield.new_products > self.min_yield * family_yield.pages):
+                return
+            family_yield.pruned = True
+        logging.info(f'Pruning URL family {family}: {family_yield.pages} pages yielded '
+                     f'{family_yield.new_products} new products')
+        self._increment('families_pruned')
+
+    def _increment(self, counter: str):
+        if self.metrics is not None:
+            self.metrics.increment(counter)
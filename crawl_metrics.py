@@ -0,0 +1,247 @@
+import bisect
+import json
+import logging
+import threading
+from time import perf_counter
+
+# Upper bounds of the latency histogram buckets, seconds
+LATENCY_BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0,
+                   10.0, 30.0, 60.0)
+
+
+class LatencyHistogram(object):
+    """
+    Count, total, max and bucketed distribution of the latencies of a stage
+    """
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def merge(self, count: int, total: float, maximum: float, buckets: list):
+        self.count += count
+        self.total += total
+        self.max = max(self.max, maximum)
+        for i, bucket_count in enumerate(buckets):
+            self.buckets[i] += bucket_count
+
+    def percentile(self, percent: float) -> float:
+        """
+        :return: upper bound of the bucket the percentile falls into (max for the last bucket)
+        """
+        rank = self.count * percent / 100.0
+        seen = 0
+        for i, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                return min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {'count': self.count,
+                'total_s': round(self.total, 6),
+                'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+                'p50_ms': round(self.percentile(50) * 1000, 3),
+                'p90_ms': round(self.percentile(90) * 1000, 3),
+                'p99_ms': round(self.percentile(99) * 1000, 3),
+                'max_ms': round(self.max * 1000, 3)}
+
+
+class _StageTimer(object):
+    __slots__ = ('_metrics', '_stage', '_started')
+
+    def __init__(self, metrics, stage: str):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._metrics.record(self._stage, perf_counter() - self._started)
+        return False
+
+
+class _NoTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_no_timer = _NoTimer()
+
+
+class CrawlMetrics(object):
+    """
+    Latency histograms of the crawl stages (fetch, parse, XPath, field rules, image downloads, export, sleep...),
+    counters (pages, bytes...) and hit/miss counts of the selectors. Thread-safe.
+    A progress line is logged every `progress_interval` seconds by log_progress(), to_dict() is the final dump.
+    Metrics of worker processes are sent to the coordinating process with drain() and merge().
+    """
+
+    def __init__(self, **kvargs):
+        """
+        :param kvargs: enabled (False - nothing is recorded), progress_interval (seconds, 0 - no progress lines),
+                       file_name (JSON file written by dump())
+        """
+        self.enabled = kvargs.get('enabled', True)
+        self.progress_interval = kvargs.get('progress_interval', 30)
+        self.file_name = kvargs.get('file_name')
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        """Clears the metrics and restarts the clock of the crawl"""
+        with self._lock:
+            self.stages = dict()
+            self.counters = dict()
+            self.selectors = dict()
+            self._started = perf_counter()
+            self._last_progress = self._started
+            self._finished = None
+
+    def finish(self):
+        """Stops the clock of the crawl, pages/sec are computed up to this moment"""
+        self._finished = perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return (self._finished or perf_counter()) - self._started
+
+    def timer(self, stage: str):
+        """
+        Context manager recording the time spent in the block to the stage histogram
+        """
+        return _StageTimer(self, stage) if self.enabled else _no_timer
+
+    def timed(self, stage: str, function):
+        """
+        :return: the function wrapped to record its calls to the stage histogram
+        """
+        if not self.enabled:
+            return function
+
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, perf_counter() - started)
+
+        return wrapper
+
+    def record(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def increment(self, counter: str, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def selector_hit(self, selector: str, hit: bool):
+        if not self.enabled:
+            return
+        with self._lock:
+            counts = self.selectors.get(selector)
+            if counts is None:
+                counts = self.selectors[selector] = [0, 0]
+            counts[0 if hit else 1] += 1
+
+    def drain(self) -> dict:
+        """
+        :return: the metrics recorded since the previous call as a picklable dict for merge(), they are cleared here
+        """
+        with self._lock:
+            snapshot = {'stages': {stage: (h.count, h.total, h.max, h.buckets) for stage, h in self.stages.items()},
+                        'counters': self.counters,
+                        'selectors': self.selectors}
+            self.stages = dict()
+            self.counters = dict()
+            self.selectors = dict()
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        if not self.enabled or not snapshot:
+            return
+        with self._lock:
+            for stage, values in snapshot['stages'].items():
+                histogram = self.stages.get(stage)
+                if histogram is None:
+                    histogram = self.stages[stage] = LatencyHistogram()
+                histogram.merge(*values)
+            for counter, value in snapshot['counters'].items():
+                self.counters[counter] = self.counters.get(counter, 0) + value
+            for selector, (hits, misses) in snapshot['selectors'].items():
+                counts = self.selectors.setdefault(selector, [0, 0])
+                counts[0] += hits
+                counts[1] += misses
+
+    def log_progress(self, pending: int = None, force=False):
+        """
+        Logs the progress line if `progress_interval` has passed since the previous one
+        """
+        if not self.enabled or not (self.progress_interval or force):
+            return
+        now = perf_counter()
+        if not force and now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        logging.info(self.progress_line(pending))
+
+    def progress_line(self, pending: int = None) -> str:
+        with self._lock:
+            pages = self.counters.get('pages', 0)
+            elapsed = self.elapsed
+            slowest = sorted(self.stages.items(), key=lambda item: item[1].total, reverse=True)[:4]
+            misses = sum(counts[1] for counts in self.selectors.values())
+            line = (f'Pages: {pages} ({pages / elapsed if elapsed else 0.0:.2f}/s)'
+                    f'{f", pending: {pending}" if pending is not None else ""}, '
+                    f'fetched: {self.counters.get("bytes", 0) / 1048576:.1f} MB, selector misses: {misses}')
+            if slowest:
+                line += ', time: ' + ', '.join(f'{stage} {h.total:.1f}s' for stage, h in slowest)
+        return line
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            elapsed = self.elapsed
+            pages = self.counters.get('pages', 0)
+            return {'elapsed_s': round(elapsed, 3),
+                    'pages_per_s': round(pages / elapsed, 3) if elapsed else 0.0,
+                    'counters': dict(sorted(self.counters.items())),
+                    'stages': {stage: h.to_dict() for stage, h in sorted(self.stages.items())},
+                    'selectors': {selector: {'hits': hits, 'misses': misses}
+                                  for selector, (hits, misses) in sorted(self.selectors.items())}}
+
+    def dump(self):
+        """
+        Logs the metrics as JSON and writes them to `file_name` if it is set
+        """
+        if not self.enabled:
+            return
+        metrics = self.to_dict()
+        logging.info(f'Crawl metrics: {json.dumps(metrics)}')
+        if self.file_name:
+            with open(self.file_name, 'w') as f:
+                json.dump(metrics, f, indent=2)
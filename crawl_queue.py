@@ -0,0 +1,435 @@
+import abc
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from abc_crawl_storage import LinkRecord
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS t_links_work (
+    record_id INTEGER PRIMARY KEY,
+    link_key TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    url_type_id INTEGER NOT NULL,
+    depth INTEGER NOT NULL DEFAULT 0,
+    state INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_links_work_state ON t_links_work (state, record_id);
+CREATE TABLE IF NOT EXISTS t_results_work (
+    result_id INTEGER PRIMARY KEY,
+    record_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    url_type_id INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    result TEXT,
+    error TEXT,
+    metrics TEXT
+);
+CREATE TABLE IF NOT EXISTS t_queue_settings (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class LinkStates:
+    PENDING = 0
+    LEASED = 1
+    DONE = 2
+    FAILED = 3
+
+
+class PageResult(object):
+    """
+    What a worker sends back for a leased link: the extraction result, the error and its CrawlMetrics.drain()
+    """
+    __slots__ = ('link', 'result', 'error', 'metrics')
+
+    def __init__(self, link: LinkRecord, result, error: str = None, metrics: dict = None):
+        self.link = link
+        self.result = result
+        self.error = error
+        self.metrics = metrics
+
+
+class ABCCrawlQueue(abc.ABC):
+    """
+    Links and results exchanged by the coordinator and the workers of a distributed crawl.
+    The coordinator pushes links from its frontier, workers lease them and complete the leased links with their
+    results (the links found on a catalogue page included), the coordinator collects the results.
+    A link whose lease expires (its worker died) is leased again, up to `max_attempts` times. A result of a lease
+    which has been lost is dropped.
+    The coordinator sets the state of its run: "seeding" when it starts, "running" once the crawl is seeded,
+    "finished" when everything is collected. The run id tells the state of a crawl from that of the previous one.
+    """
+
+    def __init__(self, **kvargs):
+        """
+        :param kvargs: max_attempts
+        """
+        self.max_attempts = kvargs.get('max_attempts', 3)
+
+    def close(self):
+        pass
+
+    @abc.abstractmethod
+    def clear(self):
+        """Removes the links, results and state of the previous crawl"""
+        pass
+
+    @abc.abstractmethod
+    def get_state(self) -> tuple:
+        """
+        :return: state and run id set by the coordinator, (None, None) if there are none
+        """
+        pass
+
+    @abc.abstractmethod
+    def set_state(self, state: str, run_id: str):
+        pass
+
+    @abc.abstractmethod
+    def push_links(self, links: list) -> int:
+        """
+        Queues the links not seen before
+        :param links: (link_key, url, url_type_id, depth) tuples, links with the same key are duplicates
+        :return: number of new links
+        """
+        pass
+
+    @abc.abstractmethod
+    def lease(self, worker_id: str, count: int, lease_timeout: float) -> list:
+        """
+        :return: up to `count` LinkRecords leased to the worker for `lease_timeout` seconds, expired leases first
+        """
+        pass
+
+    @abc.abstractmethod
+    def complete(self, worker_id: str, page_result: PageResult) -> bool:
+        """
+        Marks the leased link as done and queues its result for the coordinator
+        :return: False if the lease has been lost, the result is dropped
+        """
+        pass
+
+    @abc.abstractmethod
+    def collect(self, count: int) -> list:
+        """
+        :return: up to `count` PageResults, they are removed from the queue
+        """
+        pass
+
+    @abc.abstractmethod
+    def counts(self) -> dict:
+        """
+        :return: numbers of pending and leased links and of results not collected yet
+        """
+        pass
+
+    def is_drained(self) -> bool:
+        """
+        :return: True if there is nothing left to lease or collect
+        """
+        return not any(self.counts().values())
+
+
+class SqliteCrawlQueue(ABCCrawlQueue):
+    """
+    Crawl queue in an SQLite file shared by processes on one node or on nodes sharing a file system
+    with working locks. Leases are taken in IMMEDIATE transactions, so that a link goes to one worker only.
+    """
+
+    def __init__(self, **kvargs):
+        """
+        :param kvargs: file_name, max_attempts
+        """
+        self.file_name = kvargs.get('file_name', 'crawl_queue.sqlite')
+        self._lock = threading.RLock()
+        # Autocommit, transactions are opened explicitly
+        self._connection = sqlite3.connect(self.file_name, timeout=60, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(SCHEMA)
+        logging.debug(f'Crawl queue is stored in {self.file_name}')
+
+        super().__init__(**kvargs)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def clear(self):
+        with self._lock, self._transaction():
+            for table in ('t_links_work', 't_results_work', 't_queue_settings'):
+                self._connection.execute(f'DELETE FROM {table}')
+
+    def get_state(self) -> tuple:
+        with self._lock:
+            settings = dict(self._connection.execute(
+                "SELECT name, value FROM t_queue_settings WHERE name IN ('state', 'run_id')").fetchall())
+        return settings.get('state'), settings.get('run_id')
+
+    def set_state(self, state: str, run_id: str):
+        with self._lock, self._transaction():
+            self._connection.executemany('INSERT OR REPLACE INTO t_queue_settings (name, value) VALUES (?, ?)',
+                                         [('state', state), ('run_id', run_id)])
+
+    def push_links(self, links: list) -> int:
+        if not links:
+            return 0
+        with self._lock, self._transaction():
+            cursor = self._connection.executemany(
+                'INSERT OR IGNORE INTO t_links_work (link_key, url, url_type_id, depth) VALUES (?, ?, ?, ?)', links)
+            return cursor.rowcount
+
+    def lease(self, worker_id: str, count: int, lease_timeout: float) -> list:
+        now = time.time()
+        with self._lock, self._transaction():
+            rows = self._connection.execute(
+                'SELECT * FROM t_links_work WHERE state = ? AND lease_expires < ? ORDER BY record_id LIMIT ?',
+                (LinkStates.LEASED, now, count)).fetchall()
+            for row in rows:
+                logging.warning(f'Lease of {row["worker_id"]} on "{row["url"]}" has expired')
+            failed = [row['record_id'] for row in rows if row['attempts'] >= self.max_attempts]
+            if failed:
+                logging.error(f'{len(failed)} links failed {self.max_attempts} times, they are given up')
+                self._connection.executemany('UPDATE t_links_work SET state = ? WHERE record_id = ?',
+                                             [(LinkStates.FAILED, record_id) for record_id in failed])
+            rows = [row for row in rows if row['attempts'] < self.max_attempts]
+            if len(rows) < count:
+                rows += self._connection.execute(
+                    'SELECT * FROM t_links_work WHERE state = ? ORDER BY record_id LIMIT ?',
+                    (LinkStates.PENDING, count - len(rows))).fetchall()
+            self._connection.executemany(
+                'UPDATE t_links_work SET state = ?, worker_id = ?, lease_expires = ?, attempts = attempts + 1 '
+                'WHERE record_id = ?',
+                [(LinkStates.LEASED, worker_id, now + lease_timeout, row['record_id']) for row in rows])
+        return [LinkRecord(row['url'], row['url_type_id'], row['depth'], row['record_id']) for row in rows]
+
+    def complete(self, worker_id: str, page_result: PageResult) -> bool:
+        link = page_result.link
+        with self._lock, self._transaction():
+            cursor = self._connection.execute(
+                'UPDATE t_links_work SET state = ?, lease_expires = NULL '
+                'WHERE record_id = ? AND state = ? AND worker_id = ?',
+                (LinkStates.DONE, link['record_id'], LinkStates.LEASED, worker_id))
+            if not cursor.rowcount:
+                return False
+            self._connection.execute(
+                'INSERT INTO t_results_work (record_id, url, url_type_id, depth, result, error, metrics) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (link['record_id'], link['url'], link['url_type_id'], link['depth'],
+                 json.dumps(page_result.result), page_result.error, json.dumps(page_result.metrics)))
+        return True
+
+    def collect(self, count: int) -> list:
+        with self._lock, self._transaction():
+            rows = self._connection.execute('SELECT * FROM t_results_work ORDER BY result_id LIMIT ?',
+                                            (count,)).fetchall()
+            if rows:
+                self._connection.execute('DELETE FROM t_results_work WHERE result_id <= ?',
+                                         (rows[-1]['result_id'],))
+        return [PageResult(LinkRecord(row['url'], row['url_type_id'], row['depth'], row['record_id']),
+                           json.loads(row['result']), row['error'], json.loads(row['metrics']))
+                for row in rows]
+
+    def counts(self) -> dict:
+        with self._lock:
+            states = dict(self._connection.execute(
+                'SELECT state, COUNT(*) FROM t_links_work WHERE state IN (?, ?) GROUP BY state',
+                (LinkStates.PENDING, LinkStates.LEASED)).fetchall())
+            results = self._connection.execute('SELECT COUNT(*) FROM t_results_work').fetchone()[0]
+        return {'pending': states.get(LinkStates.PENDING, 0),
+                'leased': states.get(LinkStates.LEASED, 0),
+                'results': results}
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._connection)
+
+
+class _ImmediateTransaction(object):
+    __slots__ = ('_connection',)
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __enter__(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        return self._connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        return False
+
+
+class RedisCrawlQueue(ABCCrawlQueue):
+    """
+    Crawl queue in a Redis 6.2+ (or Redis protocol compatible) server for workers on several nodes:
+    <prefix>:seen set of link keys, <prefix>:links hash of the links, <prefix>:pending list of link ids,
+    <prefix>:leases sorted set of link ids by lease expiry, <prefix>:owners hash of the workers holding them,
+    <prefix>:attempts hash of lease counts, <prefix>:results list of results, <prefix>:state hash of the state
+    and the run id.
+    Every change reading the queue first (queueing new links, taking or requeueing leases, completing a lease)
+    is a MULTI/EXEC transaction on the keys it has read (WATCH), so that a link is never leased twice or lost
+    by a worker dying halfway. A transaction whose keys have been changed meanwhile is run again.
+    """
+
+    def __init__(self, **kvargs):
+        """
+        :param kvargs: url (redis://host:port/db), client (redis.Redis compatible client with decode_responses,
+                       used instead of url), prefix, max_attempts
+        """
+        self._client = kvargs.get('client')
+        if self._client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError('The redis package is required for the Redis crawl queue: pip install redis')
+            self._client = redis.Redis.from_url(kvargs.get('url', 'redis://localhost:6379/0'),
+                                                decode_responses=True)
+        self.prefix = kvargs.get('prefix', 'crawl')
+
+        super().__init__(**kvargs)
+
+    def _key(self, name: str) -> str:
+        return f'{self.prefix}:{name}'
+
+    def clear(self):
+        self._client.delete(*[self._key(name) for name in
+                              ('seen', 'links', 'pending', 'leases', 'owners', 'attempts', 'results', 'next_id',
+                               'state')])
+
+    def get_state(self) -> tuple:
+        state, run_id = self._client.hmget(self._key('state'), ['state', 'run_id'])
+        return state, run_id
+
+    def set_state(self, state: str, run_id: str):
+        self._client.hset(self._key('state'), mapping={'state': state, 'run_id': run_id})
+
+    def push_links(self, links: list) -> int:
+        # Duplicates within the batch are dropped here, the links seen before in the transaction
+        unique_links = dict()
+        for link in links:
+            unique_links.setdefault(link[0], link)
+        if not unique_links:
+            return 0
+
+        def push(pipe) -> int:
+            seen = pipe.smismember(self._key('seen'), list(unique_links))
+            new_links = [link for link, is_seen in zip(unique_links.values(), seen) if not is_seen]
+            if not new_links:
+                return 0
+            last_id = int(pipe.get(self._key('next_id')) or 0)
+            record_ids = range(last_id + 1, last_id + len(new_links) + 1)
+            pipe.multi()
+            pipe.sadd(self._key('seen'), *[link[0] for link in new_links])
+            pipe.set(self._key('next_id'), record_ids[-1])
+            pipe.hset(self._key('links'), mapping={record_id: json.dumps([url, url_type_id, depth])
+                                                   for record_id, (_, url, url_type_id, depth)
+                                                   in zip(record_ids, new_links)})
+            pipe.rpush(self._key('pending'), *record_ids)
+            return len(new_links)
+
+        return self._client.transaction(push, self._key('seen'), self._key('next_id'), value_from_callable=True)
+
+    def lease(self, worker_id: str, count: int, lease_timeout: float) -> list:
+        now = time.time()
+        self._requeue_expired(now)
+
+        def take(pipe) -> list:
+            record_ids = pipe.lrange(self._key('pending'), 0, count - 1)
+            if not record_ids:
+                return []
+            values = pipe.hmget(self._key('links'), record_ids)
+            pipe.multi()
+            pipe.ltrim(self._key('pending'), len(record_ids), -1)
+            pipe.hset(self._key('owners'), mapping={record_id: worker_id for record_id in record_ids})
+            pipe.zadd(self._key('leases'), {record_id: now + lease_timeout for record_id in record_ids})
+            for record_id in record_ids:
+                pipe.hincrby(self._key('attempts'), record_id, 1)
+            return list(zip(record_ids, values))
+
+        links = list()
+        for record_id, value in self._client.transaction(take, self._key('pending'), value_from_callable=True):
+            url, url_type_id, depth = json.loads(value)
+            links.append(LinkRecord(url, url_type_id, depth, int(record_id)))
+        return links
+
+    def _requeue_expired(self, now: float):
+        """
+        Puts the links of the expired leases back to the pending ones, those leased `max_attempts` times are given up
+        """
+
+        def requeue(pipe) -> list:
+            record_ids = pipe.zrangebyscore(self._key('leases'), '-inf', now)
+            if not record_ids:
+                return []
+            owners = pipe.hmget(self._key('owners'), record_ids)
+            attempts = [int(value or 0) for value in pipe.hmget(self._key('attempts'), record_ids)]
+            pipe.multi()
+            pipe.zrem(self._key('leases'), *record_ids)
+            pipe.hdel(self._key('owners'), *record_ids)
+            retried = [record_id for record_id, attempt in zip(record_ids, attempts) if attempt < self.max_attempts]
+            if retried:
+                pipe.rpush(self._key('pending'), *retried)
+            return list(zip(record_ids, owners, attempts))
+
+        for record_id, owner, attempts in self._client.transaction(requeue, self._key('leases'),
+                                                                   value_from_callable=True):
+            logging.warning(f'Lease of {owner} on link {record_id} has expired')
+            if attempts >= self.max_attempts:
+                logging.error(f'Link {record_id} failed {self.max_attempts} times, it is given up')
+
+    def complete(self, worker_id: str, page_result: PageResult) -> bool:
+        link = page_result.link
+        record_id = link['record_id']
+
+        def finish(pipe) -> bool:
+            if pipe.hget(self._key('owners'), record_id) != worker_id or \
+                    pipe.zscore(self._key('leases'), record_id) is None:
+                return False
+            pipe.multi()
+            pipe.zrem(self._key('leases'), record_id)
+            pipe.hdel(self._key('owners'), record_id)
+            pipe.rpush(self._key('results'), json.dumps(
+                [record_id, link['url'], link['url_type_id'], link['depth'], page_result.result, page_result.error,
+                 page_result.metrics]))
+            return True
+
+        return self._client.transaction(finish, self._key('owners'), self._key('leases'), value_from_callable=True)
+
+    def collect(self, count: int) -> list:
+        results = list()
+        while len(results) < count:
+            value = self._client.lpop(self._key('results'))
+            if value is None:
+                break
+            record_id, url, url_type_id, depth, result, error, metrics = json.loads(value)
+            results.append(PageResult(LinkRecord(url, url_type_id, depth, record_id), result, error, metrics))
+        return results
+
+    def counts(self) -> dict:
+        return {'pending': self._client.llen(self._key('pending')),
+                'leased': self._client.zcard(self._key('leases')),
+                'results': self._client.llen(self._key('results'))}
+
+
+def make_crawl_queue(kind: str = 'sqlite', **kvargs) -> ABCCrawlQueue:
+    """
+    :param kind: "sqlite" or "redis"
+    :param kvargs: parameters of the queue class
+    """
+    kind = (kind or 'sqlite').lower()
+    if kind == 'sqlite':
+        return SqliteCrawlQueue(**kvargs)
+    if kind == 'redis':
+        return RedisCrawlQueue(**kvargs)
+    raise ValueError(f'Unknown crawl queue "{kind}", expected one of: sqlite, redis')
@@ -0,0 +1,25 @@
+import csv
+
+from abc_results_writer import ABCResultsWriter
+
+
+class CsvResultsWriter(ABCResultsWriter):
+    """
+    CSV results writer, the file is flushed after every product
+    """
+
+    def __init__(self, file_name: str, additional_fields: list, **kvargs):
+        super().__init__(file_name, additional_fields, **kvargs)
+        self._file = open(file_name, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.columns)
+
+    def write_row(self, values: list):
+        self._writer.writerow(values)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
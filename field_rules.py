@@ -0,0 +1,88 @@
+import re
+
+from lxml import etree, html
+
+from html_sanitizer import HtmlSanitizer, prettify_string
+
+_new_lines_re = re.compile(r'\s*[\r\n]+\s*')
+
+
+def to_string(value) -> str:
+    """
+    :return: markup of an lxml element or bytes (innerHTML read by RequestsLxmlBrowser) as a string
+    """
+    if isinstance(value, etree._Element):
+        return etree.tostring(value, encoding='unicode')
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _no_html(value) -> str:
+    if isinstance(value, etree._Element):
+        return value.text_content()
+    value = to_string(value)
+    if '<' not in value and '&' not in value:
+        return value
+    return html.fragment_fromstring(value, create_parent='div').text_content()
+
+
+def _no_new_lines(value: str) -> str:
+    if '\n' not in value and '\r' not in value:
+        return value
+    return _new_lines_re.sub(' ', value)
+
+
+def _strip(value: str) -> str:
+    return value.strip()
+
+
+class FieldRules(object):
+    """
+    The "rules" string of a configured selector, e.g. "cleanTags noNewLines strip", compiled into a chain of
+    transforms applied to every value read by the selector, in the order of the rules:
+        cleanTags - markup of the element cleaned by HtmlSanitizer (attributes, links, scripts, images removed)
+        noHtml - text content of the markup
+        prettify - entities &amp; &lt; &gt; decoded, trademark signs removed, dashes replaced (prettify_string)
+        noNewLines - line breaks with the surrounding whitespace replaced with a space
+        strip - leading and trailing whitespace removed
+    Values are markup (str or bytes) or an lxml element before cleanTags or noHtml, strings after them.
+    Unknown rules raise ValueError.
+    """
+    __slots__ = ('source', 'names', '_transforms')
+
+    # Rules which read markup, the value is converted to a string before the other ones
+    MARKUP_RULES = frozenset(['cleanTags', 'noHtml'])
+
+    def __init__(self, source: str or None):
+        self.source = source
+        self.names = tuple((source or '').split())
+        transforms = list()
+        for name in self.names:
+            if not transforms and name not in self.MARKUP_RULES:
+                transforms.append(to_string)
+            transforms.append(self._compile_rule(name))
+        self._transforms = tuple(transforms)
+
+    def _compile_rule(self, name: str):
+        if name == 'cleanTags':
+            return HtmlSanitizer()
+        if name == 'noHtml':
+            return _no_html
+        if name == 'prettify':
+            return prettify_string
+        if name == 'noNewLines':
+            return _no_new_lines
+        if name == 'strip':
+            return _strip
+        raise ValueError(f'Unknown rule "{name}" in rules "{self.source}"')
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        for transform in self._transforms:
+            value = transform(value)
+        return value
+
+    def __bool__(self):
+        return bool(self._transforms)
@@ -0,0 +1,241 @@
+import html
+import re
+
+from lxml import etree
+
+_prettify_table = str.maketrans({'™': None, '®': None, '—': '-'})
+
+
+def prettify_string(string: str) -> str:
+    if string is None or not string.strip():
+        return string
+
+    rez = string
+    if '&' in rez:
+        rez = rez.replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>')
+    return rez.translate(_prettify_table)
+
+
+def prettify_description(html_code: str) -> str:
+    if not html_code:
+        return ''
+
+    # Imported here: only markup HtmlSanitizer can't handle comes here
+    import htmlmin
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html_code, "html.parser")
+    # Removing all attributes
+    for e in soup.find_all(True):
+        e.attrs = {}
+
+    # Removing unwanted tags but saving their content
+    invalid_tags = ['strong', 'a', 'style']
+    for tag in invalid_tags:
+        for match in soup.findAll(tag):
+            match.replaceWithChildren()
+
+    # Removing unwanted tags with their content
+    invalid_tags = ['script', 'img']
+    for tag in invalid_tags:
+        for match in soup.findAll(tag):
+            match.replaceWith('')
+
+    # Removing empty tags
+    for tag in soup.find_all():
+        if len(tag.text) == 0:
+            tag.extract()
+
+    rez = soup.prettify()
+    rez = prettify_string(htmlmin.minify(rez, remove_comments=True, remove_empty_space=True))
+    return rez
+
+
+# The same as in prettify_description, <style> is in LEGACY_TAGS
+UNWRAP_TAGS = frozenset(['strong', 'a'])
+DROP_TAGS = frozenset(['script', 'img'])
+# Void elements of the HTML tree builder of BeautifulSoup, they never have content
+VOID_TAGS = frozenset(['area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed', 'frame', 'hr', 'image',
+                       'img', 'input', 'isindex', 'keygen', 'link', 'menuitem', 'meta', 'nextid', 'param', 'source',
+                       'spacer', 'track', 'wbr'])
+# Tags whose content BeautifulSoup, html.parser or htmlmin treat in a special (and version dependent) way:
+# whitespace preserving, raw text or strings which don't count as text. Such markup goes to prettify_description.
+LEGACY_TAGS = frozenset(['pre', 'textarea', 'title', 'head', 'style', 'template', 'rt', 'rp', 'xmp', 'plaintext',
+                         'iframe', 'noembed', 'noframes', 'noscript'])
+
+_TEXT, _START, _END, _COMMENT = range(4)
+
+_whitespace_re = re.compile(r'\s+')
+_c1_controls_re = re.compile('[\x80-\x9f]')
+_conditional_comment_re = re.compile(r'^\[if\s')
+_markup_chars_re = re.compile(r'([&<>])')
+_entities = {'&': '&amp;', '<': '&lt;', '>': '&gt;'}
+_comment_re = re.compile(r'(<!--.*?-->)', re.S)
+_void_tag_re = re.compile(r'<(%s)((?:\s(?:[^>"\']|"[^"]*"|\'[^\']*\')*?)?)\s*/?>' % '|'.join(VOID_TAGS), re.I)
+_not_supported_markup_re = re.compile(r'<!(?!--)|<\?')
+_xml_parser = etree.XMLParser(resolve_entities=False, no_network=True, strip_cdata=False, huge_tree=True)
+
+
+def _reopens_void_tags(html_code: str) -> bool:
+    """
+    :return: True if <br/> follows <br> (or another void element): html.parser of BeautifulSoup 4.6 takes the end of
+             <br/> for the missing end of the earlier <br> and leaves <br/> open around the content after it
+    """
+    opened = set()
+    for part in _comment_re.split(html_code)[::2]:
+        for match in _void_tag_re.finditer(part):
+            name = match.group(1).lower()
+            if not match.group(0).endswith('/>'):
+                opened.add(name)
+            elif name in opened:
+                return True
+    return False
+
+
+class _LegacyMarkup(Exception):
+    """The markup can't be guaranteed to give the same result as prettify_description"""
+
+
+class HtmlSanitizer(object):
+    """
+    Single-pass equivalent of prettify_description: the markup is parsed once with lxml and cleaned while it is
+    written out, the output is the same as BeautifulSoup prettify() followed by htmlmin and prettify_string.
+    Accepts an lxml element, markup serialized by lxml (RequestsLxmlBrowser) or innerHTML of a browser.
+    Markup which BeautifulSoup could read differently from lxml goes to prettify_description.
+    """
+
+    def __init__(self):
+        self.legacy_calls = 0
+
+    def __call__(self, html_code) -> str:
+        if isinstance(html_code, etree._Element):
+            html_code = etree.tostring(html_code, pretty_print=True)
+        if not html_code:
+            return ''
+
+        try:
+            root = self._parse(html_code)
+            ops = list()
+            self._clean(root, ops)
+            return prettify_string(self._minify(ops))
+        except _LegacyMarkup:
+            self.legacy_calls += 1
+            return prettify_description(html_code)
+
+    @staticmethod
+    def _parse(html_code) -> etree._Element:
+        if isinstance(html_code, bytes):
+            if not html_code.isascii():
+                # BeautifulSoup guesses the encoding
+                raise _LegacyMarkup()
+            html_code = html_code.decode('ascii')
+        if _not_supported_markup_re.search(html_code) or ('/>' in html_code and _reopens_void_tags(html_code)):
+            raise _LegacyMarkup()
+
+        try:
+            return etree.fromstring(f'<root>{html_code}</root>', _xml_parser)
+        except etree.XMLSyntaxError:
+            pass
+
+        # Browser serialization: unclosed void elements and &nbsp; are the only things XML does not accept
+        parts = _comment_re.split(html_code)
+        for i in range(0, len(parts), 2):
+            parts[i] = _void_tag_re.sub(lambda m: f'<{m.group(1)}{m.group(2)}/>', parts[i]).replace('&nbsp;',
+                                                                                                     '&#160;')
+        try:
+            return etree.fromstring(f'<root>{"".join(parts)}</root>', _xml_parser)
+        except etree.XMLSyntaxError:
+            raise _LegacyMarkup()
+
+    def _clean(self, element, ops: list) -> bool:
+        """
+        Appends the cleaned content of the element to ops, removing tags without text
+        :return: True if the content has text
+        """
+        has_text = False
+        if element.text:
+            ops.append((_TEXT, element.text))
+            has_text = True
+
+        for child in element:
+            tag = child.tag
+            if tag is etree.Comment:
+                ops.append((_COMMENT, child.text or ''))
+            elif not isinstance(tag, str) or '}' in tag:
+                raise _LegacyMarkup()
+            else:
+                name = tag.lower()
+                if name in LEGACY_TAGS or (name in VOID_TAGS and (child.text or len(child))):
+                    raise _LegacyMarkup()
+                if name in DROP_TAGS:
+                    if len(child):
+                        # html.parser reads the content of <script> as text
+                        raise _LegacyMarkup()
+                elif name in UNWRAP_TAGS:
+                    has_text = self._clean(child, ops) or has_text
+                else:
+                    start = len(ops)
+                    ops.append((_START, name))
+                    if self._clean(child, ops):
+                        ops.append((_END, name))
+                        has_text = True
+                    else:
+                        del ops[start:]
+
+            if child.tail:
+                ops.append((_TEXT, child.tail))
+                has_text = True
+
+        return has_text
+
+    @staticmethod
+    def _minify(ops: list) -> str:
+        """
+        Writes the cleaned content the way BeautifulSoup prettify() does (every tag, string and comment on its own
+        line, strings stripped, &<> escaped) and minifies it the way htmlmin.minify(remove_comments=True,
+        remove_empty_space=True) does, without building the intermediate string
+        """
+        out = list()
+        data = list()
+
+        def flush():
+            if not data:
+                return
+            chunk = ''.join(data)
+            data.clear()
+            if chunk.isspace() and ('\n' in chunk or '\r' in chunk):
+                return
+            chunk = _whitespace_re.sub(' ', chunk)
+            if chunk[0] == ' ' and out and out[-1][-1] == ' ':
+                chunk = chunk[1:]
+                if not chunk:
+                    return
+            out.append(chunk)
+
+        for kind, value in ops:
+            if kind == _TEXT:
+                value = value.strip()
+                if not value:
+                    continue
+                if _c1_controls_re.search(value):
+                    # BeautifulSoup reads such character references as windows-1252
+                    raise _LegacyMarkup()
+                for part in _markup_chars_re.split(value):
+                    if part in _entities:
+                        flush()
+                        out.append(_entities[part])
+                    elif part:
+                        data.append(part)
+            elif kind == _START:
+                flush()
+                out.append(f'<{html.escape(value)}>')
+            elif kind == _END:
+                flush()
+                out.append(f'</{html.escape(value)}>')
+            else:
+                flush()
+                if value and (value[0] == '!' or _conditional_comment_re.match(value)):
+                    out.append(f'<!--{value[1:] if value[0] == "!" else value}-->')
+            data.append('\n')
+        flush()
+        return ''.join(out)
@@ -0,0 +1,64 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+
+
+class HttpClient(object):
+    """
+    HTTP session shared by page and image downloads: keep-alive connection pool, compressed responses
+    (brotli when the brotli package is installed), timeouts and retries with exponential backoff.
+    Connection errors are always retried. 429 and 5xx responses are retried honouring Retry-After unless
+    get() is called with status_retries=False, the last response is returned if all retries fail.
+    Thread-safe for GET requests.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, **kvargs):
+        """
+        :param kvargs: pool_size, timeout, connect_timeout, retries, backoff_factor, user_agent
+        """
+        self.timeout = (kvargs.get('connect_timeout', 10), kvargs.get('timeout', 30))
+        pool_size = kvargs.get('pool_size', 10)
+        retries = kvargs.get('retries', 3)
+        backoff_factor = kvargs.get('backoff_factor', 0.5)
+        status_retry = Retry(total=retries,
+                             backoff_factor=backoff_factor,
+                             status_forcelist=self.RETRY_STATUSES,
+                             allowed_methods=frozenset(['GET', 'HEAD']),
+                             respect_retry_after_header=True,
+                             raise_on_status=False)
+        connection_retry = Retry(total=retries,
+                                 backoff_factor=backoff_factor,
+                                 status=0,
+                                 allowed_methods=frozenset(['GET', 'HEAD']),
+                                 respect_retry_after_header=False,
+                                 raise_on_status=False)
+
+        # Two sessions with their own pools: the retries are a property of the connection adapter
+        self.session = self._make_session(HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                                      max_retries=status_retry), kvargs.get('user_agent'))
+        self._connection_retry_session = self._make_session(
+            HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=connection_retry),
+            kvargs.get('user_agent'))
+
+    @staticmethod
+    def _make_session(adapter: HTTPAdapter, user_agent: str = None) -> requests.Session:
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = make_headers(accept_encoding=True)['accept-encoding']
+        if user_agent:
+            session.headers['User-Agent'] = user_agent
+        return session
+
+    def get(self, url: str, headers: dict = None, stream=False, status_retries=True) -> requests.Response:
+        """
+        :param status_retries: retry 429 and 5xx responses, False when the caller retries them itself
+                               (e.g. HostLimiter.call, so that the per-host limits see every response)
+        """
+        session = self.session if status_retries else self._connection_retry_session
+        return session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+
+    def close(self):
+        self.session.close()
+        self._connection_retry_session.close()
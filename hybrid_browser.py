@@ -0,0 +1,103 @@
+import logging
+import re
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from abc_browser import ABCBrowser
+from requests_lxml_browser import RequestsLxmlBrowser
+
+
+def url_pattern(url: str) -> str:
+    """
+    Generalizes the URL to the pattern shared by similar pages: host + directory part of the path with digits masked
+    """
+    parsed = urlparse(url)
+    directory = parsed.path.rsplit('/', 1)[0]
+    return f"{parsed.netloc}{re.sub(r'[0-9]+', '#', directory)}/"
+
+
+class HybridBrowser(ABCBrowser):
+    """
+    Opens pages with RequestsLxmlBrowser and escalates to SeleniumChromeBrowser only when required selectors
+    hit nothing in the plain HTML. A URL pattern is opened with Chrome straight away once `escalate_after` of its
+    pages missed the selectors in the plain HTML and hit them in Chrome: a single broken page, which Chrome does not
+    fix either, does not send its siblings to Chrome.
+    """
+    _chrome_browser = None
+
+    def __init__(self, **kvargs):
+        """
+        :param kvargs: http_client, no_session, chrome (dict of SeleniumChromeBrowser parameters), escalated_patterns,
+                       escalate_after (pages of a URL pattern which needed Chrome before the pattern is escalated)
+        """
+        self._lxml_browser = RequestsLxmlBrowser(**kvargs)
+        self._chrome_kvargs = kvargs.get('chrome', {})
+        self._active_browser = self._lxml_browser
+        self.escalated_patterns = set(kvargs.get('escalated_patterns', []))
+        self.escalate_after = max(1, kvargs.get('escalate_after', 3))
+        # Pages per URL pattern which missed the required selectors in the plain HTML and hit them in Chrome
+        self._chrome_needed = defaultdict(int)
+        self.pages_escalated = 0
+
+        super().__init__(**kvargs)
+
+    def get(self, url, required_xpaths=()):
+        """
+        :param required_xpaths: XPaths which must all hit something for the plain HTML page to be good enough
+        """
+        self._current_url = url
+        pattern = url_pattern(url)
+        if pattern in self.escalated_patterns:
+            self.pages_escalated += 1
+            self._active_browser = self._get_chrome_browser()
+            return self._active_browser.get(url)
+
+        status = self._lxml_browser.get(url)
+        if status != 200 or all(self._lxml_browser.find_elements_by_xpath(xpath) for xpath in required_xpaths):
+            self._active_browser = self._lxml_browser
+            return status
+
+        self.pages_escalated += 1
+        self._active_browser = self._get_chrome_browser()
+        status = self._active_browser.get(url)
+        if not all(self._active_browser.find_elements_by_xpath(xpath) for xpath in required_xpaths):
+            logging.debug(f'Required selectors hit nothing in Chrome either: {url}')
+            return status
+
+        self._chrome_needed[pattern] += 1
+        if self._chrome_needed[pattern] >= self.escalate_after:
+            logging.debug(f'Required selectors hit only in Chrome on {self._chrome_needed[pattern]} pages, '
+                          f'URLs like "{pattern}" will be opened with Chrome')
+            self.escalated_patterns.add(pattern)
+        return status
+
+    def get_page_info(self) -> dict or None:
+        """
+        :return: RequestsLxmlBrowser.get_page_info() of the current page, None if it has been opened with Chrome
+        """
+        return self._lxml_browser.get_page_info() if self._active_browser is self._lxml_browser else None
+
+    def find_elements_by_xpath(self, xpath, web_element=None):
+        return self._active_browser.find_elements_by_xpath(xpath, web_element)
+
+    def get_element_attribute(self, element, attribute):
+        return self._active_browser.get_element_attribute(element, attribute)
+
+    def get_current_page_as_element(self):
+        return self._active_browser.get_current_page_as_element()
+
+    def scroll_to_element(self, element):
+        return self._active_browser.scroll_to_element(element)
+
+    def extract_fields(self, batch):
+        return self._active_browser.extract_fields(batch)
+
+    def read_structured_product(self) -> dict or None:
+        return self._active_browser.read_structured_product()
+
+    def _get_chrome_browser(self):
+        # Chrome (and selenium) is loaded only when the first page needs it
+        if self._chrome_browser is None:
+            from selenium_chrome_browser import SeleniumChromeBrowser
+            self._chrome_browser = SeleniumChromeBrowser(**self._chrome_kvargs)
+        return self._chrome_browser
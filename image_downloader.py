@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from os.path import basename
+from urllib.parse import urlparse
+
+from crawl_metrics import CrawlMetrics
+from http_client import HttpClient
+
+CHUNK_SIZE = 256 * 1024
+
+
+class ImageDownloader(object):
+    """
+    Downloads product images to a folder on a thread pool, so that the crawl does not wait for them.
+    Every URL is downloaded once, and files with the same content are stored once.
+    The future of a download returns the file name, or the URL if the download failed.
+    """
+
+    def __init__(self, folder: str, max_workers: int = 4, http_client: HttpClient = None,
+                 metrics: CrawlMetrics = None):
+        """
+        :param folder: existing folder to save the images to
+        :param max_workers: max number of downloads in flight
+        :param http_client: shared HttpClient, a private one is created if None
+        :param metrics: CrawlMetrics getting the "image_download" stage and the "image_bytes" counter
+        """
+        self.folder = folder
+        self._http_client = http_client or HttpClient(pool_size=max_workers)
+        self._metrics = metrics or CrawlMetrics(enabled=False)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='images')
+        self._lock = threading.Lock()
+        self._by_url = dict()
+        self._by_hash = dict()
+        self._file_names = set(os.listdir(folder))
+        self.downloaded = 0
+        self.duplicates = 0
+
+    def submit(self, image_url: str) -> Future:
+        with self._lock:
+            future = self._by_url.get(image_url)
+            if future is None:
+                future = self._by_url[image_url] = self._executor.submit(self._download, image_url)
+            return future
+
+    def close(self):
+        """Waits for the downloads in flight"""
+        self._executor.shutdown(wait=True)
+        logging.info(f'Images downloaded: {self.downloaded}, duplicates skipped: {self.duplicates}')
+
+    def _download(self, image_url: str) -> str:
+        target_filename = self._reserve_file_name(basename(urlparse(image_url).path) or 'image')
+        partial_filename = os.path.join(self.folder, f'.{target_filename}.part')
+        content_hash = hashlib.sha1()
+        try:
+            with self._metrics.timer('image_download'), self._http_client.get(image_url, stream=True) as r:
+                if r.status_code != 200:
+                    logging.error(f"Error {r.status_code} downloading image {image_url}")
+                    self._release_file_name(target_filename)
+                    return image_url
+
+                with open(partial_filename, 'wb') as f:
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        content_hash.update(chunk)
+                        f.write(chunk)
+                        self._metrics.increment('image_bytes', len(chunk))
+
+        except Exception as ex:
+            logging.error(f"Error {ex} downloading image {image_url}")
+            self._release_file_name(target_filename)
+            if os.path.exists(partial_filename):
+                os.remove(partial_filename)
+            return image_url
+
+        with self._lock:
+            existing_filename = self._by_hash.get(content_hash.digest())
+            if existing_filename is None:
+                self._by_hash[content_hash.digest()] = target_filename
+                self.downloaded += 1
+            else:
+                self._file_names.discard(target_filename)
+                self.duplicates += 1
+
+        if existing_filename is not None:
+            logging.debug(f'Image {image_url} is the same as {existing_filename}')
+            os.remove(partial_filename)
+            return existing_filename
+
+        os.replace(partial_filename, os.path.join(self.folder, target_filename))
+        return target_filename
+
+    def _reserve_file_name(self, filename: str) -> str:
+        """Picks a file name not used in the folder yet, adding _1, _2... before the extension"""
+        name, dot, extension = filename.rpartition('.')
+        if not dot:
+            name, extension = filename, ''
+        with self._lock:
+            target_filename = filename
+            i = 1
+            while target_filename in self._file_names:
+                target_filename = f'{name}_{i}{dot}{extension}'
+                i += 1
+            self._file_names.add(target_filename)
+        return target_filename
+
+    def _release_file_name(self, filename: str):
+        with self._lock:
+            self._file_names.discard(filename)
@@ -0,0 +1,24 @@
+import json
+
+from abc_results_writer import ABCResultsWriter
+
+
+class JsonLinesResultsWriter(ABCResultsWriter):
+    """
+    JSON Lines results writer: one JSON object per row, the file is flushed after every product
+    """
+
+    def __init__(self, file_name: str, additional_fields: list, **kvargs):
+        super().__init__(file_name, additional_fields, **kvargs)
+        self._file = open(file_name, 'w', encoding='utf-8')
+
+    def write_row(self, values: list):
+        self._file.write(json.dumps(dict(zip(self.columns, values)), ensure_ascii=False, default=str))
+        self._file.write('\n')
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
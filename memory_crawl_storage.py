@@ -0,0 +1,160 @@
+import threading
+from array import array
+from datetime import datetime
+
+from abc_crawl_storage import ABCCrawlStorage, LinkRecord
+from url_dedup import ExactSet
+
+
+class MemoryCrawlStorage(ABCCrawlStorage):
+    """
+    Keeps the crawl state in dicts, nothing survives the process.
+    Links are kept in parallel arrays and deduplicated with a visited set (see url_dedup), so a link costs
+    its URL string and a few bytes. Without a visited set the caller deduplicates the links, e.g. the frontier
+    of Scraper, so that the keys are not kept twice.
+    """
+
+    def __init__(self, **kvargs):
+        """
+        :param kvargs: visited_set_factory (function returning an empty url_dedup visited set, ExactSet by default,
+                       None - every link inserted is new), link_key (function (url, url_type_id) -> key of the
+                       visited set)
+        """
+        self._visited_set_factory = kvargs.get('visited_set_factory', ExactSet)
+        self._link_key = kvargs.get('link_key', lambda url, url_type_id: f'{url_type_id} {url}')
+        self._lock = threading.RLock()
+        self.t_pages_cache = dict()
+        self._crawl_id = 0
+        self.clear()
+        super().__init__(**kvargs)
+
+    def clear(self):
+        with self._lock:
+            self.t_links_work_url = list()
+            self.t_links_work_url_type_id = array('b')
+            self.t_links_work_depth = array('i')
+            # -1 - no parent
+            self.t_links_work_parent_id = array('i')
+            # POSIX timestamps, 0 - not retrieved
+            self.t_links_work_retrieved = array('d')
+            self.t_links_work_pk = self._visited_set_factory() if self._visited_set_factory is not None else None
+
+            self.t_products_work = dict()
+            self.t_products_work_pk = dict()
+
+            self.t_product_variants_work = dict()
+            self.t_product_variants_work_pk = set()
+            self.t_product_variants_work_by_product = dict()
+
+            self.t_product_variant_images_work = dict()
+            self.t_product_variant_images_work_pk = set()
+            self.t_product_variant_images_work_by_variant = dict()
+
+            self._crawl_id += 1
+
+    def insert_link(self, url: str, url_type_id: int, depth: int, parent_id: int = None) -> LinkRecord or None:
+        with self._lock:
+            if self.t_links_work_pk is not None and not self.t_links_work_pk.add(self._link_key(url, url_type_id)):
+                return None
+            record_id = len(self.t_links_work_url)
+            self.t_links_work_url.append(url)
+            self.t_links_work_url_type_id.append(url_type_id)
+            self.t_links_work_depth.append(depth)
+            self.t_links_work_parent_id.append(-1 if parent_id is None else parent_id)
+            self.t_links_work_retrieved.append(0.0)
+            return LinkRecord(url, url_type_id, depth, record_id, parent_id=parent_id)
+
+    def mark_link_retrieved(self, record_id: int, retrieved):
+        self.t_links_work_retrieved[record_id] = retrieved.timestamp()
+
+    def select_links(self):
+        with self._lock:
+            count = len(self.t_links_work_url)
+        for record_id in range(count):
+            retrieved = self.t_links_work_retrieved[record_id]
+            parent_id = self.t_links_work_parent_id[record_id]
+            yield LinkRecord(self.t_links_work_url[record_id], self.t_links_work_url_type_id[record_id],
+                             self.t_links_work_depth[record_id], record_id,
+                             datetime.fromtimestamp(retrieved) if retrieved else None,
+                             parent_id if parent_id >= 0 else None)
+
+    def insert_product(self, name: str, description: str or None, category_1: str or None,
+                       category_2: str or None, category_3: str or None, url: str) -> int or None:
+        with self._lock:
+            if url in self.t_products_work_pk:
+                return None
+            record_id = len(self.t_products_work)
+            self.t_products_work_pk[url] = record_id
+            self.t_products_work[record_id] = {'name': name,
+                                               'description': description,
+                                               'category_1': category_1,
+                                               'category_2': category_2,
+                                               'category_3': category_3,
+                                               'url': url,
+                                               'record_id': record_id}
+            return record_id
+
+    def select_product_id_where_url(self, url: str) -> int or None:
+        return self.t_products_work_pk.get(url)
+
+    def select_products(self):
+        return iter(list(self.t_products_work.values()))
+
+    def insert_variant(self, sku: str, additional: dict, product_record_id: int) -> int or None:
+        with self._lock:
+            if (sku, product_record_id) in self.t_product_variants_work_pk:
+                return None
+            self.t_product_variants_work_pk.add((sku, product_record_id))
+            record_id = len(self.t_product_variants_work)
+            self.t_product_variants_work[record_id] = {'sku': sku,
+                                                       'additional': additional,
+                                                       'product_record_id': product_record_id,
+                                                       'record_id': record_id}
+            self.t_product_variants_work_by_product.setdefault(product_record_id, []).append(record_id)
+            return record_id
+
+    def select_variants_where_product_key(self, product_key: int) -> list:
+        return [self.t_product_variants_work[vk] for vk in self.t_product_variants_work_by_product.get(product_key, [])]
+
+    def insert_image(self, url: str, variant_id: int) -> int or None:
+        with self._lock:
+            if (url, variant_id) in self.t_product_variant_images_work_pk:
+                return None
+            self.t_product_variant_images_work_pk.add((url, variant_id))
+            record_id = len(self.t_product_variant_images_work)
+            self.t_product_variant_images_work[record_id] = {'url': url,
+                                                             'variant_id': variant_id,
+                                                             'record_id': record_id}
+            self.t_product_variant_images_work_by_variant.setdefault(variant_id, []).append(record_id)
+            return record_id
+
+    def update_image_url(self, record_id: int, url: str):
+        with self._lock:
+            image = self.t_product_variant_images_work[record_id]
+            self.t_product_variant_images_work_pk.discard((image['url'], image['variant_id']))
+            self.t_product_variant_images_work_pk.add((url, image['variant_id']))
+            image['url'] = url
+
+    def select_images_where_variant_id(self, variant_id: int) -> list:
+        return [self.t_product_variant_images_work[ik]
+                for ik in self.t_product_variant_images_work_by_variant.get(variant_id, [])]
+
+    def select_page_cache(self, url: str) -> dict or None:
+        return self.t_pages_cache.get(url)
+
+    def save_page_cache(self, url: str, etag: str or None, last_modified: str or None, body_hash: str or None,
+                        result):
+        with self._lock:
+            self.t_pages_cache[url] = {'url': url,
+                                       'etag': etag,
+                                       'last_modified': last_modified,
+                                       'body_hash': body_hash,
+                                       'result': result,
+                                       'crawl_id': self._crawl_id}
+
+    def purge_page_cache(self) -> int:
+        with self._lock:
+            gone = [url for url, page in self.t_pages_cache.items() if page['crawl_id'] != self._crawl_id]
+            for url in gone:
+                del self.t_pages_cache[url]
+            return len(gone)
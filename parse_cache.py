@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+
+class ParsedPage(object):
+    """
+    Parsed tree of a page body and the results extracted from it (by XPath or FieldBatch)
+    """
+    __slots__ = ('tree', 'results')
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.results = dict()
+
+
+class ParseCache(object):
+    """
+    Bounded LRU cache of parsed pages keyed by the hash of the body, so the same page reached via different URLs
+    (a product listed under several categories, session or sorting parameters) is parsed and extracted once.
+    The URL is not part of the key: links are resolved against the URL of the link being scraped, not the tree.
+    Thread-safe, the cached trees must only be read.
+    """
+
+    def __init__(self, max_entries=128, metrics=None):
+        """
+        :param max_entries: max number of parsed pages kept, 0 - nothing is cached
+        :param metrics: CrawlMetrics getting the parse_cache_hits and parse_cache_misses counters
+        """
+        self.max_entries = max_entries
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, body_hash: str) -> ParsedPage or None:
+        if not self.max_entries or body_hash is None:
+            return None
+        with self._lock:
+            page = self._pages.get(body_hash)
+            if page is not None:
+                self._pages.move_to_end(body_hash)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self.metrics is not None:
+            self.metrics.increment('parse_cache_hits' if page is not None else 'parse_cache_misses')
+        return page
+
+    def put(self, body_hash: str, page: ParsedPage):
+        if not self.max_entries or body_hash is None:
+            return
+        with self._lock:
+            self._pages[body_hash] = page
+            self._pages.move_to_end(body_hash)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def __len__(self):
+        return len(self._pages)
@@ -0,0 +1,333 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from sitemap import parse_sitemaps
+
+
+class RobotsTxt(object):
+    """
+    Crawl-delay (or Request-rate) and sitemaps of the hosts from their robots.txt, fetched once per host with the
+    crawl's HttpClient and parsed locally (urllib.robotparser ignores fractional delays).
+    Hosts without a readable robots.txt have no delay and no sitemaps.
+    """
+
+    def __init__(self, http_client, user_agent: str = None):
+        """
+        :param http_client: HttpClient
+        :param user_agent: user agent the rules are looked up for, "*" if empty
+        """
+        self._http_client = http_client
+        self.user_agent = user_agent or '*'
+        self._lock = threading.Lock()
+        self._host_locks = dict()
+        self._robots = dict()
+
+    def crawl_delay(self, url: str) -> float or None:
+        return self._get(url)[0]
+
+    def sitemaps(self, url: str) -> list:
+        """
+        :return: sitemap URLs listed in the robots.txt of the URL's host
+        """
+        return self._get(url)[1]
+
+    def _get(self, url: str) -> tuple:
+        parsed = urlparse(url)
+        origin = f'{parsed.scheme}://{parsed.netloc}'
+        if origin in self._robots:
+            return self._robots[origin]
+
+        with self._lock:
+            host_lock = self._host_locks.setdefault(origin, threading.Lock())
+        with host_lock:
+            if origin not in self._robots:
+                self._robots[origin] = self._fetch(origin)
+        return self._robots[origin]
+
+    def _fetch(self, origin: str) -> tuple:
+        """
+        :return: Crawl-delay and sitemaps of the robots.txt
+        """
+        try:
+            response = self._http_client.get(f'{origin}/robots.txt')
+        except Exception as ex:
+            logging.warning(f'Error fetching {origin}/robots.txt: {ex}')
+            return None, []
+        if response.status_code != 200:
+            return None, []
+
+        delay = parse_crawl_delay(response.text, self.user_agent)
+        if delay:
+            logging.info(f'{origin}/robots.txt asks for {delay:.2f} s between requests')
+        return delay, parse_sitemaps(response.text)
+
+
+class HostLimiter(object):
+    """
+    Per-host politeness limits shared by all fetching threads:
+    a cap on requests in flight and a minimal interval between request starts (at least the robots.txt Crawl-delay).
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_concurrency=0, max_rate=0.0, robots: RobotsTxt = None, metrics=None, retries=3,
+                 backoff_factor=0.5):
+        """
+        :param max_concurrency: max number of requests in flight per host, 0 - unlimited
+        :param max_rate: max number of requests started per second per host, 0 - unlimited
+        :param robots: RobotsTxt honoured by call()
+        :param metrics: CrawlMetrics getting the "politeness_wait" stage and the "retries" counter
+        :param retries: times call() repeats a request answered with 429 or 5xx
+        :param backoff_factor: call() waits backoff_factor * 2 ** (retry - 1) seconds before a retry
+                               unless the response has a Retry-After header
+        """
+        self.max_concurrency = max_concurrency
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.robots = robots
+        self.metrics = metrics
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._condition = threading.Condition()
+        self._in_flight = defaultdict(int)
+        self._next_start = defaultdict(float)
+        # Hosts throttling the crawl get no request before this time, whatever was reserved before
+        self._penalties = defaultdict(float)
+        self._crawl_delays = dict()
+
+    def interval(self, host) -> float:
+        """
+        :return: current interval between request starts for the host, seconds
+        """
+        return max(self.min_interval, self._crawl_delays.get(host) or 0.0)
+
+    def acquire(self, host):
+        with self._condition:
+            while self.max_concurrency and self._in_flight[host] >= self.max_concurrency:
+                self._condition.wait()
+            self._in_flight[host] += 1
+            start = self._reserve(host)
+
+        while True:
+            delay = start - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._condition:
+                if self._penalties[host] <= start:
+                    return
+                # The host has been penalised while waiting, the slot is taken again after the penalty
+                start = self._reserve(host)
+
+    def _reserve(self, host) -> float:
+        """
+        Reserves the start time of a request so that concurrent callers queue up behind each other,
+        called with the condition held
+        """
+        start = max(time.monotonic(), self._next_start[host], self._penalties[host])
+        self._next_start[host] = start + self.interval(host)
+        return start
+
+    def penalise(self, host, delay: float):
+        """
+        Holds the requests to the host for `delay` seconds from now. A burst of throttled responses extends
+        the penalty to the latest of their delays, the delays do not add up.
+        """
+        with self._condition:
+            self._penalties[host] = max(self._penalties[host], time.monotonic() + delay)
+
+    def release(self, host):
+        with self._condition:
+            self._in_flight[host] -= 1
+            self._condition.notify_all()
+
+    def report(self, host, status: int or None, latency: float, retry_after: float = None, error=False):
+        """
+        Feedback on a finished request, used by adaptive limiters
+        :param status: HTTP status, None if unknown
+        :param retry_after: seconds from the Retry-After header
+        :param error: the request failed without a response (timeout, connection error)
+        """
+        pass
+
+    @contextmanager
+    def slot(self, url):
+        host = urlparse(url).netloc
+        self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    def call(self, url: str, request):
+        """
+        Runs the request for the URL within the limits of its host and reports its outcome.
+        A 429 or 5xx response is reported and the request is repeated (up to `retries` times) in a later slot of
+        the host, which is penalised for the Retry-After delay or an exponential backoff meanwhile (see penalise),
+        so the request must not retry them itself (see HttpClient.get(status_retries=False))
+        :param request: function without arguments returning a requests.Response or an HTTP status (or None)
+        :return: what the last attempt of the request returns
+        """
+        host = urlparse(url).netloc
+        if self.robots is not None and host not in self._crawl_delays:
+            self._crawl_delays[host] = self.robots.crawl_delay(url)
+
+        for retry in range(self.retries + 1):
+            result, status, retry_after = self._attempt(host, request)
+            if status not in self.RETRY_STATUSES or retry == self.retries:
+                return result
+
+            if hasattr(result, 'close'):
+                # Gives the connection of a streamed response back to the pool
+                result.close()
+            delay = retry_after if retry_after is not None else self.backoff_factor * 2 ** retry
+            logging.debug(f'Host {host} answered {status} to "{url}", retrying in {delay:.2f} s')
+            if self.metrics is not None:
+                self.metrics.increment('retries')
+            self.penalise(host, delay)
+
+    def _attempt(self, host, request) -> tuple:
+        """
+        Runs the request once in a slot of the host
+        :return: result of the request, its HTTP status (None if unknown) and Retry-After seconds
+        """
+        started = time.monotonic()
+        self.acquire(host)
+        if self.metrics is not None:
+            self.metrics.record('politeness_wait', time.monotonic() - started)
+        try:
+            started = time.monotonic()
+            try:
+                result = request()
+            except Exception:
+                self.report(host, None, time.monotonic() - started, error=True)
+                raise
+            latency = time.monotonic() - started
+
+            status, retry_after = result, None
+            if hasattr(result, 'status_code'):
+                status, retry_after = result.status_code, parse_retry_after(result.headers.get('Retry-After'))
+            status = status if isinstance(status, int) else None
+            self.report(host, status, latency, retry_after)
+            return result, status, retry_after
+        finally:
+            self.release(host)
+
+
+class AdaptiveHostLimiter(HostLimiter):
+    """
+    HostLimiter with a per-host request rate adapted to the responses (additive increase, multiplicative decrease):
+    the rate grows by `rate_increase` after every fast successful response, is multiplied by `backoff` on 429,
+    5xx and failed requests, and by (1 + backoff) / 2 when the latency jumps over `latency_spike` times its
+    moving average. Retry-After pauses the host. The rate stays within min_rate..max_rate and under the
+    robots.txt Crawl-delay.
+    """
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(self, max_concurrency=0, max_rate=10.0, initial_rate=1.0, min_rate=0.1, rate_increase=0.1,
+                 backoff=0.5, latency_spike=3.0, robots: RobotsTxt = None, metrics=None, retries=3,
+                 backoff_factor=0.5):
+        """
+        :param max_rate: max requests per second per host, 0 - unlimited
+        :param initial_rate: requests per second per host to start with
+        :param min_rate: the rate never backs off below it
+        :param rate_increase: requests per second added after every good response
+        :param backoff: rate multiplier on errors and throttling
+        :param latency_spike: latency over this multiple of the average slows the host down
+        """
+        super().__init__(max_concurrency=max_concurrency, max_rate=0.0, robots=robots, metrics=metrics,
+                         retries=retries, backoff_factor=backoff_factor)
+        self.max_rate = max_rate
+        self.initial_rate = min(initial_rate, max_rate) if max_rate else initial_rate
+        self.min_rate = min_rate
+        self.rate_increase = rate_increase
+        self.backoff = backoff
+        self.latency_spike = latency_spike
+        self._rates = dict()
+        self._latencies = dict()
+
+    def rate(self, host) -> float:
+        """
+        :return: current requests per second for the host
+        """
+        return self._rates.get(host, self.initial_rate)
+
+    def interval(self, host) -> float:
+        rate = self.rate(host)
+        return max(1.0 / rate if rate else 0.0, self._crawl_delays.get(host) or 0.0)
+
+    def report(self, host, status: int or None, latency: float, retry_after: float = None, error=False):
+        with self._condition:
+            rate = self.rate(host)
+            average_latency = self._latencies.get(host)
+            if error or status == 429 or (status is not None and status >= 500):
+                rate *= self.backoff
+                logging.debug(f'Host {host} {"failed" if error else f"answered {status}"}, '
+                              f'slowing down to {max(rate, self.min_rate):.2f} requests/s')
+            elif average_latency is not None and latency > self.latency_spike * average_latency:
+                rate *= (1.0 + self.backoff) / 2
+            else:
+                rate += self.rate_increase
+            if self.max_rate:
+                rate = min(rate, self.max_rate)
+            self._rates[host] = max(rate, self.min_rate)
+
+            if not error and status != 429 and (status is None or status < 500):
+                self._latencies[host] = latency if average_latency is None else (
+                        average_latency + self.LATENCY_SMOOTHING * (latency - average_latency))
+            if retry_after:
+                self._penalties[host] = max(self._penalties[host], time.monotonic() + retry_after)
+
+
+def parse_crawl_delay(robots_txt: str, user_agent: str = '*') -> float or None:
+    """
+    :return: Crawl-delay (or the interval of Request-rate, whichever is longer) of the robots.txt group for the
+             user agent, the "*" group is used if no group names the user agent
+    """
+    groups = list()
+    group = None
+    for line in robots_txt.splitlines():
+        key, _, value = line.split('#', 1)[0].partition(':')
+        key, value = key.strip().lower(), value.strip()
+        if key == 'user-agent':
+            if group is None or group['delays']:
+                group = {'agents': set(), 'delays': list()}
+                groups.append(group)
+            group['agents'].add(value.lower())
+        elif group is not None and key in ('crawl-delay', 'request-rate', 'allow', 'disallow'):
+            try:
+                if key == 'crawl-delay':
+                    group['delays'].append(float(value))
+                elif key == 'request-rate':
+                    requests, _, seconds = value.partition('/')
+                    group['delays'].append(float(seconds.strip().rstrip('s') or 1) / float(requests))
+                else:
+                    # Rules end the list of user agents of the group
+                    group['delays'].append(0.0)
+            except (ValueError, ZeroDivisionError):
+                pass
+
+    token = (user_agent or '*').split('/')[0].strip().lower()
+    matching = [g for g in groups if any(agent != '*' and agent in token for agent in g['agents'])] or \
+               [g for g in groups if '*' in g['agents']]
+    delay = max((d for g in matching for d in g['delays']), default=0.0)
+    return delay or None
+
+
+def parse_retry_after(value: str or None) -> float or None:
+    """
+    :return: seconds to wait from a Retry-After header (seconds or HTTP date), None if missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -1,47 +1,137 @@
+import hashlib
 import logging
+from contextlib import nullcontext
 from lxml import html, etree
 import requests
 from lxml.html import HtmlElement
 
 from abc_browser import ABCBrowser
+from http_client import HttpClient
+from parse_cache import ParseCache, ParsedPage
+from structured_data import read_product
+
+
+def is_html(content_type: str or None) -> bool:
+    """
+    :return: False if the Content-Type names something else than (X)HTML or XML, True if it is missing
+    """
+    if not content_type:
+        return True
+    content_type = content_type.split(';', 1)[0].strip().lower()
+    return 'html' in content_type or 'xml' in content_type
+
+
+def copy_result(result):
+    # Callers get their own list, the cached one stays as extracted
+    return list(result) if isinstance(result, list) else result
 
 
 class RequestsLxmlBrowser(ABCBrowser):
-    _session = None
+    """
+    Pages are parsed lazily by the first XPath call, bodies which are not HTML are never parsed.
+    Parsed pages and the results extracted from them are shared through a ParseCache.
+    """
+    _http_client = None
     _parsed_page = None
+    _page_info = None
+    _content = None
 
     def __init__(self, **kvargs):
         """
-        :param kvargs: no_session
+        :param kvargs: http_client (shared HttpClient, a private one is created if missing),
+                       no_session (open a new connection for every page),
+                       parse_cache (shared ParseCache, pages are not cached if missing),
+                       metrics (CrawlMetrics getting the "parse" stage)
         """
-        if kvargs.get('no_session', False):
-            self._session = requests.Session()
+        if not kvargs.get('no_session', False):
+            self._http_client = kvargs.get('http_client') or HttpClient()
+        self.parse_cache = kvargs.get('parse_cache')
+        if self.parse_cache is None:
+            self.parse_cache = ParseCache(max_entries=0)
+        self.metrics = kvargs.get('metrics')
 
         super().__init__(**kvargs)
 
-    def __del__(self):
-        if self._session is not None:
-            self._session.close()
-
     def get(self, url):
-        if self._session is None:
-            resp = requests.get(url)
+        return self.load(url, self.fetch(url))
+
+    def fetch(self, url, headers=None) -> requests.Response:
+        """
+        Downloads the page without changing the current page, so it can be called from several threads.
+        429 and 5xx responses are returned without retries, HostLimiter.call retries them within the host limits
+        :param headers: additional request headers, e.g. If-None-Match / If-Modified-Since
+        """
+        if self._http_client is None:
+            return requests.get(url, headers=headers)
         else:
-            resp = self._session.get(url)
+            return self._http_client.get(url, headers=headers, status_retries=False)
 
+    def load(self, url, resp: requests.Response):
+        """
+        Makes a fetched response the current page, it is parsed when it is searched first
+        """
+        self._current_url = url
+        self._parsed_page = None
+        self._content = None
+        self._page_info = {'status': resp.status_code,
+                           'etag': resp.headers.get('ETag'),
+                           'last_modified': resp.headers.get('Last-Modified'),
+                           'body_hash': hashlib.sha1(resp.content).hexdigest() if resp.status_code == 200 else None,
+                           'bytes': len(resp.content)}
+        if resp.status_code == 304:
+            # Not modified since the validators sent with the request, there is nothing to parse
+            return resp.status_code
         if resp.status_code != 200:
             logging.warning(f'Error {resp.status_code} opening URL "{url}": {resp.text}')
             return resp.status_code
 
-        self._parsed_page = html.fromstring(resp.content)
+        if is_html(resp.headers.get('Content-Type')):
+            self._content = resp.content
+        else:
+            logging.debug(f'Page "{url}" is {resp.headers.get("Content-Type")}, it will not be parsed')
         return 200
 
+    def get_parsed_page(self) -> ParsedPage or None:
+        """
+        :return: the current page parsed (or taken from the parse cache), None if there is no HTML page
+        """
+        if self._parsed_page is None and self._content:
+            body_hash = self._page_info['body_hash']
+            self._parsed_page = self.parse_cache.get(body_hash)
+            if self._parsed_page is None:
+                with self.metrics.timer('parse') if self.metrics is not None else nullcontext():
+                    self._parsed_page = ParsedPage(html.fromstring(self._content))
+                self.parse_cache.put(body_hash, self._parsed_page)
+            self._content = None
+        return self._parsed_page
+
+    def get_page_info(self) -> dict or None:
+        """
+        :return: status, etag, last_modified, body_hash and bytes (body size) of the last loaded response
+        """
+        return self._page_info
+
     def find_elements_by_xpath(self, xpath, web_element=None):
+        """
+        :param xpath: XPath string or precompiled etree.XPath
+        """
         try:
-            if isinstance(web_element, HtmlElement):
-                return web_element.xpath(xpath)
+            page = None
+            if not isinstance(web_element, HtmlElement):
+                page = self.get_parsed_page()
+                if page is None:
+                    return []
+                if xpath in page.results:
+                    return copy_result(page.results[xpath])
+                web_element = page.tree
+            if isinstance(xpath, etree.XPath):
+                elements = xpath(web_element)
             else:
-                return self._parsed_page.xpath(xpath)
+                elements = web_element.xpath(xpath)
+            if page is not None:
+                page.results[xpath] = elements
+                return copy_result(elements)
+            return elements
         except Exception as ex:
             logging.warning(f'{ex}, {xpath}')
             return []
@@ -54,7 +144,28 @@ class RequestsLxmlBrowser(ABCBrowser):
             return element.attrib.get(attribute)
 
     def get_current_page_as_element(self):
-        return self._parsed_page
+        page = self.get_parsed_page()
+        return page.tree if page is not None else None
+
+    def extract_fields(self, batch):
+        """
+        Results are cached with the parsed page, an identical page is not read again
+        """
+        page = self.get_parsed_page()
+        if page is None:
+            return batch.read(self)
+        result = page.results.get(batch)
+        if result is None:
+            result = page.results[batch] = batch.read(self)
+        return result
+
+    def read_structured_product(self) -> dict or None:
+        page = self.get_parsed_page()
+        if page is None:
+            return None
+        if read_product not in page.results:
+            page.results[read_product] = read_product(page.tree)
+        return page.results[read_product]
 
     def scroll_to_element(self, element):
         pass
@@ -0,0 +1,269 @@
+import json
+import re
+
+from lxml import etree
+
+from field_rules import FieldRules
+
+
+class SelectorStep(object):
+    """
+    One alternative of a configured selector: compiled XPath to the elements and what to read from them
+    """
+    __slots__ = ('xpath', 'mode', 'attribute', 'absolute')
+
+    TEXT = 'text'
+    ATTRIBUTE = 'attribute'
+    INNER_HTML = 'innerHTML'
+
+    def __init__(self, xpath: etree.XPath, mode: str, attribute: str or None, absolute: bool):
+        self.xpath = xpath
+        self.mode = mode
+        self.attribute = attribute
+        self.absolute = absolute
+
+
+class Selector(object):
+    """
+    Configured selector like "(//h1/text()|//div[@id='title']/@title)" split into steps tried in order
+    """
+    __slots__ = ('source', 'steps')
+
+    def __init__(self, source: str):
+        self.source = source
+        self.steps = list()
+        if source is None or not source.strip():
+            return
+
+        alternatives = source.split('|')
+        last = len(alternatives) - 1
+        for i, alternative in enumerate(alternatives):
+            if i == 0 and alternative.startswith('('):
+                alternative = alternative[1:]
+            if i == last and not alternative.endswith('()') and alternative.endswith(')'):
+                alternative = alternative[:-1]
+
+            alternative = alternative.replace("\'", '"')
+            absolute = alternative.startswith('//')
+
+            last_step = alternative.split('/')[-1]
+            elements_xpath = alternative[:len(alternative) - len(last_step)].rstrip('/')
+            last_step = last_step.lower()
+            if last_step == 'text()':
+                self.steps.append(SelectorStep(compile_xpath(elements_xpath, source), SelectorStep.TEXT, None,
+                                               absolute))
+            elif last_step.startswith('@'):
+                self.steps.append(SelectorStep(compile_xpath(elements_xpath, source), SelectorStep.ATTRIBUTE,
+                                               last_step.lstrip('@'), absolute))
+            else:
+                self.steps.append(SelectorStep(compile_xpath(alternative, source), SelectorStep.INNER_HTML, None,
+                                               absolute))
+
+    def __bool__(self):
+        return bool(self.steps)
+
+
+class AdditionalField(object):
+    __slots__ = ('name', 'selector', 'rules', 'index', 'index_is_variant')
+
+    def __init__(self, name: str, settings: dict):
+        self.name = name
+        self.selector = Selector(settings['sel'])
+        self.rules = FieldRules(settings.get('rules'))
+        self.index_is_variant = str(settings['index']).lower() == 'variant'
+        self.index = 0 if self.index_is_variant else int(settings['index']) or 0  # TODO: Implement
+
+
+class BatchField(object):
+    """
+    Field read by a FieldBatch, the rules are applied to the value by the caller
+    """
+    __slots__ = ('name', 'label', 'selector', 'rules', 'index', 'index_is_variant', 'warn')
+
+    def __init__(self, name: str, selector: Selector, index=0, index_is_variant=False, warn=True, label=None,
+                 rules: FieldRules = None):
+        self.name = name
+        self.label = label or name
+        self.selector = selector
+        self.rules = rules or FieldRules(None)
+        self.index = index
+        self.index_is_variant = index_is_variant
+        self.warn = warn
+
+
+class FieldBatch(object):
+    """
+    Fields of a page read in one operation: page fields, then variant fields for every element matched by the
+    variants XPath. Variants with an empty key field don't advance the variant index.
+    """
+
+    def __init__(self, fields: list, variants: etree.XPath or None = None, variant_fields: list = (),
+                 variant_key_field: str = None):
+        self.fields = fields
+        self.variants = variants
+        self.variant_fields = list(variant_fields)
+        self.variant_key_field = variant_key_field
+        self._script_arguments = None
+
+    def read(self, browser) -> dict:
+        """
+        Reads the fields one by one with the browser methods
+        :return: {'fields': {name: value}, 'variants': [{name: value}]}, values are not stripped
+        """
+        result = {'fields': {field.name: read_selector(browser, field.selector, None, field.index)
+                             for field in self.fields},
+                  'variants': list()}
+        if self.variants is None:
+            return result
+
+        variant_index = 0
+        for variant in browser.find_elements_by_xpath(self.variants):
+            values = {field.name: read_selector(browser, field.selector, variant,
+                                                variant_index if field.index_is_variant else field.index)
+                      for field in self.variant_fields}
+            result['variants'].append(values)
+            if not is_none_or_empty(values.get(self.variant_key_field)):
+                variant_index += 1
+        return result
+
+    def to_script_arguments(self) -> dict:
+        """
+        JSON-serializable description of the batch for browsers which evaluate it on their side
+        """
+        if self._script_arguments is None:
+            def field_arguments(field):
+                return {'name': field.name,
+                        'index': field.index,
+                        'index_is_variant': field.index_is_variant,
+                        'steps': [{'xpath': step.xpath.path, 'mode': step.mode, 'attribute': step.attribute,
+                                   'absolute': step.absolute} for step in field.selector.steps]}
+
+            self._script_arguments = {
+                'fields': [field_arguments(field) for field in self.fields],
+                'variants': self.variants.path if self.variants is not None else None,
+                'variant_fields': [field_arguments(field) for field in self.variant_fields],
+                'variant_key_field': self.variant_key_field,
+            }
+        return self._script_arguments
+
+
+def is_none_or_empty(string) -> bool:
+    return bool(string is None or not (string.strip()))
+
+
+def read_selector(browser, selector: Selector, parent_web_element=None, element_index=0):
+    """
+    Reads the value of the first selector step which hits something
+    :return: the value (not stripped) or None
+    """
+    result = None
+    for step in selector.steps:
+        parent = parent_web_element
+        if parent is None or step.absolute:
+            parent = browser.get_current_page_as_element()
+
+        element = browser.find_elements_by_xpath(step.xpath, parent)
+        if not len(element):
+            continue
+
+        if step.mode == SelectorStep.TEXT:
+            result = element[element_index].text
+            ind = 1
+            while is_none_or_empty(result) and ind < len(element):
+                result = element[ind].text
+                ind += 1
+                # TODO: add warning
+        elif step.mode == SelectorStep.ATTRIBUTE:
+            result = browser.get_element_attribute(element[element_index], step.attribute)
+        else:
+            result = browser.get_element_attribute(element[element_index], 'innerHTML')
+
+        if result is not None:
+            break
+
+    return result
+
+
+def compile_xpath(xpath: str, source: str = None) -> etree.XPath:
+    try:
+        return etree.XPath(xpath)
+    except etree.XPathSyntaxError as ex:
+        raise ValueError(f'Invalid XPath "{xpath}"{f" in selector {source}" if source else ""}: {ex}')
+
+
+def compile_regex(regex: str) -> re.Pattern:
+    try:
+        return re.compile(regex)
+    except re.error as ex:
+        raise ValueError(f'Invalid regex "{regex}": {ex}')
+
+
+class SelectorPlan(object):
+    """
+    Links and products settings of the scraping config compiled once: XPaths, regexes and the value each
+    selector reads, rules of the fields. Invalid XPaths, regexes and rules raise ValueError here rather than in the
+    middle of a crawl.
+    """
+
+    def __init__(self, config: dict):
+        config_links = config['config_links']
+        # TODO: rename links to catalogues in config?
+        self.catalogue_xpaths = [compile_xpath(xpath.replace('/@href', ''))
+                                 for xpath in config_links['links']['xpaths']]
+        self.catalogue_regexps = [compile_regex(regex) for regex in config_links['links']['regexps']]
+        self.product_xpaths = [compile_xpath(xpath.replace('/@href', ''))
+                               for xpath in config_links['products']['xpaths']]
+        self.product_regexps = [compile_regex(regex) for regex in config_links['products']['regexps']]
+
+        config_products = config['config_products']
+        self.product_fields = {name: Selector(settings['sel'])
+                               for name, settings in config_products['product_selectors'].items()}
+        self.product_rules = {name: FieldRules(settings.get('rules'))
+                              for name, settings in config_products['product_selectors'].items()}
+        variant_settings = config_products['variant_settings']
+        self.variants = compile_xpath(variant_settings['sel'])
+        self.variant_sku = Selector(variant_settings['product_code'])
+        self.variant_rules = FieldRules(variant_settings.get('rules'))
+        if 'image' in variant_settings:
+            self.variant_image = Selector(variant_settings['image'])
+            self.variant_image_rules = self.variant_rules
+        else:
+            self.variant_image = self.product_fields['image_file_name_1']
+            self.variant_image_rules = self.product_rules['image_file_name_1']
+        self.additional_fields = [AdditionalField(name, settings)
+                                  for name, settings in config_products.get('additional_selectors', {}).items()]
+
+        # Everything read from a product page
+        self.product_batch = FieldBatch(
+            fields=[BatchField('name', self.product_fields['name'], rules=self.product_rules['name']),
+                    BatchField('description', self.product_fields['description'],
+                               rules=self.product_rules['description']),
+                    BatchField('category1', self.product_fields['category1'], rules=self.product_rules['category1']),
+                    BatchField('category2', self.product_fields['category2'], warn=False,
+                               rules=self.product_rules['category2']),
+                    BatchField('category3', self.product_fields['category3'], warn=False,
+                               rules=self.product_rules['category3'])],
+            variants=self.variants,
+            variant_fields=[BatchField('sku', self.variant_sku, rules=self.variant_rules),
+                            BatchField('image', self.variant_image, rules=self.variant_image_rules)] +
+                           [BatchField(f'additional.{field.name}', field.selector, field.index,
+                                       field.index_is_variant, warn=False, label=field.name, rules=field.rules)
+                            for field in self.additional_fields],
+            variant_key_field='sku',
+        )
+
+
+# Plans compiled by this process, keyed by the links and products settings
+_plans = dict()
+
+
+def cached_selector_plan(config: dict) -> SelectorPlan:
+    """
+    SelectorPlan of the config compiled once per process: crawls of the same website (e.g. one per category,
+    differing in initial_url only) launched one after another share it
+    """
+    key = json.dumps([config['config_links'], config['config_products']], sort_keys=True)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = SelectorPlan(config)
+    return plan
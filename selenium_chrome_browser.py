@@ -1,8 +1,104 @@
 import logging
 
+from lxml import html
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
 
 from abc_browser import ABCBrowser
+from structured_data import read_product
+
+# URL patterns (Network.setBlockedURLs wildcards) of the resource types which can be blocked
+RESOURCE_TYPE_URLS = {
+    'image': ['*.png', '*.png?*', '*.jpg', '*.jpg?*', '*.jpeg', '*.jpeg?*', '*.gif', '*.gif?*', '*.webp',
+              '*.webp?*', '*.svg', '*.svg?*', '*.ico', '*.ico?*'],
+    'stylesheet': ['*.css', '*.css?*'],
+    'font': ['*.woff', '*.woff?*', '*.woff2', '*.woff2?*', '*.ttf', '*.ttf?*', '*.otf', '*.otf?*', '*.eot',
+             '*.eot?*'],
+    'media': ['*.mp4', '*.mp4?*', '*.webm', '*.webm?*', '*.ogg', '*.ogg?*', '*.mp3', '*.mp3?*', '*.m3u8',
+              '*.m3u8?*', '*.mov', '*.mov?*'],
+}
+PAGE_LOAD_STRATEGIES = ('normal', 'eager', 'none')
+
+# Reads a selector_plan.FieldBatch (see FieldBatch.to_script_arguments) in the page with one WebDriver call
+EXTRACT_FIELDS_SCRIPT = """
+var batch = arguments[0];
+
+function findNodes(xpath, context) {
+    var snapshot = document.evaluate(xpath, context, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    var nodes = [];
+    for (var i = 0; i < snapshot.snapshotLength; i++) {
+        nodes.push(snapshot.snapshotItem(i));
+    }
+    return nodes;
+}
+
+function nodeText(node) {
+    return node.nodeType === Node.ELEMENT_NODE ? node.innerText : node.textContent;
+}
+
+function isEmpty(value) {
+    return value === null || value === undefined || !String(value).trim();
+}
+
+function nodeAttribute(node, name) {
+    // Like WebElement.get_attribute: the property if there is a simple one, the attribute otherwise
+    var value = node[name];
+    if (value === null || value === undefined || typeof value === 'object' || typeof value === 'function') {
+        return node.getAttribute(name);
+    }
+    return String(value);
+}
+
+function readField(field, context, index) {
+    for (var s = 0; s < field.steps.length; s++) {
+        var step = field.steps[s];
+        var nodes = findNodes(step.xpath, context === null || step.absolute ? document : context);
+        if (nodes.length <= index) {
+            continue;
+        }
+
+        var result = null;
+        if (step.mode === 'text') {
+            result = nodeText(nodes[index]);
+            for (var i = 1; isEmpty(result) && i < nodes.length; i++) {
+                result = nodeText(nodes[i]);
+            }
+        } else if (step.mode === 'attribute') {
+            result = nodeAttribute(nodes[index], step.attribute);
+        } else {
+            result = nodes[index].innerHTML;
+        }
+
+        if (result !== null && result !== undefined) {
+            return result;
+        }
+    }
+    return null;
+}
+
+var result = {fields: {}, variants: []};
+batch.fields.forEach(function (field) {
+    result.fields[field.name] = readField(field, null, field.index);
+});
+
+if (batch.variants !== null) {
+    var variantIndex = 0;
+    findNodes(batch.variants, document).forEach(function (variant) {
+        var values = {};
+        batch.variant_fields.forEach(function (field) {
+            values[field.name] = readField(field, variant, field.index_is_variant ? variantIndex : field.index);
+        });
+        result.variants.push(values);
+        if (!isEmpty(values[batch.variant_key_field])) {
+            variantIndex++;
+        }
+    });
+}
+return result;
+"""
 
 
 class SeleniumChromeBrowser(ABCBrowser):
@@ -11,8 +107,25 @@ class SeleniumChromeBrowser(ABCBrowser):
     def __init__(self, **kvargs):
         """
         Initialize ChromeDriver
-        :param kvargs: headless, disable_images, width, height, implicitly_wait
+        :param kvargs: headless, disable_images, width, height,
+                       implicitly_wait (seconds every missing element is waited for, 0 - misses return at once),
+                       page_load_strategy ("normal" - wait for the load event, "eager" - for DOMContentLoaded,
+                       "none" - for nothing), block_resource_types (image, stylesheet, font, media),
+                       block_urls (URL wildcards, e.g. "*google-analytics.com*"),
+                       ready_xpath (element waited for after a page is opened), ready_timeout (seconds)
         """
+        page_load_strategy = kvargs.get('page_load_strategy') or 'normal'
+        if page_load_strategy not in PAGE_LOAD_STRATEGIES:
+            raise ValueError(f'Unknown page load strategy "{page_load_strategy}", '
+                             f'expected one of: {", ".join(PAGE_LOAD_STRATEGIES)}')
+        block_resource_types = list(kvargs.get('block_resource_types') or [])
+        for resource_type in block_resource_types:
+            if resource_type not in RESOURCE_TYPE_URLS:
+                raise ValueError(f'Unknown resource type "{resource_type}", '
+                                 f'expected one of: {", ".join(RESOURCE_TYPE_URLS)}')
+        self.ready_xpath = kvargs.get('ready_xpath') or None
+        self.ready_timeout = kvargs.get('ready_timeout', 10)
+
         # Configuring Chrome
         chrome_options = webdriver.ChromeOptions()
         if kvargs.get('headless', False):
@@ -20,11 +133,17 @@ class SeleniumChromeBrowser(ABCBrowser):
             chrome_options.add_argument('headless')
             chrome_options.add_argument(f'window-size={kvargs.get("width", 1920)}x{kvargs.get("height", 1080)}')
 
-        if kvargs.get('disable_images', False):
+        if kvargs.get('disable_images', False) or 'image' in block_resource_types:
             chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
 
-        self.chromedriver = webdriver.Chrome(chrome_options=chrome_options)
-        self.chromedriver.implicitly_wait(kvargs.get('implicitly_wait', 1))
+        self.chromedriver = webdriver.Chrome(chrome_options=chrome_options,
+                                             desired_capabilities={'pageLoadStrategy': page_load_strategy})
+        self.chromedriver.implicitly_wait(kvargs.get('implicitly_wait', 0))
+
+        blocked_urls = [url for resource_type in block_resource_types for url in RESOURCE_TYPE_URLS[resource_type]]
+        blocked_urls += list(kvargs.get('block_urls') or [])
+        if blocked_urls:
+            self.block_urls(blocked_urls)
 
         # TODO: Stopped working. selenium.common.exceptions.WebDriverException: Message: disconnected: unable to connect to renderer
         # if headless is False:
@@ -38,10 +157,73 @@ class SeleniumChromeBrowser(ABCBrowser):
         if self.chromedriver is not None:
             self.chromedriver.close()
 
+    def quit(self):
+        """
+        Closes all windows and stops the ChromeDriver process
+        """
+        if self.chromedriver is not None:
+            try:
+                self.chromedriver.quit()
+            except Exception as ex:
+                logging.warning(f'Error stopping ChromeDriver: {ex}')
+            self.chromedriver = None
+
     def get(self, url):
-        return self.chromedriver.get(url)
+        result = self.chromedriver.get(url)
+        if self.ready_xpath:
+            self.wait_for(self.ready_xpath, self.ready_timeout)
+        return result
+
+    def wait_for(self, xpath, timeout) -> bool:
+        """
+        Waits until an element matching the XPath is in the page
+        :return: False if it has not appeared within `timeout` seconds
+        """
+        try:
+            WebDriverWait(self.chromedriver, timeout).until(
+                expected_conditions.presence_of_element_located((By.XPATH, xpath)))
+            return True
+        except TimeoutException:
+            logging.debug(f'"{xpath}" has not appeared in {timeout} s: {self.chromedriver.current_url}')
+            return False
+
+    def block_urls(self, urls: list):
+        """
+        Makes Chrome drop the requests to the URLs matching the wildcards (DevTools Network.setBlockedURLs).
+        Nothing is blocked, with a warning, if ChromeDriver does not serve the DevTools protocol (before 73).
+        """
+        execute_cdp = self._get_cdp_executor()
+        if execute_cdp is None:
+            logging.warning(f'Unable to block requests, ChromeDriver 73+ is required, this one is '
+                            f'{chromedriver_version(self.chromedriver.capabilities) or "unknown"}')
+            return
+        try:
+            execute_cdp('Network.enable', {})
+            execute_cdp('Network.setBlockedURLs', {'urls': urls})
+        except WebDriverException as ex:
+            logging.warning(f'Unable to block requests: {ex}')
+
+    def _get_cdp_executor(self):
+        """
+        :return: function (command, params) running a DevTools command, None if ChromeDriver has none
+        """
+        if hasattr(self.chromedriver, 'execute_cdp_cmd'):
+            # Selenium 4+
+            return self.chromedriver.execute_cdp_cmd
+        version = chromedriver_version(self.chromedriver.capabilities)
+        commands = getattr(self.chromedriver.command_executor, '_commands', None)
+        if version is None or version < 73 or not isinstance(commands, dict):
+            return None
+        # Selenium 3 has no command for the DevTools protocol, ChromeDriver 73+ serves it at this endpoint
+        commands.setdefault('executeCdpCommand', ('POST', '/session/$sessionId/goog/cdp/execute'))
+        return lambda command, params: self.chromedriver.execute(
+            'executeCdpCommand', {'cmd': command, 'params': params})
 
     def find_elements_by_xpath(self, xpath, web_element=None):
+        """
+        :param xpath: XPath string or precompiled etree.XPath (its source is used)
+        """
+        xpath = getattr(xpath, 'path', xpath)
         if web_element is None:
             return self.chromedriver.find_elements_by_xpath(xpath)
         else:
@@ -57,3 +239,21 @@ class SeleniumChromeBrowser(ABCBrowser):
 
     def get_current_page_as_element(self):
         return self.chromedriver
+
+    def extract_fields(self, batch):
+        return self.chromedriver.execute_script(EXTRACT_FIELDS_SCRIPT, batch.to_script_arguments())
+
+    def read_structured_product(self) -> dict or None:
+        # The rendered page, JSON-LD may be added by scripts
+        return read_product(html.fromstring(self.chromedriver.page_source))
+
+
+def chromedriver_version(capabilities: dict) -> int or None:
+    """
+    :return: major version of ChromeDriver from the session capabilities, None if they don't tell it
+    """
+    version = (capabilities or {}).get('chrome', {}).get('chromedriverVersion') or ''
+    try:
+        return int(version.split('.', 1)[0])
+    except ValueError:
+        return None
@@ -0,0 +1,172 @@
+import atexit
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from selenium.common.exceptions import WebDriverException
+
+from abc_browser import ABCBrowser
+from selenium_chrome_browser import SeleniumChromeBrowser
+
+
+class SeleniumChromeBrowserPool(ABCBrowser):
+    """
+    Pool of warm headless ChromeDriver instances shared by several worker threads.
+    A worker leases a driver with lease(), the ABCBrowser methods are then forwarded to the driver leased by
+    the calling thread. Drivers are restarted after `recycle_after` pages or after a WebDriverException.
+    """
+    _warm_pools = dict()
+    _warm_pools_lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, **kvargs):
+        """
+        Returns a running pool with the same settings if there is one, so that drivers are reused across crawls
+        :param kvargs: pool_size, recycle_after + SeleniumChromeBrowser parameters
+        """
+        key = tuple(sorted(kvargs.items()))
+        with cls._warm_pools_lock:
+            pool = cls._warm_pools.get(key)
+            if pool is None or pool.is_shut_down or pool.pool_size < 1:
+                pool = cls._warm_pools[key] = cls(**kvargs)
+            return pool
+
+    @classmethod
+    def shutdown_all(cls):
+        with cls._warm_pools_lock:
+            for pool in cls._warm_pools.values():
+                pool.shutdown()
+            cls._warm_pools.clear()
+
+    def __init__(self, **kvargs):
+        """
+        Starts `pool_size` headless ChromeDriver instances
+        :param kvargs: pool_size, recycle_after + SeleniumChromeBrowser parameters
+        """
+        self.pool_size = max(1, int(kvargs.pop('pool_size', 2)))
+        self.recycle_after = int(kvargs.pop('recycle_after', 0))
+        self._browser_kvargs = dict(kvargs, headless=True)
+        # Idle drivers, None once the pool is empty or shut down: it wakes up the waiting workers
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._pages_served = dict()
+        self._local = threading.local()
+        self.is_shut_down = False
+
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            for browser in executor.map(lambda _: self._start_browser(), range(self.pool_size)):
+                self._idle.put(browser)
+
+        logging.debug(f'ChromeDriver pool of {self.pool_size} has been initialized')
+        super().__init__(**kvargs)
+
+    def __del__(self):
+        self.shutdown()
+
+    @contextmanager
+    def lease(self):
+        """
+        Binds an idle driver to the calling thread for the duration of the block.
+        A driver that raised WebDriverException inside the block is replaced with a fresh one.
+        """
+        if self.is_shut_down:
+            raise RuntimeError('ChromeDriver pool has been shut down')
+        if self.pool_size < 1:
+            raise RuntimeError('No ChromeDriver left in the pool')
+
+        browser = self._idle.get()
+        if browser is None:
+            # Passed on to the next waiting worker
+            self._idle.put(None)
+            raise RuntimeError('ChromeDriver pool has been shut down' if self.is_shut_down else
+                               'No ChromeDriver left in the pool, every restart has failed')
+        self._local.browser = browser
+        crashed = False
+        try:
+            yield browser
+        except WebDriverException:
+            crashed = True
+            raise
+        finally:
+            self._local.browser = None
+            self._release(browser, crashed)
+
+    def shutdown(self):
+        if self.is_shut_down:
+            return
+        self.is_shut_down = True
+        while True:
+            try:
+                browser = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if browser is not None:
+                browser.quit()
+        self._pages_served.clear()
+        self._idle.put(None)
+        logging.debug('ChromeDriver pool has been shut down')
+
+    def get(self, url):
+        browser = self._leased_browser()
+        self._pages_served[browser] += 1
+        return browser.get(url)
+
+    def get_current_url(self):
+        return self._leased_browser().get_current_url()
+
+    def find_elements_by_xpath(self, xpath, web_element=None):
+        return self._leased_browser().find_elements_by_xpath(xpath, web_element)
+
+    def get_element_attribute(self, element, attribute):
+        return self._leased_browser().get_element_attribute(element, attribute)
+
+    def get_current_page_as_element(self):
+        return self._leased_browser().get_current_page_as_element()
+
+    def scroll_to_element(self, element):
+        return self._leased_browser().scroll_to_element(element)
+
+    def extract_fields(self, batch):
+        return self._leased_browser().extract_fields(batch)
+
+    def read_structured_product(self) -> dict or None:
+        return self._leased_browser().read_structured_product()
+
+    def _leased_browser(self) -> SeleniumChromeBrowser:
+        browser = getattr(self._local, 'browser', None)
+        if browser is None:
+            raise RuntimeError('No ChromeDriver is leased by the current thread, use lease()')
+        return browser
+
+    def _start_browser(self) -> SeleniumChromeBrowser:
+        browser = SeleniumChromeBrowser(**self._browser_kvargs)
+        self._pages_served[browser] = 0
+        return browser
+
+    def _release(self, browser, crashed):
+        if self.is_shut_down:
+            browser.quit()
+            return
+
+        if crashed or (self.recycle_after and self._pages_served[browser] >= self.recycle_after):
+            logging.debug(f'Recycling ChromeDriver after {self._pages_served[browser]} pages'
+                          f'{" (crashed)" if crashed else ""}')
+            self._pages_served.pop(browser, None)
+            browser.quit()
+            try:
+                browser = self._start_browser()
+            except WebDriverException as ex:
+                with self._lock:
+                    self.pool_size -= 1
+                    pool_size = self.pool_size
+                logging.error(f'Unable to restart ChromeDriver, the pool shrinks to {pool_size}: {ex}')
+                if not pool_size:
+                    self._idle.put(None)
+                return
+
+        self._idle.put(browser)
+
+
+atexit.register(SeleniumChromeBrowserPool.shutdown_all)
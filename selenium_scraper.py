@@ -1,65 +1,44 @@
+import argparse
+import copy
+import hashlib
 import json
 import logging
-import re
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
 from datetime import datetime
-from os.path import basename
-from time import sleep
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin
 
-import htmlmin
 import os
 
-import requests
-import xlsxwriter as xlsxwriter
-from bs4 import BeautifulSoup
-from selenium.common.exceptions import WebDriverException
-
+from abc_results_writer import ABCResultsWriter
+from concurrent_fetcher import ConcurrentFetcher
+from crawl_budget import CrawlBudget
+from crawl_metrics import CrawlMetrics
+from crawl_queue import ABCCrawlQueue, PageResult, make_crawl_queue
+from csv_results_writer import CsvResultsWriter
+from field_rules import to_string
+from http_client import HttpClient
+from hybrid_browser import HybridBrowser
+from image_downloader import ImageDownloader
+from jsonl_results_writer import JsonLinesResultsWriter
+from memory_crawl_storage import MemoryCrawlStorage
+from parse_cache import ParseCache
+from politeness import AdaptiveHostLimiter, HostLimiter, RobotsTxt
 from requests_lxml_browser import RequestsLxmlBrowser
-from selenium_chrome_browser import SeleniumChromeBrowser
-
-
-def is_none_or_empty(string: str) -> bool:
-    return bool(string is None or not (string.strip()))
-
-
-def prettify_string(string: str) -> str:
-    if is_none_or_empty(string):
-        return string
-
-    rez = string.replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>')
-    rez = rez.replace('™', '').replace('®', '').replace('—', '-')
-    return rez
-
-
-def prettify_description(html_code: str) -> str:
-    if not html_code:
-        return ''
-
-    soup = BeautifulSoup(html_code, "html.parser")
-    # Removing all attributes
-    for e in soup.find_all(True):
-        e.attrs = {}
-
-    # Removing unwanted tags but saving their content
-    invalid_tags = ['strong', 'a', 'style']
-    for tag in invalid_tags:
-        for match in soup.findAll(tag):
-            match.replaceWithChildren()
-
-    # Removing unwanted tags with their content
-    invalid_tags = ['script', 'img']
-    for tag in invalid_tags:
-        for match in soup.findAll(tag):
-            match.replaceWith('')
-
-    # Removing empty tags
-    for tag in soup.find_all():
-        if len(tag.text) == 0:
-            tag.extract()
-
-    rez = soup.prettify()
-    rez = prettify_string(htmlmin.minify(rez, remove_comments=True, remove_empty_space=True))
-    return rez
+from selector_plan import Selector, SelectorPlan, cached_selector_plan, compile_xpath, read_selector, is_none_or_empty
+from sitemap import iter_sitemap_urls
+from sqlite_crawl_storage import SqliteCrawlStorage
+from url_dedup import canonicalize_url, make_visited_set
+from url_frontier import UrlFrontier
+from xlsx_results_writer import XlsxResultsWriter
 
 
 class Scraper(object):
@@ -70,25 +49,58 @@ class Scraper(object):
         CATALOGUE = 0
         PRODUCT = 1
 
-    t_links_work = dict()
-    t_links_work_pk = set()
-
-    t_products_work = dict()
-    t_products_work_pk = set()
-
-    t_product_variants_work = dict()
-    t_product_variants_work_pk = set()
-
-    t_product_variant_images_work = dict()
-    t_product_variant_images_work_pk = set()
-
-    def __init__(self, config: dict):
-
+    results_writers = {
+        'xlsx': XlsxResultsWriter,
+        'csv': CsvResultsWriter,
+        'jsonl': JsonLinesResultsWriter,
+    }
+
+    # Priority functions for the links frontier, lower values are scraped first
+    frontier_orders = {
+        'fifo': None,
+        'products_first': lambda record: 0 if record['url_type_id'] == Scraper.UrlTypes.PRODUCT else 1,
+        'shallow_first': lambda record: record['depth'],
+    }
+
+    # Pages queued to every worker process in multi-process mode
+    process_prefetch = 2
+
+    def __init__(self, config: dict, selector_plan: SelectorPlan = None):
+        """
+        :param selector_plan: compiled links and products settings of the config, by default compiled once per
+                              process for every distinct settings (see cached_selector_plan)
+        """
         self.config = config
-        self.config['config_links']['links']['xpaths'] = [xpath.replace('/@href', '') for xpath in
-                                                          self.config['config_links']['links']['xpaths']]
-        self.config['config_links']['products']['xpaths'] = [xpath.replace('/@href', '') for xpath in
-                                                             self.config['config_links']['products']['xpaths']]
+        self.selector_plan = selector_plan if selector_plan is not None else cached_selector_plan(self.config)
+        self.batch_extraction = self.config.get('scraper', {}).get('batch_extraction', True)
+        self.structured_data = self.config.get('scraper', {}).get('structured_data', False)
+        self.sitemaps = self.config.get('scraper', {}).get('sitemaps', {})
+        self._selectors = dict()
+
+        dedup = self.config.get('scraper', {}).get('dedup', {})
+        self.canonicalize_urls = dedup.get('canonicalize', True)
+        self.strip_params = frozenset(dedup.get('strip_params', []))
+        visited_set_options = dict(error_rate=dedup.get('error_rate', 0.001), capacity=dedup.get('capacity', 100000))
+        make_visited_set(dedup.get('mode'), **visited_set_options)  # Fails on an unknown mode before the crawl
+        self.visited_set_factory = lambda: make_visited_set(dedup.get('mode'), **visited_set_options)
+
+        frontier_order = self.config.get('scraper', {}).get('frontier_order', 'fifo').lower()
+        if frontier_order not in self.frontier_orders:
+            raise ValueError(f'Unknown frontier order "{frontier_order}", '
+                             f'expected one of: {", ".join(self.frontier_orders)}')
+        self.frontier = UrlFrontier(self.frontier_orders[frontier_order], self.visited_set_factory)
+        self._lock = threading.RLock()
+
+        storage = self.config.get('scraper', {}).get('storage', 'sqlite').lower()
+        if storage == 'memory':
+            # The visited set of the frontier is the only one, every link inserted to the storage is new to it
+            self.storage = MemoryCrawlStorage(visited_set_factory=None)
+        else:
+            self.storage = SqliteCrawlStorage(
+                file_name=self.config.get('scraper', {}).get('storage_file') or self.default_storage_file_name(),
+                checkpoint_every=self.config.get('scraper', {}).get('checkpoint_every', 100),
+                link_key=self.link_key,
+            )
 
         self.download_product_images = self.config.get('scraper', {}).get('download_product_images', True)
         if self.download_product_images:
@@ -99,27 +111,192 @@ class Scraper(object):
                 i += 1
             os.mkdir(images_folder_name)
             self.product_images_folder = images_folder_name
-
+        self.image_downloader = None
+
+        self.http_client = HttpClient(**self.config.get('scraper', {}).get('http', {}))
+        self.metrics = CrawlMetrics(**self.config.get('scraper', {}).get('metrics', {}))
+        self.robots = None
+        if self.config.get('scraper', {}).get('politeness', {}).get('robots_txt', True):
+            self.robots = RobotsTxt(self.http_client,
+                                    user_agent=self.config.get('scraper', {}).get('http', {}).get('user_agent'))
+        self.host_limiter = self.make_host_limiter()
+        self.parse_cache = ParseCache(metrics=self.metrics,
+                                      **self.config.get('scraper', {}).get('parse_cache', {}))
+        self.budget = CrawlBudget(metrics=self.metrics, **self.config.get('scraper', {}).get('budget', {}))
+
+        # selenium is imported only by the crawls using Chrome
         browser = self.config.get('scraper', {}).get('browser', 'lxml').lower()
-        if browser == 'chrome':
+        pool_size = self.config.get('scraper', {}).get('pool_size', 1)
+        self.browser_pool = browser == 'chrome' and pool_size > 1
+        if self.browser_pool:
+            from selenium_chrome_browser_pool import SeleniumChromeBrowserPool
+            logging.info(f'Using a pool of {pool_size} Selenium WebDrivers with Chrome browser')
+            self.browser = SeleniumChromeBrowserPool.get_pool(
+                pool_size=pool_size,
+                recycle_after=self.config.get('scraper', {}).get('recycle_after', 0),
+                **self.get_chrome_options(),
+            )
+        elif browser == 'chrome':
+            from selenium_chrome_browser import SeleniumChromeBrowser
             logging.info('Using Selenium WebDriver with Chrome browser')
-            self.browser = SeleniumChromeBrowser(
-                headless=self.config.get('scraper', {}).get('headless', False),
-                disable_images=self.config.get('scraper', {}).get('disable_images',
-                                                                  False),
-                width=self.config.get('scraper', {}).get('width', 1920),
-                height=self.config.get('scraper', {}).get('height', 1080),
-                implicitly_wait=self.config.get('scraper', {}).get('headless', 1),
+            self.browser = SeleniumChromeBrowser(**self.get_chrome_options())
+        elif browser == 'hybrid':
+            logging.info('Using requests with lxml, escalating to Selenium WebDriver with Chrome browser when needed')
+            self.browser = HybridBrowser(
+                http_client=self.http_client,
+                parse_cache=self.parse_cache,
+                metrics=self.metrics,
+                chrome=self.get_chrome_options(),
+                escalate_after=self.config.get('scraper', {}).get('hybrid_escalate_after', 3),
             )
+            self.hybrid_required_xpaths = self.get_hybrid_required_xpaths()
         else:
             logging.info('Using Selenium WebDriver with Chrome browser')
-            self.browser = RequestsLxmlBrowser(
-                no_session=self.config.get('scraper', {}).get('download_product_images', True)
-            )
+            self.browser = RequestsLxmlBrowser(http_client=self.http_client, parse_cache=self.parse_cache,
+                                               metrics=self.metrics)
+
+        self.incremental_crawl = self.config.get('scraper', {}).get('incremental', False)
+        if self.incremental_crawl and not isinstance(self.browser, RequestsLxmlBrowser):
+            logging.warning('Incremental crawl is supported only by lxml browser, all pages will be scraped')
+            self.incremental_crawl = False
+        if self.incremental_crawl and self.config.get('scraper', {}).get('processes', 1) > 1:
+            logging.warning('Incremental crawl is not supported with several processes, all pages will be scraped')
+            self.incremental_crawl = False
+        self.distributed = self.config.get('scraper', {}).get('distributed', {})
+        if self.incremental_crawl and self.distributed.get('enabled', False):
+            logging.warning('Incremental crawl is not supported by a distributed crawl, all pages will be scraped')
+            self.incremental_crawl = False
+        self.crawl_report = dict()
+
+        self.output = self.config.get('scraper', {}).get('output', {})
+        if self.output.get('format', 'xlsx').lower() not in self.results_writers:
+            raise ValueError(f'Unknown output format "{self.output["format"]}", '
+                             f'expected one of: {", ".join(self.results_writers)}')
+        self.results_writer = None
+
+    def scrape(self, get_interval=1.00, resume=False):
+        """
+        :param get_interval: seconds between requests to a host to start with, see make_host_limiter
+        :param resume: continue the crawl kept in the storage, links already retrieved are not scraped again
+        """
+        self.host_limiter = self.make_host_limiter(get_interval)
+        self.frontier.clear()
+        if resume:
+            self.load_links_from_storage()
+        else:
+            self.storage.clear()
+        self.crawl_report = dict(unchanged=0, changed=0, new=0, gone=0)
+        self.metrics.start()
+        self.budget.start()
+        sitemap_products = self.discover_from_sitemaps() if self.sitemaps.get('enabled', False) else 0
+        if not (sitemap_products and self.sitemaps.get('skip_catalogues', False)):
+            self.put_initial_url(self.UrlTypes.CATALOGUE)
 
-    def scrape(self, get_interval=1.00):
-        self.put_initial_url(self.UrlTypes.CATALOGUE)
+        if self.download_product_images:
+            self.image_downloader = ImageDownloader(
+                self.product_images_folder,
+                max_workers=self.config.get('scraper', {}).get('image_download_workers', 4),
+                http_client=self.http_client,
+                metrics=self.metrics)
+
+        if self.output.get('stream', False):
+            self.results_writer = self.open_results_writer()
+            if resume:
+                # Products saved before the crawl was interrupted
+                self.export_results(self.results_writer)
 
+        try:
+            processes = self.config.get('scraper', {}).get('processes', 1)
+            concurrency = self.config.get('scraper', {}).get('concurrency', 1)
+            if self.distributed.get('enabled', False):
+                self.scrape_distributed(resume)
+            elif processes > 1:
+                self.scrape_with_processes(processes, get_interval)
+            elif concurrency > 1 and isinstance(self.browser, RequestsLxmlBrowser):
+                self.scrape_concurrently(concurrency)
+            elif self.browser_pool:
+                self.scrape_with_browser_pool()
+            else:
+                self.scrape_sequentially()
+
+            if self.incremental_crawl:
+                self.crawl_report['gone'] = self.storage.purge_page_cache()
+                logging.info(f"Incremental crawl is finished. Pages unchanged: {self.crawl_report['unchanged']}, "
+                             f"changed: {self.crawl_report['changed']}, new: {self.crawl_report['new']}, "
+                             f"gone: {self.crawl_report['gone']}")
+        finally:
+            if self.image_downloader is not None:
+                # Images in flight update the storage and the streamed results when they are saved
+                self.image_downloader.close()
+                self.image_downloader = None
+            self.storage.checkpoint()
+            if self.results_writer is not None:
+                self.results_writer.close()
+                logging.info(f"Results are saved to {self.results_writer.file_name}. "
+                             f"Rows saved: {self.results_writer.rows_written}")
+                self.results_writer = None
+            self.metrics.finish()
+            self.metrics.log_progress(len(self.frontier), force=True)
+            self.metrics.dump()
+
+    def default_storage_file_name(self) -> str:
+        """
+        State file of the crawl: website name and a hash of the initial URL, links and products settings, so that
+        crawls of other categories or websites don't share it while a resumed crawl finds its own
+        """
+        crawl = json.dumps([self.config.get('initial_url'), self.config.get('config_links'),
+                            self.config.get('config_products')], sort_keys=True)
+        return (f"{(self.config.get('website_name') or 'Scraping Results').replace(' ', '_')}_"
+                f"{hashlib.sha1(crawl.encode('utf-8')).hexdigest()[:10]}.sqlite")
+
+    def get_chrome_options(self) -> dict:
+        """
+        :return: SeleniumChromeBrowser parameters from the config, lists as tuples so that the pools can be looked up
+        """
+        scraper_config = self.config.get('scraper', {})
+        return dict(headless=scraper_config.get('headless', False),
+                    disable_images=scraper_config.get('disable_images', False),
+                    width=scraper_config.get('width', 1920),
+                    height=scraper_config.get('height', 1080),
+                    implicitly_wait=scraper_config.get('implicitly_wait', 0),
+                    page_load_strategy=scraper_config.get('page_load_strategy', 'normal'),
+                    block_resource_types=tuple(scraper_config.get('block_resource_types', [])),
+                    block_urls=tuple(scraper_config.get('block_urls', [])),
+                    ready_xpath=scraper_config.get('ready_xpath', ''),
+                    ready_timeout=scraper_config.get('ready_timeout', 10))
+
+    def make_host_limiter(self, get_interval=1.00, share=1) -> HostLimiter:
+        """
+        Politeness limits of the crawl from config["scraper"]["politeness"]. By default the request rate of every
+        host adapts to its responses, starting from one request per get_interval up to max_rate
+        (config["scraper"]["per_host_rate"] if it is set). With "adaptive": false or no max rate the interval
+        between requests is fixed. robots.txt Crawl-delay is honoured unless "robots_txt" is false.
+        Pages answered with 429 or 5xx are retried by the limiter as config["scraper"]["http"] sets
+        ("retries", "backoff_factor").
+        :param share: number of processes sharing the limits, each one gets its part of the rates
+        """
+        politeness = self.config.get('scraper', {}).get('politeness', {})
+        http = self.config.get('scraper', {}).get('http', {})
+        retries = dict(retries=http.get('retries', 3), backoff_factor=http.get('backoff_factor', 0.5))
+        max_concurrency = self.config.get('scraper', {}).get('per_host_concurrency', 4)
+        max_rate = self.config.get('scraper', {}).get('per_host_rate') or politeness.get('max_rate', 10.0)
+        initial_rate = 1.0 / get_interval if get_interval else max_rate
+
+        if politeness.get('adaptive', True) and max_rate:
+            return AdaptiveHostLimiter(max_concurrency=max_concurrency,
+                                       max_rate=max_rate / share,
+                                       initial_rate=initial_rate / share,
+                                       min_rate=politeness.get('min_rate', 0.1) / share,
+                                       rate_increase=politeness.get('rate_increase', 0.1) / share,
+                                       backoff=politeness.get('backoff', 0.5),
+                                       latency_spike=politeness.get('latency_spike', 3.0),
+                                       robots=self.robots,
+                                       metrics=self.metrics,
+                                       **retries)
+        return HostLimiter(max_concurrency=max_concurrency, max_rate=initial_rate / share, robots=self.robots,
+                           metrics=self.metrics, **retries)
+
+    def scrape_sequentially(self):
         url_to_scrape = self.get_next_url_to_scrape()
         while url_to_scrape:
             try:
@@ -129,164 +306,567 @@ class Scraper(object):
                 raise ex
 
             url_to_scrape = self.get_next_url_to_scrape()
-            sleep(get_interval)
+            logging.debug(f'Links scraped: {self.frontier.size - len(self.frontier)}, '
+                          f'pending: {len(self.frontier)}')
+
+    def scrape_concurrently(self, concurrency: int):
+        """
+        Keeps up to `concurrency` pages downloading at once, pages are parsed one by one as soon as they arrive.
+        The host limiter caps the requests in flight and the request rate per host.
+        """
+        fetcher = ConcurrentFetcher(self.metrics.timed('fetch', self.browser.fetch), concurrency, self.host_limiter)
+        logging.info(f'Scraping with {concurrency} concurrent requests, '
+                     f'{self.host_limiter.max_concurrency or "unlimited"} per host')
+
+        in_flight = dict()
+        try:
+            while True:
+                while len(in_flight) < concurrency:
+                    url_to_scrape = self.get_next_url_to_scrape()
+                    if url_to_scrape is None:
+                        break
+                    headers = self.get_conditional_headers(
+                        self.storage.select_page_cache(url_to_scrape['url'])) if self.incremental_crawl else None
+                    in_flight[fetcher.submit(url_to_scrape['url'], headers)] = url_to_scrape
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url_to_scrape = in_flight.pop(future)
+                    try:
+                        self.scrape_url(url_to_scrape, future.result())
+                    except Exception as ex:
+                        logging.error(f"Error scraping url {url_to_scrape}: {ex}")
+                        raise ex
+
+                logging.debug(f'Links scraped: {self.frontier.size - len(self.frontier) - len(in_flight)}, '
+                              f'in flight: {len(in_flight)}, pending: {len(self.frontier)}')
+        finally:
+            fetcher.close()
+
+    def scrape_with_browser_pool(self):
+        """
+        Runs one worker thread per pooled ChromeDriver, each worker leases a driver for every URL it takes
+        from the frontier. A URL which crashed its driver is retried once with a fresh driver.
+        """
+        condition = threading.Condition(self._lock)
+        state = {'in_flight': 0, 'error': None}
+
+        def worker():
+            while True:
+                with condition:
+                    while not self.frontier and state['in_flight'] and state['error'] is None:
+                        condition.wait()
+                    url_to_scrape = self.get_next_url_to_scrape() if state['error'] is None else None
+                    if url_to_scrape is None:
+                        return
+                    state['in_flight'] += 1
+
+                try:
+                    self.scrape_url_with_leased_browser(url_to_scrape)
+                except Exception as ex:
+                    logging.error(f"Error scraping url {url_to_scrape}: {ex}")
+                    state['error'] = ex
+                finally:
+                    with condition:
+                        state['in_flight'] -= 1
+                        condition.notify_all()
+
+        workers = [threading.Thread(target=worker, name=f'scraper-{i}') for i in range(self.browser.pool_size)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        if state['error'] is not None:
+            raise state['error']
+
+    def scrape_with_processes(self, processes: int, get_interval=1.00):
+        """
+        Shards the frontier by URL hash across worker processes, each with its own browser, which open and parse
+        the pages. This process keeps the frontier, deduplicates the links and saves the results.
+        Links are taken from the frontier only while a shard is short of work, so that the crawl budget and the
+        pruning of low-yield URL families still apply to the pending links.
+        """
+        import multiprocessing
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        shards = [{'tasks': context.Queue(), 'backlog': deque(), 'in_flight': 0} for _ in range(processes)]
+        workers = [context.Process(target=crawl_worker, name=f'scraper-{i}', daemon=True,
+                                   args=(self.config, shard['tasks'], results, get_interval,
+                                         logging.getLogger().level))
+                   for i, shard in enumerate(shards)]
+        for w in workers:
+            w.start()
+        logging.info(f'Scraping with {processes} worker processes')
+
+        def shard_of(url_to_scrape):
+            return shards[zlib.crc32(url_to_scrape['url'].encode('utf-8')) % processes]
+
+        # Links of the busy shards wait in the backlogs, up to this number altogether
+        backlog_limit = processes * self.process_prefetch
+        try:
+            while True:
+                while (any(len(s['backlog']) + s['in_flight'] < self.process_prefetch for s in shards) and
+                       sum(len(s['backlog']) for s in shards) < backlog_limit):
+                    url_to_scrape = self.get_next_url_to_scrape()
+                    if url_to_scrape is None:
+                        break
+                    shard_of(url_to_scrape)['backlog'].append(url_to_scrape)
+                for shard in shards:
+                    while shard['backlog'] and shard['in_flight'] < self.process_prefetch:
+                        shard['tasks'].put(shard['backlog'].popleft())
+                        shard['in_flight'] += 1
+
+                if not any(shard['in_flight'] for shard in shards):
+                    break
+
+                try:
+                    url_to_scrape, result, error, worker_metrics = results.get(timeout=1.0)
+                except queue.Empty:
+                    dead_workers = [w.name for w in workers if not w.is_alive()]
+                    if dead_workers:
+                        raise RuntimeError(f'Worker processes exited unexpectedly: {", ".join(dead_workers)}')
+                    continue
+
+                shard_of(url_to_scrape)['in_flight'] -= 1
+                self.metrics.merge(worker_metrics)
+                if error is not None:
+                    logging.error(f"Error scraping url {url_to_scrape}: {error}")
+                    raise RuntimeError(error)
+                self.save_page_result(url_to_scrape, result)
+
+                logging.debug(f'Links scraped: {self.frontier.size - len(self.frontier)}, '
+                              f'queued to workers: {sum(len(s["backlog"]) + s["in_flight"] for s in shards)}')
+        finally:
+            for shard in shards:
+                shard['tasks'].put(None)
+            for w in workers:
+                w.join(timeout=10)
+                if w.is_alive():
+                    w.terminate()
+
+    def open_crawl_queue(self) -> ABCCrawlQueue:
+        """
+        :return: the queue shared by the coordinator and the workers of a distributed crawl
+        """
+        return make_crawl_queue(self.distributed.get('queue', 'sqlite'),
+                                file_name=self.distributed.get('queue_file') or 'crawl_queue.sqlite',
+                                url=self.distributed.get('redis_url', 'redis://localhost:6379/0'),
+                                prefix=self.distributed.get('prefix') or
+                                       (self.config.get('website_name') or 'crawl').replace(' ', '_'),
+                                max_attempts=self.distributed.get('max_attempts', 3))
+
+    def scrape_distributed(self, resume=False):
+        """
+        Coordinates a crawl of distributed_worker processes, possibly on other nodes: keeps the frontier and the
+        crawl budget, hands the links to the workers through the crawl queue a few at a time and saves the links
+        and products the workers extract. Returns when the frontier is exhausted, no link is pending or leased and
+        every result is collected.
+        Every run has its own id in the queue state, so that workers started before it don't take the "finished"
+        state of the previous run for its own. If no page is completed for lease_timeout seconds, a warning is
+        logged, after idle_timeout seconds (0 - never) the crawl is given up with RuntimeError.
+        """
+        poll_interval = self.distributed.get('poll_interval', 1.0)
+        lease_timeout = self.distributed.get('lease_timeout', 300)
+        idle_timeout = self.distributed.get('idle_timeout', 0)
+        # Links queued ahead of the workers, the others wait in the frontier where the budget applies to them
+        queued_ahead = max(1, self.distributed.get('workers', 1)) * self.distributed.get('lease_batch', 5) * 2
+        crawl_queue = self.open_crawl_queue()
+        # Links handed to the queue by link key: the records of the storage the results belong to
+        dispatched = dict()
+        run_id = uuid.uuid4().hex
+        try:
+            if not resume:
+                crawl_queue.clear()
+            crawl_queue.set_state('seeding', run_id)
+            self.feed_crawl_queue(crawl_queue, dispatched, queued_ahead)
+            crawl_queue.set_state('running', run_id)
+            logging.info(f'Coordinating distributed crawl {run_id}, queue: {crawl_queue.counts()}')
+
+            last_result = idle_warned = time.monotonic()
+            while True:
+                page_results = crawl_queue.collect(100)
+                for page_result in page_results:
+                    self.metrics.merge(page_result.metrics)
+                    link = page_result.link
+                    url_to_scrape = dispatched.pop(self.link_key(link['url'], link['url_type_id']), None)
+                    if url_to_scrape is None:
+                        logging.warning(f"Result of a link not queued by this crawl is dropped: {link['url']}")
+                    elif page_result.error is not None:
+                        logging.error(f"Error scraping url {link['url']}: {page_result.error}")
+                        self.metrics.increment('pages')
+                    else:
+                        self.save_page_result(url_to_scrape, page_result.result)
+                fed = self.feed_crawl_queue(crawl_queue, dispatched, queued_ahead)
+                if page_results:
+                    last_result = idle_warned = time.monotonic()
+                    continue
+                if not fed and crawl_queue.is_drained():
+                    break
+
+                now = time.monotonic()
+                if idle_timeout and now - last_result >= idle_timeout:
+                    raise RuntimeError(f'No page has been completed for {idle_timeout} s, the distributed crawl is '
+                                       f'given up, queue: {crawl_queue.counts()}')
+                if now - idle_warned >= lease_timeout:
+                    logging.warning(f'No page has been completed for {now - last_result:.0f} s, are the workers '
+                                    f'running? Queue: {crawl_queue.counts()}')
+                    idle_warned = now
+                time.sleep(poll_interval)
+            crawl_queue.set_state('finished', run_id)
+        finally:
+            crawl_queue.close()
+
+    def feed_crawl_queue(self, crawl_queue: ABCCrawlQueue, dispatched: dict, queued_ahead: int) -> int:
+        """
+        Moves links from the frontier to the crawl queue until `queued_ahead` links are pending there
+        :param dispatched: links handed to the queue by link key, the new ones are added
+        :return: number of links taken from the frontier
+        """
+        links = list()
+        pending = crawl_queue.counts()['pending']
+        while pending + len(links) < queued_ahead:
+            url_to_scrape = self.get_next_url_to_scrape()
+            if url_to_scrape is None:
+                break
+            key = self.link_key(url_to_scrape['url'], url_to_scrape['url_type_id'])
+            dispatched[key] = url_to_scrape
+            links.append((key, url_to_scrape['url'], url_to_scrape['url_type_id'], url_to_scrape['depth']))
+        crawl_queue.push_links(links)
+        return len(links)
+
+    def scrape_url_with_leased_browser(self, url_to_scrape: dict):
+        from selenium.common.exceptions import WebDriverException
+        try:
+            with self.browser.lease():
+                self.scrape_url(url_to_scrape)
+        except WebDriverException as ex:
+            logging.warning(f"ChromeDriver failed on url {url_to_scrape['url']}, retrying with a fresh one: {ex}")
+            with self.browser.lease():
+                self.scrape_url(url_to_scrape)
 
     def save_results_to_xslx(self, report_file_name: str):
-        # Create a workbook and add a worksheet.
         workbook_name = self.config.get('website_name') or "Scraping Results"
-        workbook = xlsxwriter.Workbook(f"{workbook_name.replace(' ', '_')}.xlsx")
-        worksheet = workbook.add_worksheet(name=workbook_name)
-
-        # Add a bold format to use to highlight row headers.
-        bold_format = workbook.add_format({'bold': True})
-
-        # Write data headers.
-        worksheet.write('A1', 'name', bold_format)
-        worksheet.write('B1', 'sku', bold_format)
-        worksheet.write('C1', 'description', bold_format)
-        worksheet.write('D1', 'category_1', bold_format)
-        worksheet.write('E1', 'category_2', bold_format)
-        worksheet.write('F1', 'category_3', bold_format)
-        worksheet.write('G1', 'url', bold_format)
-        worksheet.write('H1', 'image_url', bold_format)
-
-        additional_fields = [s for s in self.config['config_products'].get('additional_selectors', [])]
-        columns = 'IJKLMNOPQRSTUVWXYZ'
-        ind = 0
-        for s in additional_fields:
-            worksheet.write(f'{columns[ind]}1', s, bold_format)
-            ind += 1
-
-        # Writing data
-        row = 1
-        for product_key in self.t_products_work.keys():
-            product = self.t_products_work[product_key]
-            variants = self.select_variants_where_product_key(product_key)
+        with XlsxResultsWriter(f"{workbook_name.replace(' ', '_')}.xlsx", self.get_additional_field_names(),
+                               sheet_name=workbook_name) as results_writer:
+            self.export_results(results_writer)
+        logging.info(f"Export to Excel file {workbook_name} is finished. Rows saved: {results_writer.rows_written}")
+
+    def save_results(self):
+        """
+        Exports all scraped products to the file configured in config["scraper"]["output"]
+        """
+        with self.open_results_writer() as results_writer:
+            self.export_results(results_writer)
+        logging.info(f"Results are saved to {results_writer.file_name}. Rows saved: {results_writer.rows_written}")
+
+    def open_results_writer(self) -> ABCResultsWriter:
+        output_format = self.output.get('format', 'xlsx').lower()
+        website_name = self.config.get('website_name') or "Scraping Results"
+        file_name = self.output.get('file_name') or f"{website_name.replace(' ', '_')}.{output_format}"
+        return self.results_writers[output_format](file_name, self.get_additional_field_names(),
+                                                   sheet_name=website_name)
+
+    def get_additional_field_names(self) -> list:
+        return [s for s in self.config['config_products'].get('additional_selectors', [])]
+
+    def export_results(self, results_writer: ABCResultsWriter):
+        for product in self.storage.select_products():
+            variants = self.select_variants_where_product_key(product['record_id'])
             for variant in variants:
-                image_url = self.select_image_url_where_variant_id(variant['record_id'])
-                worksheet.write(row, 0, product['name'])
-                worksheet.write(row, 1, variant['sku'])
-                worksheet.write(row, 2, product['description'])
-                worksheet.write(row, 3, product['category_1'])
-                worksheet.write(row, 4, product['category_2'])
-                worksheet.write(row, 5, product['category_3'])
-                worksheet.write(row, 6, product['url'])
-                worksheet.write(row, 7, image_url)
-                ind = 8
-                for s in additional_fields:
-                    v = [v for v in variant['additional'] if s in v.keys()]
-                    worksheet.write(row, ind, v[0][s])
-                    ind += 1
-                row += 1
-
-        workbook.close()
-        logging.info(f"Export to Excel file {workbook_name} is finished. Rows saved: {row - 1}")
+                variant['image_url'] = self.select_image_url_where_variant_id(variant['record_id'])
+            with self.metrics.timer('export'):
+                results_writer.write_product(product, variants)
+
+    def get_hybrid_required_xpaths(self) -> dict:
+        """
+        Selectors which must hit something on a page opened without JavaScript, per URL type.
+        config["scraper"]["hybrid_required_selectors"] lists names of product selectors ("variant_settings" included)
+        or raw XPaths for "catalogue" and "product" pages.
+        """
+        required_selectors = self.config.get('scraper', {}).get('hybrid_required_selectors', {
+            'catalogue': [],
+            'product': ['name', 'variant_settings'],
+        })
+
+        def resolve(selector):
+            if selector == 'variant_settings':
+                selector = self.config['config_products']['variant_settings']['sel']
+            elif selector in self.config['config_products']['product_selectors']:
+                selector = self.config['config_products']['product_selectors'][selector]['sel']
+            return compile_xpath(selector)
+
+        return {
+            self.UrlTypes.CATALOGUE: [resolve(s) for s in required_selectors.get('catalogue', [])],
+            self.UrlTypes.PRODUCT: [resolve(s) for s in required_selectors.get('product', [])],
+        }
+
+    def load_links_from_storage(self):
+        """
+        Fills the frontier with the links kept in the storage, only links not retrieved yet are queued
+        """
+        with self._lock:
+            retrieved = 0
+            for record in self.storage.select_links():
+                if record['retrieved'] is None:
+                    self.frontier.push(self.link_key(record['url'], record['url_type_id']), record)
+                else:
+                    self.frontier.mark_seen(self.link_key(record['url'], record['url_type_id']))
+                    retrieved += 1
+        logging.info(f'Resuming the crawl: {retrieved} links retrieved, {len(self.frontier)} pending')
+
+    def discover_from_sitemaps(self) -> int:
+        """
+        Queues the product URLs of the sitemaps (config["scraper"]["sitemaps"]["urls"], those listed in robots.txt
+        or /sitemap.xml of the initial URL) which match the products regexps
+        :return: number of product URLs found
+        """
+        initial_url = self.config['initial_url']
+        sitemap_urls = list(self.sitemaps.get('urls', []))
+        if not sitemap_urls and self.sitemaps.get('from_robots_txt', True):
+            robots = self.robots or RobotsTxt(
+                self.http_client, user_agent=self.config.get('scraper', {}).get('http', {}).get('user_agent'))
+            sitemap_urls = robots.sitemaps(initial_url)
+        if not sitemap_urls:
+            sitemap_urls = [urljoin(initial_url, '/sitemap.xml')]
+        logging.info(f'Reading sitemaps: {", ".join(sitemap_urls)}')
+
+        def fetch(url):
+            with self.metrics.timer('fetch'):
+                return self.host_limiter.call(url, lambda: self.http_client.get(url, stream=True, status_retries=False))
+
+        product_regexps = self.selector_plan.product_regexps
+        found = 0
+        with self.metrics.timer('sitemaps'):
+            for url in iter_sitemap_urls(fetch, sitemap_urls, max_depth=self.sitemaps.get('max_depth', 3),
+                                         max_urls=self.sitemaps.get('max_urls', 0)):
+                if product_regexps and not any(regex.match(url) for regex in product_regexps):
+                    continue
+                self.insert_t_links_work(url, self.UrlTypes.PRODUCT, depth=1)
+                found += 1
+        logging.info(f'{found} product URLs found in the sitemaps')
+        return found
 
     def put_initial_url(self, url_type: int):
-        self.t_links_work_pk.add((self.config['initial_url'], url_type))
-        self.t_links_work[0] = {'url': self.config['initial_url'],
-                                'url_type_id': url_type,
-                                'retrieved': None,
-                                'record_id': 0}
+        self.insert_t_links_work(self.config['initial_url'], url_type, depth=0)
 
     def get_next_url_to_scrape(self) -> dict or None:
-        for rid in self.t_links_work.keys():
-            if self.t_links_work[rid]['retrieved'] is None:
-                return self.t_links_work[rid]
+        """
+        :return: next link of the frontier within the crawl budget, None if there is none
+        """
+        with self._lock:
+            while not self.budget.exhausted():
+                url_to_scrape = self.frontier.pop()
+                if url_to_scrape is None or self.budget.take(
+                        url_to_scrape['url'], url_to_scrape['url_type_id'] == self.UrlTypes.CATALOGUE):
+                    return url_to_scrape
+                logging.debug(f"Skipping the link of a pruned URL family: {url_to_scrape['url']}")
         return None
 
-    def insert_t_links_work(self, url: str, url_type_id: int):
-        if (url, url_type_id) not in self.t_links_work_pk:
-            self.t_links_work_pk.add((url, url_type_id))
-            record_id = len(self.t_links_work)
-            self.t_links_work[record_id] = {'url': url,
-                                            'url_type_id': url_type_id,
-                                            'retrieved': None,
-                                            'record_id': record_id}
-        else:
-            # logging.debug(f"Doubled link: {url}")
-            pass
+    def link_key(self, url: str, url_type_id: int) -> str:
+        """
+        Key of the link in the visited sets: links with the same canonical URL are duplicates
+        """
+        if self.canonicalize_urls:
+            url = canonicalize_url(url, self.strip_params)
+        return f'{url_type_id} {url}'
+
+    def insert_t_links_work(self, url: str, url_type_id: int, depth: int = 0, parent_id: int = None) -> bool:
+        """
+        :return: True if the link is new and has been queued
+        """
+        with self._lock:
+            key = self.link_key(url, url_type_id)
+            if key in self.frontier:
+                # logging.debug(f"Doubled link: {url}")
+                return False
+            if not self.budget.allows_link(url, url_type_id == self.UrlTypes.CATALOGUE, depth):
+                return False
+            record = self.storage.insert_link(url, url_type_id, depth, parent_id)
+            if record is None:
+                return False
+            self.frontier.push(key, record)
+            return True
 
     def insert_t_products_work(self, name: str, description: str or None, category_1: str or None,
                                category_2: str or None, category_3: str or None, url: str) -> int or None:
-        if url not in self.t_products_work_pk:
-            self.t_products_work_pk.add(url)
-            record_id = len(self.t_products_work)
-            self.t_products_work[record_id] = {'name': name,
-                                               'description': description,
-                                               'category_1': category_1,
-                                               'category_2': category_2,
-                                               'category_3': category_3,
-                                               'url': url,
-                                               'record_id': record_id}
-            return record_id
-        else:
-            return None
+        return self.storage.insert_product(name, description, category_1, category_2, category_3, url)
 
     def insert_t_product_variants_work(self, variant_sku, variant_additional, product_record_id):
-        if (variant_sku, product_record_id) not in self.t_product_variants_work_pk:
-            self.t_product_variants_work_pk.add((variant_sku, product_record_id))
-            record_id = len(self.t_product_variants_work)
-            self.t_product_variants_work[record_id] = {'sku': variant_sku,
-                                                       'additional': variant_additional,
-                                                       'product_record_id': product_record_id,
-                                                       'record_id': record_id}
-            return record_id
-        else:
-            return None
+        return self.storage.insert_variant(variant_sku, variant_additional, product_record_id)
 
     def insert_t_product_variant_images_work(self, url, variant_id):
-        if (url, variant_id) not in self.t_product_variant_images_work_pk:
-            self.t_product_variant_images_work_pk.add((url, variant_id))
-            record_id = len(self.t_product_variant_images_work)
-            self.t_product_variant_images_work[record_id] = {'url': url,
-                                                             'variant_id': variant_id,
-                                                             'record_id': record_id}
-            return record_id
-        else:
-            return None
+        return self.storage.insert_image(url, variant_id)
+
+    def scrape_url(self, url_to_scrape: dict, response=None):
+        """
+        :param response: already fetched response for the URL (RequestsLxmlBrowser only), None - open the URL
+        """
+        cached_page = None
+        if self.incremental_crawl:
+            cached_page = self.storage.select_page_cache(url_to_scrape['url'])
+            if response is None:
+                headers = self.get_conditional_headers(cached_page)
+                fetch = self.metrics.timed('fetch', self.browser.fetch)
+                response = self.host_limiter.call(url_to_scrape['url'], lambda: fetch(url_to_scrape['url'], headers))
+
+        status = self.open_page(url_to_scrape, response)
+
+        if self.incremental_crawl and self.reuse_unchanged_page(url_to_scrape, cached_page):
+            self.mark_link_retrieved(url_to_scrape)
+            return
+        if status is not None and status != 200:
+            # The page has not been loaded, the previous page must not be parsed instead of it
+            self.mark_link_retrieved(url_to_scrape)
+            return
 
-    def scrape_url(self, url_to_scrape: dict):
         # If the URL is a catalogue - get links
         if url_to_scrape['url_type_id'] == self.UrlTypes.CATALOGUE:
             logging.debug(f'Scraping catalogue URL: {url_to_scrape["url"]}')
-            self.extract_links(url_to_scrape)
+            result = self.extract_links(url_to_scrape)
         else:  # If the URL is a product - get product data and variants
             logging.debug(f'Scraping product URL: {url_to_scrape["url"]}')
-            self.extract_product_data(url_to_scrape)
+            result = self.extract_product_data(url_to_scrape)
             # self.extract_links(url_to_scrape) # TODO: Remove it!
 
-        self.t_links_work[url_to_scrape['record_id']]['retrieved'] = datetime.now()
+        if self.incremental_crawl:
+            self.update_page_cache(url_to_scrape, cached_page, result)
+        self.mark_link_retrieved(url_to_scrape)
+
+    def open_page(self, url_to_scrape: dict, response=None):
+        """
+        Makes the URL the current page of the browser, requests wait for the politeness limits of the host
+        :return: HTTP status if the browser knows it
+        """
+        url = url_to_scrape['url']
+        if response is None and isinstance(self.browser, RequestsLxmlBrowser):
+            fetch = self.metrics.timed('fetch', self.browser.fetch)
+            response = self.host_limiter.call(url, lambda: fetch(url))
+
+        if response is not None:
+            with self.metrics.timer('load'):
+                status = self.browser.load(url, response)
+        elif isinstance(self.browser, HybridBrowser):
+            get = self.metrics.timed('page_load', self.browser.get)
+            status = self.host_limiter.call(
+                url, lambda: get(url, self.hybrid_required_xpaths[url_to_scrape['url_type_id']]))
+        else:
+            get = self.metrics.timed('page_load', self.browser.get)
+            status = self.host_limiter.call(url, lambda: get(url))
+
+        page_info = self.browser.get_page_info() if hasattr(self.browser, 'get_page_info') else None
+        if page_info is not None:
+            self.metrics.increment('bytes', page_info['bytes'])
+        return status
+
+    def scrape_page(self, url_to_scrape: dict):
+        """
+        Opens the URL and extracts its links or product without saving anything
+        :return: links as returned by get_page_links or product as returned by get_page_product,
+                 None if the page has not been loaded
+        """
+        status = self.open_page(url_to_scrape)
+        if status is not None and status != 200:
+            return None
+
+        if url_to_scrape['url_type_id'] == self.UrlTypes.CATALOGUE:
+            logging.debug(f'Scraping catalogue URL: {url_to_scrape["url"]}')
+            return self.get_page_links(url_to_scrape)
+        else:
+            logging.debug(f'Scraping product URL: {url_to_scrape["url"]}')
+            return self.get_page_product(url_to_scrape)
+
+    def save_page_result(self, url_to_scrape: dict, result):
+        """
+        Saves what scrape_page has extracted and marks the link as retrieved
+        """
+        if url_to_scrape['url_type_id'] == self.UrlTypes.CATALOGUE:
+            if result is not None:
+                self.save_links(url_to_scrape, result)
+        elif result is not None:
+            self.save_product(url_to_scrape, result)
+        self.mark_link_retrieved(url_to_scrape)
+
+    def mark_link_retrieved(self, url_to_scrape: dict):
+        self.storage.mark_link_retrieved(url_to_scrape['record_id'], datetime.now())
+        self.metrics.increment('pages')
+        self.metrics.log_progress(len(self.frontier))
+
+    @staticmethod
+    def get_conditional_headers(cached_page: dict or None) -> dict:
+        headers = dict()
+        if cached_page is not None and cached_page['etag']:
+            headers['If-None-Match'] = cached_page['etag']
+        if cached_page is not None and cached_page['last_modified']:
+            headers['If-Modified-Since'] = cached_page['last_modified']
+        return headers
+
+    def reuse_unchanged_page(self, url_to_scrape: dict, cached_page: dict or None) -> bool:
+        """
+        Saves the result of the previous crawl again if the current page has not changed since then
+        :return: True if the page is unchanged and does not need to be parsed
+        """
+        page_info = self.browser.get_page_info()
+        if cached_page is None or page_info['status'] not in (200, 304):
+            return False
+        if page_info['status'] == 200 and page_info['body_hash'] != cached_page['body_hash']:
+            return False
+
+        logging.debug(f'Page is not changed since the previous crawl: {url_to_scrape["url"]}')
+        self.crawl_report['unchanged'] += 1
+        self.storage.save_page_cache(url_to_scrape['url'],
+                                     page_info['etag'] or cached_page['etag'],
+                                     page_info['last_modified'] or cached_page['last_modified'],
+                                     cached_page['body_hash'],
+                                     cached_page['result'])
+        if url_to_scrape['url_type_id'] == self.UrlTypes.CATALOGUE:
+            self.save_links(url_to_scrape, cached_page['result'])
+        elif cached_page['result'] is not None:
+            self.save_product(url_to_scrape, cached_page['result'])
+        return True
+
+    def update_page_cache(self, url_to_scrape: dict, cached_page: dict or None, result):
+        page_info = self.browser.get_page_info()
+        if page_info['status'] != 200:
+            # Pages which are not available any more are counted as gone at the end of the crawl
+            return
+
+        self.crawl_report['new' if cached_page is None else 'changed'] += 1
+        self.storage.save_page_cache(url_to_scrape['url'], page_info['etag'], page_info['last_modified'],
+                                     page_info['body_hash'], result)
 
-    def extract_links(self, url_to_scrape):
-        self.browser.get(url_to_scrape['url'])
+    def extract_links(self, url_to_scrape) -> list:
+        """
+        Saves links to catalogues and products found on the current page
+        :return: the links as (url, url_type_id) pairs
+        """
+        extracted_links = self.get_page_links(url_to_scrape)
+        self.save_links(url_to_scrape, extracted_links)
+        return extracted_links
 
+    def get_page_links(self, url_to_scrape) -> list:
         # Extracting links from the page
         extracted_links = set()
-        catalogue_url_regex_filters = list()
-        for cre in self.config['config_links']['links']['regexps']:  # TODO: rename links to catalogues in config?
-            try:
-                catalogue_url_regex_filters.append(re.compile(cre))
-            except:
-                logging.error(f'Invalid catalogue regex: {cre}')
+        catalogue_url_regex_filters = self.selector_plan.catalogue_regexps
+        product_url_regex_filters = self.selector_plan.product_regexps
 
-        product_url_regex_filters = list()
-        for pre in self.config['config_links']['products']['regexps']:
-            try:
-                product_url_regex_filters.append(re.compile(pre))
-            except:
-                logging.error(f'Invalid product regex: {pre}')
-
-        for catalogue_xpath in self.config['config_links']['links']['xpaths']:
-            for a_element in self.browser.find_elements_by_xpath(catalogue_xpath):
+        for catalogue_xpath in self.selector_plan.catalogue_xpaths:
+            with self.metrics.timer('links_xpath'):
+                a_elements = self.browser.find_elements_by_xpath(catalogue_xpath)
+            for a_element in a_elements:
                 catalogue_url = urljoin(url_to_scrape['url'], self.browser.get_element_attribute(a_element, 'href'))
                 if len(catalogue_url_regex_filters) and not (
                         any(regex.match(catalogue_url) for regex in catalogue_url_regex_filters)):
                     continue
                 extracted_links.add((catalogue_url, self.UrlTypes.CATALOGUE))
 
-        for product_xpath in self.config['config_links']['products']['xpaths']:
-            for a_element in self.browser.find_elements_by_xpath(product_xpath):
+        for product_xpath in self.selector_plan.product_xpaths:
+            with self.metrics.timer('links_xpath'):
+                a_elements = self.browser.find_elements_by_xpath(product_xpath)
+            for a_element in a_elements:
                 product_url = urljoin(url_to_scrape['url'],
                                       self.browser.get_element_attribute(a_element, 'href'))
 
@@ -295,32 +875,55 @@ class Scraper(object):
                     continue
                 extracted_links.add((product_url, self.UrlTypes.PRODUCT))
 
-        # logging.debug(f'Adding new links to DB: {extracted_links}')
-        for (url, link_type) in extracted_links:
-            self.insert_t_links_work(url, link_type)
-
-    def extract_product_data(self, url_to_scrape):
-        self.browser.get(url_to_scrape['url'])
-
+        return list(extracted_links)
+
+    def save_links(self, url_to_scrape, links):
+        # logging.debug(f'Adding new links to DB: {links}')
+        new_products = 0
+        for (url, link_type) in links:
+            if (self.insert_t_links_work(url, link_type, url_to_scrape['depth'] + 1, url_to_scrape['record_id']) and
+                    link_type == self.UrlTypes.PRODUCT):
+                new_products += 1
+        self.budget.record_yield(url_to_scrape['url'], new_products)
+
+    def extract_product_data(self, url_to_scrape) -> dict or None:
+        """
+        Saves the product found on the current page with its variants and images
+        :return: the product as returned by get_page_product
+        """
+        product = self.get_page_product(url_to_scrape)
+        if product is not None:
+            self.save_product(url_to_scrape, product)
+        return product
+
+    def get_page_product(self, url_to_scrape) -> dict or None:
+        """
+        Extracts the product on the current page without saving it
+        :return: product fields and a list of variants (sku, additional, image_url), None if there is no product
+        """
         # Getting product data
-        product_name = prettify_string(
-            self.get_web_element_attribute(self.config['config_products']['product_selectors']['name']['sel'])
-        )
-        product_description = prettify_description(
-            self.get_web_element_attribute(self.config['config_products']['product_selectors']['description']['sel'])
-        )
-        product_category1 = self.get_web_element_attribute(
-            self.config['config_products']['product_selectors']['category1']['sel'])
-        product_category2 = self.get_web_element_attribute(
-            self.config['config_products']['product_selectors']['category2']['sel'], no_warning=True)
-        product_category3 = self.get_web_element_attribute(
-            self.config['config_products']['product_selectors']['category3']['sel'], no_warning=True)
+        batch = self.selector_plan.product_batch
+        page = None
+        if self.structured_data:
+            with self.metrics.timer('structured_data'):
+                page = self.browser.read_structured_product()
+            self.metrics.increment('structured_products' if page is not None else 'structured_misses')
+        if page is None:
+            with self.metrics.timer('extract_fields'):
+                page = self.browser.extract_fields(batch) if self.batch_extraction else batch.read(self.browser)
+        fields = {field.name: self.get_batch_value(field, page['fields']) for field in batch.fields}
+
+        product_name = fields['name']
+        product_description = fields['description']
+        product_category1 = fields['category1']
+        product_category2 = fields['category2']
+        product_category3 = fields['category3']
 
         # Validating products data
         if not product_name:
             logging.warning(
                 f"Unable to extract product name! This product will be skipped. URL: {url_to_scrape['url']}, selector: {self.config['config_products']['product_selectors']['name']['sel']}")
-            return
+            return None
         if is_none_or_empty(product_description):
             logging.warning(
                 f"Product '{product_name}' has no description! URL: {url_to_scrape['url']}, selector: {self.config['config_products']['product_selectors']['description']['sel']}")
@@ -329,162 +932,277 @@ class Scraper(object):
                 is_none_or_empty(self.config['config_products']['product_selectors']['category1']['sel'])):
             logging.warning(f"Product '{product_name}' has no categories! URL: {url_to_scrape['url']}")
 
-        new_product_record_id = self.insert_t_products_work(product_name, product_description, product_category1,
-                                                            product_category2, product_category3, url_to_scrape['url'])
+        product = {'name': product_name,
+                   'description': product_description,
+                   'category_1': product_category1,
+                   'category_2': product_category2,
+                   'category_3': product_category3,
+                   'variants': list()}
         logging.debug(f'Extracted product: {product_name}')
 
-        # Getting a list of variants for the product
-        product_variants = self.browser.find_elements_by_xpath(
-            self.config['config_products']['variant_settings']['sel'])
-
-        if not len(product_variants):
+        # Variants of the product
+        if not len(page['variants']):
             logging.warning(
                 f"Product '{product_name}' has no variants! URL: {url_to_scrape['url']}, selector: {self.config['config_products']['variant_settings']['sel']}")
-            return
+            return product
 
-        variant_index = 0
-        for variant in product_variants:
-            variant_sku = self.get_web_element_attribute(
-                self.config['config_products']['variant_settings']['product_code'],
-                variant)
-
-            variant_additional = list()
-            for additional_selector_name in self.config['config_products'].get('additional_selectors', []):
-                additional_selector = self.config['config_products']['additional_selectors'][
-                    additional_selector_name]
-                if str(additional_selector['index']).lower() == 'variant':
-                    selector_index = variant_index
-                else:
-                    selector_index = int(additional_selector['index']) or 0  # TODO: Implement
-
-                variant_additional.append({additional_selector_name: self.get_web_element_attribute(
-                    additional_selector['sel'],
-                    variant,
-                    selector_index,
-                    no_warning=True)})
+        sku_field, image_field, *additional_fields = batch.variant_fields
+        for variant_values in page['variants']:
+            variant_sku = self.get_batch_value(sku_field, variant_values)
+            variant_additional = {field.label: self.get_batch_value(field, variant_values)
+                                  for field in additional_fields}
 
             if is_none_or_empty(variant_sku):
                 logging.warning(
                     f"Variant of product '{product_name}' has no SKU! URL: {url_to_scrape['url']}, selector: {self.config['config_products']['variant_settings']['sel']} + {self.config['config_products']['variant_settings']['product_code']}")
                 continue
 
-            new_product_variant_id = self.insert_t_product_variants_work(variant_sku, variant_additional,
+            variant_image_url = self.get_batch_value(image_field, variant_values)
+
+            if is_none_or_empty(variant_image_url):
+                logging.warning(
+                    f"Variant of product '{product_name}' has no image! URL: {url_to_scrape['url']}, selector: {self.config['config_products']['variant_settings']['sel']} + {self.config['config_products']['product_selectors']['image_file_name_1']['sel']}")
+
+            product['variants'].append({'sku': variant_sku,
+                                        'additional': variant_additional,
+                                        'image_url': variant_image_url})
+
+        return product
+
+    def get_batch_value(self, field, values: dict):
+        """
+        :return: stripped value of the batch field with the rules of the field applied
+        """
+        value = values.get(field.name)
+        self.metrics.selector_hit(field.label, value is not None)
+        if value is None:
+            if field.warn and field.selector:
+                logging.warning(
+                    f'Selector hit nothing!: {field.selector.source}, URL: {self.browser.get_current_url()}')
+            return None
+        if not field.rules:
+            # innerHTML read by lxml comes as bytes, the rules convert it themselves
+            return to_string(value).strip()
+        with self.metrics.timer(f'rules.{field.label}'):
+            return field.rules(value.strip())
+
+    def save_product(self, url_to_scrape, product: dict):
+        new_product_record_id = self.insert_t_products_work(product['name'], product['description'],
+                                                            product['category_1'], product['category_2'],
+                                                            product['category_3'], url_to_scrape['url'])
+        if new_product_record_id is None:
+            # The product has been saved before the crawl was interrupted
+            new_product_record_id = self.storage.select_product_id_where_url(url_to_scrape['url'])
+
+        new_variants = list()
+        downloads = list()
+        for variant in product['variants']:
+            if isinstance(variant['additional'], list):
+                # Page cached by an older version: additional fields as a list of {name: value}
+                variant = dict(variant, additional={k: v for field in variant['additional'] for k, v in field.items()})
+            new_product_variant_id = self.insert_t_product_variants_work(variant['sku'], variant['additional'],
                                                                          new_product_record_id)
-            logging.debug(f'\tVariant: {variant_sku}')
+            logging.debug(f'\tVariant: {variant["sku"]}')
 
             if new_product_variant_id is not None:
-                variant_image_url = self.get_web_element_attribute(
-                    self.config['config_products']['variant_settings'].get('image', self.config['config_products'][
-                        'product_selectors']['image_file_name_1']['sel']),
-                    variant)
-
-                if is_none_or_empty(variant_image_url):
-                    logging.warning(
-                        f"Variant of product '{product_name}' has no image! URL: {url_to_scrape['url']}, selector: {self.config['config_products']['variant_settings']['sel']} + {self.config['config_products']['product_selectors']['image_file_name_1']['sel']}")
-                elif self.download_product_images:
-                    variant_image_url = self.download_product_image(variant_image_url)
-
-                self.insert_t_product_variant_images_work(variant_image_url, new_product_variant_id)
+                variant_image_url = variant['image_url']
+                image_record_id = self.insert_t_product_variant_images_work(variant_image_url, new_product_variant_id)
                 logging.debug(f'\t\tImage: {variant_image_url}')
-
-            variant_index += 1
+                new_variant = dict(variant)
+                new_variants.append(new_variant)
+                if (image_record_id is not None and not is_none_or_empty(variant_image_url) and
+                        self.image_downloader is not None):
+                    image_url = urljoin(url_to_scrape['url'], variant_image_url)
+                    downloads.append((new_variant, self.download_product_image(image_url, image_record_id)))
+
+        if self.results_writer is not None and new_variants:
+            product = dict(product, url=url_to_scrape['url'])
+            if downloads:
+                self.write_product_when_downloaded(product, new_variants, downloads)
+            else:
+                with self._lock, self.metrics.timer('export'):
+                    self.results_writer.write_product(product, new_variants)
+
+    def write_product_when_downloaded(self, product: dict, variants: list, downloads: list):
+        """
+        Streams the product to the results once its images are saved, so that the rows get the file names
+        :param downloads: (variant, future of the image download) pairs
+        """
+        remaining = [len(downloads)]
+
+        def on_downloaded(_):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+                for variant, download in downloads:
+                    variant['image_url'] = download.result()
+                if self.results_writer is not None:
+                    with self.metrics.timer('export'):
+                        self.results_writer.write_product(product, variants)
+
+        for _, download in downloads:
+            download.add_done_callback(on_downloaded)
 
     def get_web_element_attribute(self, selector, parent_web_element=None, element_index=0, no_warning=False):
-        if is_none_or_empty(selector):
+        """
+        :param selector: Selector from the selector plan or a selector string (compiled on the first use)
+        """
+        if not isinstance(selector, Selector):
+            selector = self.get_selector(selector)
+        if not selector:
             return None
 
-        result = None
-
-        selectors = selector.split("|")
-        for selector in selectors:
-            if selector == selectors[0] and selector.startswith('('):
-                selector = selector[1:]
-            if selector == selectors[-1] and not selector.endswith('()') and selector.endswith(')'):
-                selector = selector[:-1]
-
-            selector = selector.replace("\'", '"')
-
-            if not parent_web_element or selector.startswith('//'):
-                parent_web_element = self.browser.get_current_page_as_element()
-
-            possible_attribute = selector.split('/')[-1]
-            possible_selector = selector.replace(possible_attribute, '').rstrip('/')
-            possible_attribute = possible_attribute.lower()
-            if possible_attribute == 'text()':
-                element = self.browser.find_elements_by_xpath(possible_selector, parent_web_element)
-                if len(element):
-                    result = element[element_index].text
-                    ind = 1
-                    while is_none_or_empty(result) and ind < len(element):
-                        result = element[ind].text
-                        # TODO: add warning
-            elif possible_attribute.startswith('@'):
-                element = self.browser.find_elements_by_xpath(possible_selector, parent_web_element)
-                if len(element):
-                    result = self.browser.get_element_attribute(element[element_index], possible_attribute.lstrip('@'))
-            else:
-                element = self.browser.find_elements_by_xpath(selector, parent_web_element)
-                if len(element):
-                    result = self.browser.get_element_attribute(element[element_index], 'innerHTML')
-
-            if result is not None:
-                break
-
+        with self.metrics.timer('read_selector'):
+            result = read_selector(self.browser, selector, parent_web_element, element_index)
+        self.metrics.selector_hit(selector.source, result is not None)
         if result is None:
             if not no_warning:
-                logging.warning(f'Selector hit nothing!: {selector}, URL: {self.browser.get_current_url()}')
+                logging.warning(f'Selector hit nothing!: {selector.source}, URL: {self.browser.get_current_url()}')
             return result
 
-        return result.strip()
+        return to_string(result).strip()
+
+    def get_selector(self, selector: str) -> Selector:
+        compiled_selector = self._selectors.get(selector)
+        if compiled_selector is None:
+            compiled_selector = self._selectors[selector] = Selector(selector)
+        return compiled_selector
 
     def select_image_url_where_variant_id(self, variant_id):
-        for ik in self.t_product_variant_images_work.keys():
-            if self.t_product_variant_images_work[ik]['variant_id'] == variant_id:
-                return self.t_product_variant_images_work[ik]['url']
-        return None
+        return self.storage.select_image_url_where_variant_id(variant_id)
 
     def select_variants_where_product_key(self, product_key):
-        variants = list()
-        for vk in self.t_product_variants_work.keys():
-            if self.t_product_variants_work[vk]['product_record_id'] == product_key:
-                variants.append(self.t_product_variants_work[vk])
-        return variants
-
-    def download_product_image(self, image_url):
-        filename = basename(image_url)
-        path_to_check = os.path.join(self.product_images_folder, filename)
-        target_filename = path_to_check
-        i = 1
-        while os.path.exists(target_filename):
-            target_filename = f'{path_to_check.rsplit(".", 1)[0]}_{i}.{path_to_check.rsplit(".", 1)[1]}'
-            i += 1
-
+        return self.storage.select_variants_where_product_key(product_key)
+
+    def download_product_image(self, image_url, image_record_id):
+        """
+        Queues the image for download, the image record gets the file name when it is saved
+        :return: future of the file name (the URL if the download fails)
+        """
+        def on_downloaded(download):
+            filename = download.result()
+            if filename != image_url:
+                self.storage.update_image_url(image_record_id, filename)
+
+        download = self.image_downloader.submit(image_url)
+        download.add_done_callback(on_downloaded)
+        return download
+
+
+def crawl_worker(config: dict, tasks, results, get_interval=1.00, log_level=logging.WARNING):
+    """
+    Worker process of Scraper.scrape_with_processes: scrapes the URLs received from `tasks` and puts
+    (url_to_scrape, result, error, metrics) to `results`, metrics are CrawlMetrics.drain() since the previous page.
+    Nothing is stored by the worker. None in `tasks` stops it.
+    """
+    # Interruption is handled by the coordinating process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(processName)s %(filename)s:%(lineno)d] '
+                               '%(message)s',
+                        datefmt='%d-%m-%Y:%H:%M:%S',
+                        level=log_level)
+
+    config = copy.deepcopy(config)
+    scraper_config = config.setdefault('scraper', {})
+    processes = scraper_config.get('processes', 1)
+    scraper_config.update(storage='memory', download_product_images=False, incremental=False, processes=1,
+                          pool_size=1, output=dict(scraper_config.get('output', {}), stream=False),
+                          metrics=dict(scraper_config.get('metrics', {}), progress_interval=0, file_name=None))
+    scraper = Scraper(config)
+    # Every worker keeps its own limits, the hosts get the configured rates from all the workers together
+    scraper.host_limiter = scraper.make_host_limiter(get_interval, share=processes)
+    while True:
+        url_to_scrape = tasks.get()
+        if url_to_scrape is None:
+            break
         try:
-            r = requests.get(image_url, stream=True)
-            if r.status_code != 200:
-                logging.error(f"Error {r.status_code} downloading image {image_url}")
-                return image_url
-
-            with open(target_filename, 'wb') as f:
-                for chunk in r.iter_content(1024):
-                    f.write(chunk)
-
+            result, error = scraper.scrape_page(url_to_scrape), None
         except Exception as ex:
-            logging.error(f"Error {ex} downloading image {image_url}")
-            return image_url
+            result, error = None, f'{type(ex).__name__}: {ex}'
+        results.put((url_to_scrape, result, error, scraper.metrics.drain()))
+
+
+def distributed_worker(config: dict, worker_id: str = None, get_interval=1.00):
+    """
+    Worker of Scraper.scrape_distributed: leases links from the crawl queue, opens and parses the pages and
+    completes the leased links with the extracted links or products. The coordinator queues the links found.
+    Waits for the coordinator to start a crawl and returns when it has finished that crawl, a worker still
+    working when the coordinator starts another one (e.g. after a restart) joins it.
+    :param worker_id: name of the worker in the leases, host name and process id by default
+    """
+    config = copy.deepcopy(config)
+    scraper_config = config.setdefault('scraper', {})
+    scraper_config.update(storage='memory', download_product_images=False, incremental=False, processes=1,
+                          output=dict(scraper_config.get('output', {}), stream=False),
+                          metrics=dict(scraper_config.get('metrics', {}), progress_interval=0, file_name=None))
+    scraper = Scraper(config)
+    distributed = scraper.distributed
+    # Every worker keeps its own limits, the hosts get the configured rates from all the workers together
+    scraper.host_limiter = scraper.make_host_limiter(get_interval, share=distributed.get('workers', 1))
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    lease_timeout = distributed.get('lease_timeout', 300)
+    lease_batch = distributed.get('lease_batch', 5)
+    poll_interval = distributed.get('poll_interval', 1.0)
+
+    crawl_queue = scraper.open_crawl_queue()
+    logging.info(f'Worker {worker_id} is waiting for links')
+    # Run of the coordinator the worker has joined
+    run_id = None
+    try:
+        while True:
+            state, state_run_id = crawl_queue.get_state()
+            if state == 'running' and state_run_id != run_id:
+                run_id = state_run_id
+                logging.info(f'Worker {worker_id} has joined crawl {run_id}')
+            elif state == 'finished' and run_id is not None and state_run_id == run_id:
+                break
+
+            links = crawl_queue.lease(worker_id, lease_batch, lease_timeout) if run_id is not None else []
+            if not links:
+                time.sleep(poll_interval)
+                continue
 
-        return basename(target_filename)
+            for link in links:
+                try:
+                    result, error = scraper.scrape_page(link), None
+                except Exception as ex:
+                    result, error = None, f'{type(ex).__name__}: {ex}'
+                if not crawl_queue.complete(worker_id, PageResult(link, result, error, scraper.metrics.drain())):
+                    logging.warning(f"Lease on {link['url']} has been lost, the result is dropped")
+    finally:
+        crawl_queue.close()
+        scraper.http_client.close()
+    logging.info(f'Worker {worker_id} has finished')
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scrapes products from the website described in config.json')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the interrupted crawl kept in the storage instead of starting from scratch')
+    parser.add_argument('--processes', type=int,
+                        help='number of worker processes opening and parsing pages, overrides config.json')
+    parser.add_argument('--worker', action='store_true',
+                        help='work for the coordinator of the distributed crawl configured in config.json')
+    parser.add_argument('--worker-id', help='name of the worker in the crawl queue, host name and pid by default')
+    args = parser.parse_args()
+
     with open('config.json') as scraping_config_file:
         config_json = json.loads(scraping_config_file.read())
+    if args.processes is not None:
+        config_json.setdefault('scraper', {})['processes'] = args.processes
 
     logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
                         datefmt='%d-%m-%Y:%H:%M:%S',
                         level=logging.DEBUG)
     logging.getLogger("selenium").setLevel(logging.INFO)
 
+    if args.worker:
+        distributed_worker(config_json, args.worker_id, get_interval=0.05)
+        sys.exit(0)
+
     scraper = Scraper(config_json)
-    scraper.scrape(get_interval=0.05)
-    scraper.save_results_to_xslx('results.xlsx')
+    scraper.scrape(get_interval=0.05, resume=args.resume)
+    if not scraper.output.get('stream', False):
+        scraper.save_results()
+    scraper.storage.close()
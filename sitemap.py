@@ -0,0 +1,97 @@
+import logging
+import zlib
+
+from lxml import etree
+
+GZIP_MAGIC = b'\x1f\x8b'
+CHUNK_SIZE = 65536
+
+
+def iter_sitemap_urls(fetch, sitemap_urls: list, max_depth=3, max_urls=0):
+    """
+    Streams the page URLs of the sitemaps: the response is parsed while it is downloaded (gunzipped first if it is
+    a .gz file) and every <url> element is dropped once read, so memory does not grow with the sitemap size.
+    Sitemap indexes are followed up to `max_depth` levels, every sitemap is read once.
+    :param fetch: function url -> streamed requests.Response
+    :param max_urls: stop after this number of URLs, 0 - no limit
+    """
+    queue = [(url, 0) for url in sitemap_urls]
+    seen = set(sitemap_urls)
+    urls = 0
+    while queue:
+        sitemap_url, depth = queue.pop(0)
+        for kind, url in _iter_sitemap(fetch, sitemap_url):
+            if kind == 'sitemap':
+                if depth < max_depth and url not in seen:
+                    seen.add(url)
+                    queue.append((url, depth + 1))
+                continue
+            yield url
+            urls += 1
+            if max_urls and urls >= max_urls:
+                return
+
+
+def _iter_sitemap(fetch, sitemap_url: str):
+    """
+    :return: iterator over ("sitemap", url) of a sitemap index and ("url", url) of a URL set
+    """
+    try:
+        response = fetch(sitemap_url)
+    except Exception as ex:
+        logging.warning(f'Error fetching sitemap {sitemap_url}: {ex}')
+        return
+    try:
+        if response.status_code != 200:
+            logging.warning(f'Error {response.status_code} fetching sitemap {sitemap_url}')
+            return
+
+        parser = etree.XMLPullParser(events=('end',), resolve_entities=False, no_network=True, huge_tree=True)
+        decompressor = None
+        first_chunk = True
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if first_chunk:
+                    first_chunk = False
+                    if chunk.startswith(GZIP_MAGIC):
+                        # .xml.gz file, not a gzip Content-Encoding which requests has decoded already
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+                parser.feed(chunk)
+                yield from _read_events(parser)
+            if decompressor is not None:
+                parser.feed(decompressor.flush())
+            parser.close()
+            yield from _read_events(parser)
+        except (etree.XMLSyntaxError, zlib.error) as ex:
+            logging.warning(f'Sitemap {sitemap_url} is broken, the rest of it is skipped: {ex}')
+    finally:
+        response.close()
+
+
+def _read_events(parser: etree.XMLPullParser):
+    for _, element in parser.read_events():
+        tag = etree.QName(element).localname
+        if tag not in ('url', 'sitemap'):
+            continue
+        for child in element:
+            if isinstance(child.tag, str) and etree.QName(child).localname == 'loc' and child.text:
+                yield tag, child.text.strip()
+                break
+        # Dropping what has been read
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def parse_sitemaps(robots_txt: str) -> list:
+    """
+    :return: sitemap URLs listed in the robots.txt
+    """
+    sitemaps = list()
+    for line in robots_txt.splitlines():
+        key, _, value = line.split('#', 1)[0].partition(':')
+        if key.strip().lower() == 'sitemap' and value.strip():
+            sitemaps.append(value.strip())
+    return sitemaps
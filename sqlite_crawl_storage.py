@@ -0,0 +1,280 @@
+import json
+import logging
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from abc_crawl_storage import ABCCrawlStorage, LinkRecord
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS t_links_work (
+    record_id INTEGER PRIMARY KEY,
+    link_key TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    url_type_id INTEGER NOT NULL,
+    depth INTEGER NOT NULL DEFAULT 0,
+    retrieved TEXT,
+    parent_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS t_products_work (
+    record_id INTEGER PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    category_1 TEXT,
+    category_2 TEXT,
+    category_3 TEXT,
+    url TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS t_product_variants_work (
+    record_id INTEGER PRIMARY KEY,
+    sku TEXT,
+    additional TEXT,
+    product_record_id INTEGER,
+    UNIQUE (sku, product_record_id)
+);
+CREATE TABLE IF NOT EXISTS t_product_variant_images_work (
+    record_id INTEGER PRIMARY KEY,
+    url TEXT,
+    variant_id INTEGER,
+    UNIQUE (url, variant_id)
+);
+CREATE INDEX IF NOT EXISTS ix_product_variants_work_product_record_id ON t_product_variants_work (product_record_id);
+CREATE INDEX IF NOT EXISTS ix_product_variant_images_work_variant_id ON t_product_variant_images_work (variant_id);
+CREATE TABLE IF NOT EXISTS t_pages_cache (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    body_hash TEXT,
+    result TEXT,
+    crawl_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS t_crawl_settings (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SqliteCrawlStorage(ABCCrawlStorage):
+    """
+    Keeps the crawl state in an SQLite file, so that an interrupted crawl can be resumed.
+    Links are unique by their link key (the canonical URL of Scraper.link_key), not by the raw URL.
+    Changes are committed every `checkpoint_every` retrieved links and on checkpoint().
+    The file belongs to one storage at a time: it is locked (<file_name>.lock) until close(), another storage
+    opening it raises RuntimeError instead of sharing or clearing the tables of a running crawl.
+    """
+
+    def __init__(self, **kvargs):
+        """
+        :param kvargs: file_name, checkpoint_every, link_key (function (url, url_type_id) -> unique key of the link)
+        """
+        self.file_name = kvargs.get('file_name', 'scraping_state.sqlite')
+        self.checkpoint_every = kvargs.get('checkpoint_every', 100)
+        self._link_key = kvargs.get('link_key', lambda url, url_type_id: f'{url_type_id} {url}')
+        self._retrieved_since_checkpoint = 0
+        self._lock = threading.RLock()
+        self._lock_file = self._lock_state_file(f'{self.file_name}.lock')
+
+        self._connection = sqlite3.connect(self.file_name, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        columns = [row['name'] for row in self._connection.execute('PRAGMA table_info(t_links_work)')]
+        if 'parent_id' not in columns:
+            # File of an older version
+            self._connection.execute('ALTER TABLE t_links_work ADD COLUMN parent_id INTEGER')
+        if 'link_key' not in columns:
+            self._add_link_keys()
+        self._connection.commit()
+        self._crawl_id = int(self._select_setting('crawl_id') or 1)
+        logging.debug(f'Crawl state is stored in {self.file_name}')
+
+        super().__init__(**kvargs)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+            if self._lock_file is not None:
+                # Closing the file releases the lock
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _add_link_keys(self):
+        """
+        Keys the links of a file of an older version, unique by the raw URL: links with the same key but the first
+        one are dropped
+        """
+        self._connection.execute('ALTER TABLE t_links_work ADD COLUMN link_key TEXT')
+        self._connection.executemany(
+            'UPDATE t_links_work SET link_key = ? WHERE record_id = ?',
+            [(self._link_key(row['url'], row['url_type_id']), row['record_id'])
+             for row in self._connection.execute('SELECT record_id, url, url_type_id FROM t_links_work')])
+        self._connection.execute('DELETE FROM t_links_work WHERE record_id NOT IN '
+                                 '(SELECT MIN(record_id) FROM t_links_work GROUP BY link_key)')
+        self._connection.execute('CREATE UNIQUE INDEX ix_links_work_link_key ON t_links_work (link_key)')
+
+    def _lock_state_file(self, lock_file_name: str):
+        """
+        :return: the open lock file, the lock lasts until it is closed
+        """
+        lock_file = open(lock_file_name, 'a')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(f'Crawl state file {self.file_name} is used by another crawl, '
+                               f'set config["scraper"]["storage_file"] to another file')
+        return lock_file
+
+    def checkpoint(self):
+        with self._lock:
+            self._connection.commit()
+            self._retrieved_since_checkpoint = 0
+
+    def clear(self):
+        with self._lock:
+            for table in ('t_links_work', 't_products_work', 't_product_variants_work',
+                          't_product_variant_images_work'):
+                self._connection.execute(f'DELETE FROM {table}')
+            self._crawl_id += 1
+            self._connection.execute('INSERT OR REPLACE INTO t_crawl_settings (name, value) VALUES (?, ?)',
+                                     ('crawl_id', str(self._crawl_id)))
+            self._connection.commit()
+
+    def insert_link(self, url: str, url_type_id: int, depth: int, parent_id: int = None) -> LinkRecord or None:
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO t_links_work (link_key, url, url_type_id, depth, parent_id) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (self._link_key(url, url_type_id), url, url_type_id, depth, parent_id))
+            if not cursor.rowcount:
+                return None
+            return LinkRecord(url, url_type_id, depth, cursor.lastrowid, parent_id=parent_id)
+
+    def mark_link_retrieved(self, record_id: int, retrieved):
+        with self._lock:
+            self._connection.execute('UPDATE t_links_work SET retrieved = ? WHERE record_id = ?',
+                                     (retrieved.isoformat(), record_id))
+            self._retrieved_since_checkpoint += 1
+            if self._retrieved_since_checkpoint >= self.checkpoint_every:
+                self.checkpoint()
+
+    def select_links(self):
+        # Reading in pages, so that millions of links are not loaded at once
+        last_record_id = -1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    'SELECT * FROM t_links_work WHERE record_id > ? ORDER BY record_id LIMIT 10000',
+                    (last_record_id,)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield LinkRecord(row['url'], row['url_type_id'], row['depth'], row['record_id'], row['retrieved'],
+                                 row['parent_id'])
+            last_record_id = rows[-1]['record_id']
+
+    def insert_product(self, name: str, description: str or None, category_1: str or None,
+                       category_2: str or None, category_3: str or None, url: str) -> int or None:
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO t_products_work (name, description, category_1, category_2, category_3, url) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (name, description, category_1, category_2, category_3, url))
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def select_product_id_where_url(self, url: str) -> int or None:
+        with self._lock:
+            row = self._connection.execute('SELECT record_id FROM t_products_work WHERE url = ?', (url,)).fetchone()
+        return row['record_id'] if row is not None else None
+
+    def select_products(self):
+        # Reading in pages, so that the lock is not held while the caller processes the products
+        last_record_id = -1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    'SELECT * FROM t_products_work WHERE record_id > ? ORDER BY record_id LIMIT 1000',
+                    (last_record_id,)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+            last_record_id = rows[-1]['record_id']
+
+    def insert_variant(self, sku: str, additional: dict, product_record_id: int) -> int or None:
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO t_product_variants_work (sku, additional, product_record_id) VALUES (?, ?, ?)',
+                (sku, json.dumps(additional), product_record_id))
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def select_variants_where_product_key(self, product_key: int) -> list:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT * FROM t_product_variants_work WHERE product_record_id = ? ORDER BY record_id',
+                (product_key,)).fetchall()
+        return [dict(row, additional=json.loads(row['additional'])) for row in rows]
+
+    def insert_image(self, url: str, variant_id: int) -> int or None:
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT OR IGNORE INTO t_product_variant_images_work (url, variant_id) VALUES (?, ?)',
+                (url, variant_id))
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def update_image_url(self, record_id: int, url: str):
+        with self._lock:
+            self._connection.execute('UPDATE OR IGNORE t_product_variant_images_work SET url = ? WHERE record_id = ?',
+                                     (url, record_id))
+
+    def select_images_where_variant_id(self, variant_id: int) -> list:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT * FROM t_product_variant_images_work WHERE variant_id = ? ORDER BY record_id',
+                (variant_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def select_image_url_where_variant_id(self, variant_id: int) -> str or None:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT url FROM t_product_variant_images_work WHERE variant_id = ? ORDER BY record_id LIMIT 1',
+                (variant_id,)).fetchone()
+        return row['url'] if row is not None else None
+
+    def select_page_cache(self, url: str) -> dict or None:
+        with self._lock:
+            row = self._connection.execute('SELECT * FROM t_pages_cache WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        return dict(row, result=json.loads(row['result']))
+
+    def save_page_cache(self, url: str, etag: str or None, last_modified: str or None, body_hash: str or None,
+                        result):
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO t_pages_cache (url, etag, last_modified, body_hash, result, crawl_id) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, body_hash, json.dumps(result), self._crawl_id))
+
+    def purge_page_cache(self) -> int:
+        with self._lock:
+            cursor = self._connection.execute('DELETE FROM t_pages_cache WHERE crawl_id != ?', (self._crawl_id,))
+            self._connection.commit()
+            return cursor.rowcount
+
+    def _select_setting(self, name):
+        row = self._connection.execute('SELECT value FROM t_crawl_settings WHERE name = ?', (name,)).fetchone()
+        return row['value'] if row is not None else None
@@ -0,0 +1,194 @@
+import json
+import logging
+
+from lxml import etree
+
+PRODUCT_TYPES = ('Product', 'ProductGroup', 'IndividualProduct', 'ProductModel')
+SKU_PROPERTIES = ('sku', 'mpn', 'productID', 'gtin13', 'gtin12', 'gtin14', 'gtin8', 'gtin')
+
+_json_ld_scripts = etree.XPath("//script[@type='application/ld+json']")
+_microdata_items = etree.XPath('//*[@itemscope and @itemtype]')
+
+
+def read_product(tree) -> dict or None:
+    """
+    Reads the first schema.org Product of the page from its JSON-LD or microdata
+    :param tree: parsed page
+    :return: {'fields': {name: value}, 'variants': [{name: value}]} with the names of
+             SelectorPlan.product_batch (name, description, category1..3; sku, image), values are not stripped.
+             None if the page has no Product with a name and a SKU.
+    """
+    products, breadcrumbs = read_json_ld(tree)
+    if not products:
+        products, microdata_breadcrumbs = read_microdata(tree)
+        breadcrumbs = breadcrumbs or microdata_breadcrumbs
+    for product in products:
+        page = product_page(product, breadcrumbs)
+        if page is not None:
+            return page
+    return None
+
+
+def product_page(product: dict, breadcrumbs: list) -> dict or None:
+    name = text_value(product.get('name'))
+    if not name:
+        return None
+    image = image_url(product.get('image'))
+
+    variants = list()
+    for variant in as_list(product.get('hasVariant')):
+        if isinstance(variant, dict) and sku_of(variant):
+            variants.append({'sku': sku_of(variant), 'image': image_url(variant.get('image')) or image})
+    if not variants:
+        for offer in as_list(product.get('offers')):
+            if isinstance(offer, dict) and sku_of(offer):
+                variants.append({'sku': sku_of(offer), 'image': image})
+    if not variants and sku_of(product):
+        variants.append({'sku': sku_of(product), 'image': image})
+    if not variants:
+        return None
+
+    categories = [c for c in breadcrumbs if c != name]
+    if not categories and product.get('category'):
+        category = text_value(product['category'])
+        categories = [c.strip() for c in category.replace('>', '/').split('/') if c.strip()] if category else []
+    categories = (categories + [None] * 3)[:3]
+    return {'fields': {'name': name,
+                       'description': text_value(product.get('description')),
+                       'category1': categories[0],
+                       'category2': categories[1],
+                       'category3': categories[2]},
+            'variants': variants}
+
+
+def read_json_ld(tree) -> tuple:
+    """
+    :return: Product nodes and the names of the first BreadcrumbList of the JSON-LD blocks
+    """
+    products = list()
+    breadcrumbs = list()
+    for script in _json_ld_scripts(tree):
+        try:
+            data = json.loads(script.text or '', strict=False)
+        except ValueError as ex:
+            logging.debug(f'Invalid JSON-LD block: {ex}')
+            continue
+
+        nodes = as_list(data)
+        while nodes:
+            node = nodes.pop(0)
+            if not isinstance(node, dict):
+                continue
+            nodes.extend(as_list(node.get('@graph')))
+            types = as_list(node.get('@type'))
+            if any(t in PRODUCT_TYPES for t in types):
+                products.append(node)
+            elif 'BreadcrumbList' in types and not breadcrumbs:
+                breadcrumbs = breadcrumb_names(node)
+    return products, breadcrumbs
+
+
+def breadcrumb_names(node: dict) -> list:
+    items = [item for item in as_list(node.get('itemListElement')) if isinstance(item, dict)]
+    items.sort(key=position)
+    names = list()
+    for item in items:
+        name = item.get('name')
+        if name is None and isinstance(item.get('item'), dict):
+            name = item['item'].get('name')
+        if text_value(name):
+            names.append(text_value(name))
+    return names
+
+
+def read_microdata(tree) -> tuple:
+    """
+    :return: Products (as dicts of their properties) and the names of the first BreadcrumbList of the microdata
+    """
+    products = list()
+    breadcrumbs = list()
+    for item in _microdata_items(tree):
+        item_type = item.get('itemtype').rstrip('/').rsplit('/', 1)[-1]
+        if item.get('itemprop') and item_type not in PRODUCT_TYPES:
+            # Nested items are read with their parent
+            continue
+        if item_type in PRODUCT_TYPES:
+            products.append(microdata_properties(item))
+        elif item_type == 'BreadcrumbList' and not breadcrumbs:
+            breadcrumbs = breadcrumb_names(microdata_properties(item))
+    return products, breadcrumbs
+
+
+def position(item: dict) -> int:
+    try:
+        return int(item.get('position'))
+    except (TypeError, ValueError):
+        return 0
+
+
+def microdata_properties(item) -> dict:
+    """
+    :return: properties of the item, nested items as dicts, repeated properties as lists
+    """
+    properties = dict()
+    for element in item.iterdescendants():
+        if not isinstance(element.tag, str) or element.get('itemprop') is None:
+            continue
+        # Properties of nested items belong to them
+        parent = element.getparent()
+        while parent is not item and parent.get('itemscope') is None:
+            parent = parent.getparent()
+        if parent is not item:
+            continue
+
+        value = microdata_properties(element) if element.get('itemscope') is not None else microdata_value(element)
+        for name in element.get('itemprop').split():
+            if name in properties:
+                properties[name] = as_list(properties[name]) + [value]
+            else:
+                properties[name] = value
+    return properties
+
+
+def microdata_value(element) -> str:
+    if element.get('content') is not None:
+        return element.get('content')
+    tag = element.tag.lower()
+    if tag in ('a', 'link', 'area'):
+        return element.get('href')
+    if tag in ('img', 'source', 'video', 'audio', 'iframe', 'embed'):
+        return element.get('src')
+    return element.text_content()
+
+
+def sku_of(node: dict) -> str or None:
+    for name in SKU_PROPERTIES:
+        value = text_value(node.get(name))
+        if value:
+            return value
+    return None
+
+
+def image_url(value) -> str or None:
+    for image in as_list(value):
+        if isinstance(image, dict):
+            image = image.get('contentUrl') or image.get('url')
+        if text_value(image):
+            return text_value(image)
+    return None
+
+
+def text_value(value) -> str or None:
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        value = value.get('name') or value.get('@value')
+    if value is None:
+        return None
+    return str(value) if str(value).strip() else None
+
+
+def as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
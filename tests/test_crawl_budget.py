@@ -0,0 +1,91 @@
+"""
+Page and depth limits of the crawl budget and pruning of low-yield URL families.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+from crawl_budget import CrawlBudget, url_family  # noqa: E402
+from crawl_metrics import CrawlMetrics  # noqa: E402
+
+
+class CrawlBudgetLimitsTest(unittest.TestCase):
+
+    def test_take_stops_at_max_pages(self):
+        budget = CrawlBudget(max_pages=3)
+        for page in range(3):
+            self.assertIsNone(budget.exhausted())
+            self.assertTrue(budget.take(f'http://shop.test/p/{page}', False))
+        self.assertEqual(budget.pages, 3)
+        self.assertEqual(budget.exhausted(), '3 pages scraped')
+
+    def test_without_max_pages_the_budget_lasts(self):
+        budget = CrawlBudget()
+        for page in range(100):
+            budget.take(f'http://shop.test/p/{page}', False)
+        self.assertIsNone(budget.exhausted())
+
+    def test_catalogues_deeper_than_max_depth_are_not_queued(self):
+        metrics = CrawlMetrics()
+        budget = CrawlBudget(max_depth=2, metrics=metrics)
+        self.assertTrue(budget.allows_link('http://shop.test/c/2', True, 2))
+        self.assertFalse(budget.allows_link('http://shop.test/c/3', True, 3))
+        # Products found on the deepest catalogue are still scraped
+        self.assertTrue(budget.allows_link('http://shop.test/p/3', False, 3))
+        self.assertEqual(metrics.counters['links_too_deep'], 1)
+
+    def test_excluded_urls_are_not_queued(self):
+        budget = CrawlBudget(exclude_regexps=[r'.*/cart'])
+        self.assertFalse(budget.allows_link('http://shop.test/cart', False, 1))
+        self.assertTrue(budget.allows_link('http://shop.test/p/1', False, 1))
+
+
+class CrawlBudgetLowYieldTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = CrawlMetrics()
+        self.budget = CrawlBudget(low_yield=dict(enabled=True, min_pages=3, min_yield=0), metrics=self.metrics)
+
+    def test_url_family(self):
+        self.assertEqual(url_family('http://Shop.test/c/12/shoes?sort=price&color=red&color=blue'),
+                         'shop.test/c/*/shoes?color&sort')
+        self.assertIsNone(url_family('http://shop.test/c/12/shoes'))
+
+    def test_family_is_pruned_after_min_pages_without_products(self):
+        for page in range(2):
+            self.budget.record_yield(f'http://shop.test/c?sort=price&page={page}', 0)
+        self.assertFalse(self.budget.is_pruned('http://shop.test/c?sort=name&page=9'))
+        self.assertTrue(self.budget.allows_link('http://shop.test/c?sort=name&page=9', True, 1))
+
+        self.budget.record_yield('http://shop.test/c?sort=price&page=2', 0)
+        self.assertTrue(self.budget.is_pruned('http://shop.test/c?sort=name&page=9'))
+        self.assertFalse(self.budget.allows_link('http://shop.test/c?sort=name&page=9', True, 1))
+        # A link queued before the pruning is dropped when it is popped, without counting a page
+        self.assertFalse(self.budget.take('http://shop.test/c?sort=date&page=1', True))
+        self.assertEqual(self.budget.pages, 0)
+        self.assertEqual(self.metrics.counters['families_pruned'], 1)
+        self.assertEqual(self.metrics.counters['links_pruned'], 2)
+        self.assertEqual(self.budget.pruned_families, ['shop.test/c?page&sort'])
+
+    def test_family_yielding_products_is_not_pruned(self):
+        self.budget.record_yield('http://shop.test/c?page=0', 0)
+        self.budget.record_yield('http://shop.test/c?page=1', 2)
+        for page in range(2, 6):
+            self.budget.record_yield(f'http://shop.test/c?page={page}', 0)
+        self.assertFalse(self.budget.is_pruned('http://shop.test/c?page=6'))
+
+    def test_other_families_and_products_are_not_pruned(self):
+        for page in range(3):
+            self.budget.record_yield(f'http://shop.test/c?page={page}', 0)
+        self.assertTrue(self.budget.allows_link('http://shop.test/c?sort=price', True, 1))
+        self.assertTrue(self.budget.allows_link('http://shop.test/c/1?page=1', True, 1))
+        self.assertTrue(self.budget.allows_link('http://shop.test/c?page=7', False, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,436 @@
+"""
+Crawl queues of the distributed crawl and a coordinator with workers crawling the synthetic site of
+benchmarks/fixture_site.py, run locally: the Redis queue talks to RedisStandIn instead of a Redis server.
+
+    python -m unittest discover tests
+"""
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+sys.path.insert(0, os.path.join(PACKAGE_DIR, 'benchmarks'))
+
+from crawl_queue import PageResult, RedisCrawlQueue, SqliteCrawlQueue  # noqa: E402
+from fixture_site import FixtureSite, SiteOptions  # noqa: E402
+from selenium_scraper import Scraper, distributed_worker  # noqa: E402
+
+
+try:
+    from redis import WatchError
+except ImportError:
+    class WatchError(Exception):
+        """redis.WatchError, the redis package is not required by the tests"""
+
+
+class RedisStandIn(object):
+    """
+    In-memory stand-in for the redis.Redis client (decode_responses=True) with the commands of RedisCrawlQueue.
+    Commands run one at a time, like on a Redis server. Transactions are optimistic like those of redis-py:
+    EXEC raises WatchError if a watched key has been changed since WATCH, and the transaction is run again.
+    :param fail_first_exec: the first EXEC of every transaction raises WatchError, as if a watched key had changed
+    """
+
+    def __init__(self, fail_first_exec=False):
+        self.fail_first_exec = fail_first_exec
+        self.watch_errors = 0
+        self._lock = threading.RLock()
+        self._data = dict()
+        self._versions = dict()
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        attempt = 0
+        while True:
+            pipe = _PipelineStandIn(self, watches, fail_exec=self.fail_first_exec and attempt == 0)
+            attempt += 1
+            try:
+                value = func(pipe)
+                results = pipe.execute()
+            except WatchError:
+                with self._lock:
+                    self.watch_errors += 1
+                continue
+            return value if value_from_callable else results
+
+    def _exec(self, watched: dict, commands: list, fail: bool) -> list:
+        with self._lock:
+            if fail or any(self._versions.get(key, 0) != version for key, version in watched.items()):
+                raise WatchError('Watched variable changed.')
+            return [getattr(self, name)(*args, **kvargs) for name, args, kvargs in commands]
+
+    def _changed(self, key):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._changed(key)
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._changed(key)
+            self._data[key] = str(value)
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._changed(key)
+            values = self._data.setdefault(key, set())
+            added = set(map(str, members)) - values
+            values.update(added)
+            return len(added)
+
+    def smismember(self, key, members):
+        with self._lock:
+            values = self._data.get(key, set())
+            return [int(str(member) in values) for member in members]
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            self._changed(key)
+            values = self._data.setdefault(key, dict())
+            mapping = dict(mapping or {}, **({field: value} if field is not None else {}))
+            values.update({str(k): str(v) for k, v in mapping.items()})
+            return len(mapping)
+
+    def hget(self, key, field):
+        return self._data.get(key, {}).get(str(field))
+
+    def hmget(self, key, fields):
+        with self._lock:
+            values = self._data.get(key, {})
+            return [values.get(str(field)) for field in fields]
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            self._changed(key)
+            values = self._data.get(key, {})
+            return sum(values.pop(str(field), None) is not None for field in fields)
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            self._changed(key)
+            values = self._data.setdefault(key, dict())
+            values[str(field)] = str(int(values.get(str(field), 0)) + amount)
+            return int(values[str(field)])
+
+    def rpush(self, key, *values):
+        with self._lock:
+            self._changed(key)
+            items = self._data.setdefault(key, list())
+            items.extend(map(str, values))
+            return len(items)
+
+    def lpop(self, key):
+        with self._lock:
+            self._changed(key)
+            items = self._data.get(key)
+            return items.pop(0) if items else None
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            items = self._data.get(key, [])
+            return items[start:] if end == -1 else items[start:end + 1]
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            self._changed(key)
+            self._data[key] = self.lrange(key, start, end)
+
+    def llen(self, key):
+        return len(self._data.get(key, []))
+
+    def zadd(self, key, mapping):
+        with self._lock:
+            self._changed(key)
+            scores = self._data.setdefault(key, dict())
+            scores.update({str(member): float(score) for member, score in mapping.items()})
+            return len(mapping)
+
+    def zrem(self, key, *members):
+        with self._lock:
+            self._changed(key)
+            scores = self._data.get(key, {})
+            return sum(scores.pop(str(member), None) is not None for member in members)
+
+    def zscore(self, key, member):
+        return self._data.get(key, {}).get(str(member))
+
+    def zrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        with self._lock:
+            scores = sorted(self._data.get(key, {}).items(), key=lambda item: item[1])
+        return [member for member, score in scores if low <= score <= high]
+
+    def zcard(self, key):
+        return len(self._data.get(key, {}))
+
+
+class _PipelineStandIn(object):
+    """
+    Pipeline of RedisStandIn.transaction: the watched keys are versioned when it is created (WATCH), commands
+    answer at once before multi(), afterwards they are queued and run by execute() (EXEC)
+    """
+
+    def __init__(self, client: RedisStandIn, watches, fail_exec=False):
+        self._client = client
+        self._fail_exec = fail_exec
+        self._queued = None
+        with client._lock:
+            self._watched = {key: client._versions.get(key, 0) for key in watches}
+
+    def multi(self):
+        self._queued = list()
+
+    def execute(self) -> list:
+        if self._queued is None:
+            # No MULTI: nothing is written, EXEC is not sent
+            return []
+        return self._client._exec(self._watched, self._queued, self._fail_exec)
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+        if self._queued is None:
+            return command
+
+        def queue_command(*args, **kvargs):
+            self._queued.append((name, args, kvargs))
+            return self
+
+        return queue_command
+
+
+class CrawlQueueTests(object):
+    """Behaviour shared by the crawl queues, mixed into a TestCase per queue"""
+
+    def make_queue(self, **kvargs):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.queue = self.make_queue(max_attempts=2)
+        self.queue.clear()
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_push_links_skips_duplicates(self):
+        self.assertEqual(self.queue.push_links([('k1', 'u1', 0, 0), ('k2', 'u2', 1, 1), ('k1', 'u1b', 0, 0)]), 2)
+        self.assertEqual(self.queue.push_links([('k2', 'u2', 1, 1), ('k3', 'u3', 1, 1)]), 1)
+        self.assertEqual(self.queue.counts(), {'pending': 3, 'leased': 0, 'results': 0})
+
+    def test_lease_complete_collect(self):
+        self.queue.push_links([('k1', 'u1', 0, 0), ('k2', 'u2', 1, 1)])
+        first = self.queue.lease('A', 1, 60)
+        second = self.queue.lease('B', 5, 60)
+        self.assertEqual([link['url'] for link in first], ['u1'])
+        self.assertEqual([link['url'] for link in second], ['u2'])
+        self.assertEqual(self.queue.lease('C', 5, 60), [])
+
+        self.assertFalse(self.queue.complete('B', PageResult(first[0], {'x': 1})))
+        self.assertTrue(self.queue.complete('A', PageResult(first[0], {'x': 1}, None, {'counters': {}})))
+        self.assertTrue(self.queue.complete('B', PageResult(second[0], None, 'error')))
+        self.assertFalse(self.queue.complete('B', PageResult(second[0], None, 'error')))
+
+        results = self.queue.collect(10)
+        self.assertEqual([(r.link['url'], r.link['depth'], r.result, r.error) for r in results],
+                         [('u1', 0, {'x': 1}, None), ('u2', 1, None, 'error')])
+        self.assertTrue(self.queue.is_drained())
+
+    def test_expired_lease_is_leased_again_then_given_up(self):
+        self.queue.push_links([('k1', 'u1', 0, 0)])
+        lost = self.queue.lease('A', 1, 0.05)
+        time.sleep(0.1)
+        with self.assertLogs(level='WARNING'):
+            again = self.queue.lease('B', 1, 0.05)
+        self.assertEqual([link['record_id'] for link in again], [lost[0]['record_id']])
+        self.assertFalse(self.queue.complete('A', PageResult(lost[0], {'x': 1})))
+
+        time.sleep(0.1)
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(self.queue.lease('C', 1, 60), [])
+        self.assertTrue(self.queue.is_drained())
+
+    def test_concurrent_workers_lease_every_link_once(self):
+        self.queue.push_links([(f'k{i}', f'u{i}', 1, 1) for i in range(200)])
+        leased = list()
+        lock = threading.Lock()
+
+        def work(worker_id):
+            while True:
+                links = self.queue.lease(worker_id, 3, 60)
+                if not links:
+                    return
+                with lock:
+                    leased.extend(link['record_id'] for link in links)
+                for link in links:
+                    self.assertTrue(self.queue.complete(worker_id, PageResult(link, None)))
+
+        workers = [threading.Thread(target=work, args=(f'w{i}',)) for i in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sorted(leased), sorted(set(leased)))
+        self.assertEqual(len(leased), 200)
+        self.assertEqual(len(self.queue.collect(1000)), 200)
+
+    def test_state_has_the_run_id(self):
+        self.assertEqual(self.queue.get_state(), (None, None))
+        self.queue.set_state('seeding', 'r1')
+        self.queue.set_state('running', 'r1')
+        self.assertEqual(self.queue.get_state(), ('running', 'r1'))
+        self.queue.clear()
+        self.assertEqual(self.queue.get_state(), (None, None))
+
+
+class SqliteCrawlQueueTest(CrawlQueueTests, unittest.TestCase):
+
+    def make_queue(self, **kvargs):
+        self.work_dir = tempfile.mkdtemp(prefix='test_crawl_queue_')
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+        return SqliteCrawlQueue(file_name=os.path.join(self.work_dir, 'queue.sqlite'), **kvargs)
+
+
+class RedisCrawlQueueTest(CrawlQueueTests, unittest.TestCase):
+
+    def make_queue(self, **kvargs):
+        return RedisCrawlQueue(client=RedisStandIn(), prefix='test', **kvargs)
+
+
+class RedisCrawlQueueWatchErrorTest(CrawlQueueTests, unittest.TestCase):
+    """The shared tests again, every transaction fails its first EXEC as if another worker had changed the queue"""
+
+    def make_queue(self, **kvargs):
+        self.client = RedisStandIn(fail_first_exec=True)
+        return RedisCrawlQueue(client=self.client, prefix='test', **kvargs)
+
+    def test_transactions_are_retried_and_lease_every_link_once(self):
+        self.assertEqual(self.queue.push_links([(f'k{i}', f'u{i}', 1, 1) for i in range(10)]), 10)
+        self.assertEqual(self.client.watch_errors, 1)
+
+        leased = self.queue.lease('A', 4, 60) + self.queue.lease('B', 10, 60)
+        self.assertEqual(self.client.watch_errors, 3)
+        self.assertEqual(sorted(link['record_id'] for link in leased), list(range(1, 11)))
+        self.assertEqual(self.client.hmget('test:attempts', list(range(1, 11))), ['1'] * 10)
+
+        for link in leased:
+            self.assertTrue(self.queue.complete('A' if link in leased[:4] else 'B', PageResult(link, None)))
+        self.assertEqual(self.client.watch_errors, 13)
+        self.assertEqual(self.queue.counts(), {'pending': 0, 'leased': 0, 'results': 10})
+        self.assertEqual(sorted(r.link['record_id'] for r in self.queue.collect(100)), list(range(1, 11)))
+
+
+class DistributedCrawlTest(unittest.TestCase):
+    """A coordinator and worker threads crawl the fixture site through the crawl queues"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.site = FixtureSite(SiteOptions(products=60, products_per_page=6, pages_per_catalogue=2))
+        cls.site.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.site.__exit__(None, None, None)
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='test_distributed_')
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+        current_dir = os.getcwd()
+        os.chdir(self.work_dir)
+        self.addCleanup(os.chdir, current_dir)
+
+    def crawl_config(self, **distributed) -> dict:
+        with open(os.path.join(PACKAGE_DIR, 'config.json')) as config_file:
+            config = json.load(config_file)
+        config = copy.deepcopy(config)
+        config['initial_url'] = f'{self.site.url}/au/en/professional/'
+        for links in ('links', 'products'):
+            config['config_links'][links]['regexps'] = [f'{self.site.url}/au/en/.*']
+        config_products = config['config_products']
+        if '-additional_selectors' in config_products:
+            config_products['additional_selectors'] = config_products.pop('-additional_selectors')
+        config['scraper'].update(browser='lxml', storage='memory', download_product_images=False,
+                                 politeness=dict(config['scraper'].get('politeness', {}), max_rate=0),
+                                 metrics=dict(enabled=True, progress_interval=0, file_name=''),
+                                 distributed=dict(config['scraper'].get('distributed', {}), **distributed))
+        return config
+
+    @staticmethod
+    def product_urls(scraper: Scraper) -> list:
+        return sorted(product['url'] for product in scraper.storage.select_products())
+
+    def crawl(self, config: dict, workers=2, head_start=0.0) -> Scraper:
+        """
+        Runs a coordinator and worker threads started `head_start` seconds before it
+        :return: the coordinator
+        """
+        threads = [threading.Thread(target=distributed_worker, args=(config, f'w{i}', 0)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(head_start)
+        coordinator = Scraper(config)
+        coordinator.scrape(get_interval=0)
+        for thread in threads:
+            thread.join(timeout=30)
+            self.assertFalse(thread.is_alive())
+        return coordinator
+
+    def test_workers_crawl_the_site_like_a_local_crawl(self):
+        local = Scraper(self.crawl_config())
+        local.scrape(get_interval=0)
+        self.assertEqual(len(self.product_urls(local)), 60)
+
+        client = RedisStandIn()
+        config = self.crawl_config(enabled=True, queue='redis', workers=2, lease_batch=3, lease_timeout=30,
+                                   poll_interval=0.05)
+        with mock.patch.object(Scraper, 'open_crawl_queue',
+                               lambda scraper: RedisCrawlQueue(client=client, prefix='test')):
+            coordinator = self.crawl(config)
+
+        self.assertEqual(self.product_urls(coordinator), self.product_urls(local))
+        self.assertEqual(RedisCrawlQueue(client=client, prefix='test').get_state()[0], 'finished')
+
+    def test_page_budget_is_shared_by_the_workers(self):
+        client = RedisStandIn()
+        config = self.crawl_config(enabled=True, queue='redis', workers=2, lease_batch=2, lease_timeout=30,
+                                   poll_interval=0.05)
+        config['scraper']['budget'] = dict(max_pages=7)
+        with mock.patch.object(Scraper, 'open_crawl_queue',
+                               lambda scraper: RedisCrawlQueue(client=client, prefix='test')):
+            coordinator = self.crawl(config)
+
+        self.assertEqual(coordinator.metrics.counters['pages'], 7)
+        self.assertEqual(client.llen('test:pending'), 0)
+
+    def test_workers_started_before_the_coordinator_of_a_reused_queue(self):
+        # The SQLite queue file of the working directory is kept from one crawl to the next
+        config = self.crawl_config(enabled=True, queue='sqlite', workers=1, lease_batch=3, lease_timeout=30,
+                                   poll_interval=0.05)
+        for _ in range(2):
+            coordinator = self.crawl(config, workers=1, head_start=0.3)
+            self.assertEqual(len(self.product_urls(coordinator)), 60)
+
+    def test_coordinator_without_workers_warns_then_gives_up(self):
+        config = self.crawl_config(enabled=True, queue='redis', lease_timeout=0.1, idle_timeout=0.5,
+                                   poll_interval=0.05)
+        client = RedisStandIn()
+        with mock.patch.object(Scraper, 'open_crawl_queue',
+                               lambda scraper: RedisCrawlQueue(client=client, prefix='test')):
+            with self.assertLogs(level='WARNING') as logs, self.assertRaises(RuntimeError):
+                self.crawl(config, workers=0)
+        self.assertTrue(any('No page has been completed' in line for line in logs.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Link keys of the crawl storages: URL variants with the same canonical URL are stored once.
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+from memory_crawl_storage import MemoryCrawlStorage  # noqa: E402
+from sqlite_crawl_storage import SqliteCrawlStorage  # noqa: E402
+from url_dedup import canonicalize_url  # noqa: E402
+
+
+def link_key(url: str, url_type_id: int) -> str:
+    return f'{url_type_id} {canonicalize_url(url)}'
+
+
+class SqliteCrawlStorageLinkKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='test_crawl_storage_')
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+        self.file_name = os.path.join(self.work_dir, 'state.sqlite')
+
+    def test_url_variants_are_stored_once(self):
+        storage = SqliteCrawlStorage(file_name=self.file_name, link_key=link_key)
+        self.addCleanup(storage.close)
+        self.assertIsNotNone(storage.insert_link('http://Shop.test:80/c?b=2&a=1#top', 0, 0))
+        self.assertIsNone(storage.insert_link('http://shop.test/c?a=1&b=2&utm_source=mail', 0, 1))
+        self.assertIsNotNone(storage.insert_link('http://shop.test/c?a=1&b=2', 1, 1))
+        self.assertEqual([(link['url'], link['url_type_id']) for link in storage.select_links()],
+                         [('http://Shop.test:80/c?b=2&a=1#top', 0), ('http://shop.test/c?a=1&b=2', 1)])
+
+    def test_file_of_an_older_version_gets_the_link_keys(self):
+        connection = sqlite3.connect(self.file_name)
+        connection.executescript("""
+            CREATE TABLE t_links_work (
+                record_id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                url_type_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL DEFAULT 0,
+                retrieved TEXT,
+                UNIQUE (url, url_type_id)
+            );
+            INSERT INTO t_links_work (url, url_type_id) VALUES ('http://shop.test/c?a=1', 0);
+            INSERT INTO t_links_work (url, url_type_id) VALUES ('http://shop.test/p', 1);
+            INSERT INTO t_links_work (url, url_type_id) VALUES ('http://shop.test/c?a=1&gclid=x', 0);
+        """)
+        connection.close()
+
+        storage = SqliteCrawlStorage(file_name=self.file_name, link_key=link_key)
+        self.addCleanup(storage.close)
+        self.assertEqual([link['url'] for link in storage.select_links()],
+                         ['http://shop.test/c?a=1', 'http://shop.test/p'])
+        self.assertIsNone(storage.insert_link('http://SHOP.test/c?a=1', 0, 0))
+
+
+class MemoryCrawlStorageLinkKeyTest(unittest.TestCase):
+
+    def test_url_variants_are_stored_once(self):
+        storage = MemoryCrawlStorage(link_key=link_key)
+        self.assertIsNotNone(storage.insert_link('http://shop.test/c?b=2&a=1', 0, 0))
+        self.assertIsNone(storage.insert_link('http://SHOP.test/c?a=1&b=2#x', 0, 0))
+
+    def test_without_a_visited_set_the_caller_deduplicates(self):
+        storage = MemoryCrawlStorage(visited_set_factory=None)
+        first = storage.insert_link('http://shop.test/c', 0, 0)
+        second = storage.insert_link('http://shop.test/c', 0, 0)
+        self.assertEqual((first['record_id'], second['record_id']), (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
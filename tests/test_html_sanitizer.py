@@ -0,0 +1,97 @@
+"""
+HtmlSanitizer gives the same descriptions as prettify_description. The expected strings are the output of
+prettify_description with BeautifulSoup 4.6.0 and htmlmin 0.1.10, the versions in requirements.txt.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+from html_sanitizer import HtmlSanitizer  # noqa: E402
+
+try:
+    import bs4
+    import htmlmin  # noqa: F401
+    # Other versions of BeautifulSoup read some of the legacy markup differently
+    HAS_LEGACY_DEPENDENCIES = bs4.__version__ == '4.6.0'
+except ImportError:
+    HAS_LEGACY_DEPENDENCIES = False
+
+# Markup HtmlSanitizer cleans by itself
+SANITIZED = [
+    # Nested lists, stray attributes, unwrapped <strong> and <a>
+    ('<ul class="features" style="color:red">\n  <li>Waterproof\n    <ul>\n      <li>Up to <strong>50 m</strong></li>\n'
+     '      <li data-x="1">Rated <b>IPX8</b></li>\n    </ul>\n  </li>\n'
+     '  <li>Battery:   <a href="/battery" target="_blank">2 days</a></li>\n</ul>',
+     '<ul><li> Waterproof <ul><li> Up to 50 m </li><li> Rated <b> IPX8 </b></li></ul></li>'
+     '<li> Battery: 2 days </li></ul>'),
+    # Entities
+    ('<p>Fish &amp; Chips &lt;large&gt; &#8212; caf&#233;&nbsp;bar &#169; ACME&#8482; &#174;</p>',
+     '<p> Fish & Chips <large> - café bar © ACME  </p>'),
+    ('<table border="1" cellpadding="2"><tr><td>Weight</td><td>1.2&#160;kg</td></tr><tr><td></td><td>   </td></tr>'
+     '</table>',
+     '<table><tr><td> Weight </td><td> 1.2 kg </td></tr><tr><td></td></tr></table>'),
+    ('<h2 style="margin:0">Specs</h2><!-- internal note --><ol start="3"><li><b>Cotton</b> 80%</li>'
+     '<li>Polyester &#x32;0%</li></ol>',
+     '<h2> Specs </h2><ol><li><b> Cotton </b> 80% </li><li> Polyester 20% </li></ol>'),
+    # <br> of browsers and <br/> of lxml
+    ('<div id="d1">First line<br>Second line<br>  <br>Third</div>',
+     '<div> First line Second line Third </div>'),
+    ('<p>Size: M<br/>Colour: <span class="c">navy</span><br />Fit: regular</p>',
+     '<p> Size: M Colour: <span> navy </span> Fit: regular </p>'),
+    # Whitespace runs
+    ('<p>\n   Lots   of\n\n  whitespace\t here   </p>\n\n<p>  and   there </p>',
+     '<p> Lots of whitespace here </p><p> and there </p>'),
+    # Dropped <img> and <script>, removed empty tags
+    ('<div data-sku="12" onclick="go()"><span class="a" lang="en">Size</span> <em title="t">XL</em>'
+     '<img src="x.png" alt="x"><script type="text/javascript">track("x");</script><p class="empty"></p></div>',
+     '<div><span> Size </span><em> XL </em></div>'),
+]
+
+# Markup HtmlSanitizer passes to prettify_description
+LEGACY = [
+    # html.parser leaves <br/> open after <br>
+    ('<div>Mixed<br>void<br/>forms<br />here</div>',
+     '<div> Mixed void <br> forms here </div>'),
+    # Named entities other than &nbsp; are not XML
+    ('<p>Dash &mdash; and caf&eacute;</p>',
+     '<p> Dash - and café </p>'),
+]
+
+
+class HtmlSanitizerTest(unittest.TestCase):
+
+    def test_descriptions_are_the_same_as_prettify_description(self):
+        sanitizer = HtmlSanitizer()
+        for html_code, expected in SANITIZED:
+            with self.subTest(html_code=html_code):
+                self.assertEqual(sanitizer(html_code), expected)
+        self.assertEqual(sanitizer.legacy_calls, 0)
+
+    def test_markup_read_differently_by_beautifulsoup_goes_to_prettify_description(self):
+        sanitizer = HtmlSanitizer()
+        with mock.patch('html_sanitizer.prettify_description', return_value='legacy') as prettify_description:
+            for html_code, _ in LEGACY:
+                with self.subTest(html_code=html_code):
+                    self.assertEqual(sanitizer(html_code), 'legacy')
+                    prettify_description.assert_called_with(html_code)
+        self.assertEqual(sanitizer.legacy_calls, len(LEGACY))
+
+    @unittest.skipUnless(HAS_LEGACY_DEPENDENCIES, 'beautifulsoup4 4.6.0 and htmlmin are not installed')
+    def test_legacy_descriptions(self):
+        sanitizer = HtmlSanitizer()
+        for html_code, expected in LEGACY:
+            with self.subTest(html_code=html_code):
+                self.assertEqual(sanitizer(html_code), expected)
+
+    def test_empty_description(self):
+        self.assertEqual(HtmlSanitizer()(''), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
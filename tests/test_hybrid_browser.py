@@ -0,0 +1,102 @@
+"""
+Escalation of URL patterns to Chrome by HybridBrowser, with a fake HTTP client and a fake Chrome.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+from lxml import html
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+from hybrid_browser import HybridBrowser  # noqa: E402
+from selector_plan import compile_xpath  # noqa: E402
+
+PRODUCT = '<html><body><h1 class="name">Drill {}</h1></body></html>'
+EMPTY = '<html><body><div id="app"></div></body></html>'
+NAME_XPATHS = [compile_xpath("//h1[@class='name']")]
+
+
+class FakeResponse(object):
+    """The parts of requests.Response RequestsLxmlBrowser reads"""
+
+    def __init__(self, body: str):
+        self.status_code = 200
+        self.headers = {'Content-Type': 'text/html'}
+        self.content = body.encode('utf-8')
+        self.text = body
+
+
+class FakeHttpClient(object):
+
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.fetched = list()
+
+    def get(self, url, headers=None, status_retries=True):
+        self.fetched.append(url)
+        return FakeResponse(self.pages[url])
+
+
+class FakeChrome(object):
+    """SeleniumChromeBrowser rendering the pages from a dict"""
+
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.opened = list()
+        self._page = None
+
+    def get(self, url):
+        self.opened.append(url)
+        self._page = html.fromstring(self.pages[url])
+
+    def find_elements_by_xpath(self, xpath, web_element=None):
+        return xpath(self._page if web_element is None else web_element)
+
+
+class HybridBrowserEscalationTest(unittest.TestCase):
+
+    def setUp(self):
+        plain = dict()
+        rendered = dict()
+        for i in range(1, 5):
+            # Products rendered by JavaScript
+            plain[f'http://shop.test/js/{i}'] = EMPTY
+            rendered[f'http://shop.test/js/{i}'] = PRODUCT.format(i)
+            # Products in the plain HTML
+            plain[f'http://shop.test/p/{i}'] = PRODUCT.format(i)
+            rendered[f'http://shop.test/p/{i}'] = PRODUCT.format(i)
+        # A broken page, Chrome does not find the name either
+        plain['http://shop.test/p/0'] = EMPTY
+        rendered['http://shop.test/p/0'] = EMPTY
+        self.http_client = FakeHttpClient(plain)
+        self.chrome = FakeChrome(rendered)
+        self.browser = HybridBrowser(http_client=self.http_client, escalate_after=2)
+        self.browser._chrome_browser = self.chrome
+
+    def test_broken_page_does_not_escalate_its_siblings(self):
+        self.browser.get('http://shop.test/p/0', NAME_XPATHS)
+        self.assertEqual(self.chrome.opened, ['http://shop.test/p/0'])
+        for i in range(1, 5):
+            self.browser.get(f'http://shop.test/p/{i}', NAME_XPATHS)
+            self.assertEqual(len(self.browser.find_elements_by_xpath(NAME_XPATHS[0])), 1)
+        self.assertEqual(self.chrome.opened, ['http://shop.test/p/0'])
+        self.assertEqual(self.browser.escalated_patterns, set())
+
+    def test_pattern_is_escalated_after_pages_which_needed_chrome(self):
+        for i in range(1, 5):
+            self.browser.get(f'http://shop.test/js/{i}', NAME_XPATHS)
+            self.assertEqual(len(self.browser.find_elements_by_xpath(NAME_XPATHS[0])), 1)
+        self.assertEqual(self.browser.escalated_patterns, {'shop.test/js/'})
+        # The pages after the second one are not downloaded for lxml any more
+        self.assertEqual(self.http_client.fetched, ['http://shop.test/js/1', 'http://shop.test/js/2'])
+        self.assertEqual(self.chrome.opened, [f'http://shop.test/js/{i}' for i in range(1, 5)])
+        self.assertEqual(self.browser.pages_escalated, 4)
+        self.assertIsNone(self.browser.get_page_info())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Retries of throttled requests by the host limiters, with fake requests instead of a server.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+from crawl_metrics import CrawlMetrics  # noqa: E402
+from politeness import AdaptiveHostLimiter, HostLimiter  # noqa: E402
+
+
+class FakeResponse(object):
+    """The parts of requests.Response the limiters read"""
+
+    def __init__(self, status_code: int, retry_after: str = None):
+        self.status_code = status_code
+        self.headers = {'Retry-After': retry_after} if retry_after is not None else {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRequest(object):
+    """
+    Answers the responses given in turn, the status of the last one from then on.
+    The first call waits at the barrier, if any, so that concurrent requests are in flight together.
+    """
+
+    def __init__(self, *responses, barrier: threading.Barrier = None):
+        self.responses = list(responses)
+        self.returned = list()
+        self.barrier = barrier
+
+    def __call__(self):
+        if self.barrier is not None and not self.returned:
+            self.barrier.wait()
+        response = self.responses.pop(0) if len(self.responses) > 1 else FakeResponse(self.responses[0].status_code)
+        self.returned.append(response)
+        return response
+
+
+class HostLimiterRetryTest(unittest.TestCase):
+    url = 'http://shop.test/catalogue'
+
+    def make_limiter(self, **kvargs) -> HostLimiter:
+        self.metrics = CrawlMetrics(progress_interval=0)
+        return HostLimiter(metrics=self.metrics, **kvargs)
+
+    def test_throttled_request_is_retried_after_retry_after(self):
+        limiter = self.make_limiter(retries=3, backoff_factor=10)
+        request = FakeRequest(FakeResponse(429, retry_after='0.2'), FakeResponse(200))
+        started = time.monotonic()
+        response = limiter.call(self.url, request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(request.returned), 2)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(self.metrics.counters['retries'], 1)
+        # The throttled streamed response gives its connection back, the returned one is left open
+        self.assertTrue(request.returned[0].closed)
+        self.assertFalse(response.closed)
+
+    def test_last_response_is_returned_when_retries_run_out(self):
+        limiter = self.make_limiter(retries=2, backoff_factor=0.01)
+        request = FakeRequest(FakeResponse(503))
+        response = limiter.call(self.url, request)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(request.returned), 3)
+        self.assertEqual(self.metrics.counters['retries'], 2)
+        self.assertEqual([r.closed for r in request.returned], [True, True, False])
+
+    def test_concurrent_throttled_requests_do_not_stack_their_delays(self):
+        limiter = self.make_limiter(retries=1, backoff_factor=10)
+        barrier = threading.Barrier(6)
+        requests = [FakeRequest(FakeResponse(429, retry_after='0.3'), FakeResponse(200), barrier=barrier)
+                    for _ in range(6)]
+        threads = [threading.Thread(target=limiter.call, args=(self.url, request)) for request in requests]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([len(request.returned) for request in requests], [2] * 6)
+        self.assertEqual(self.metrics.counters['retries'], 6)
+        self.assertLess(time.monotonic() - started, 0.3 * 2)
+
+    def test_penalty_holds_requests_reserved_before_it(self):
+        limiter = self.make_limiter(max_rate=5)
+        limiter.acquire('shop.test')
+        limiter.release('shop.test')
+        limiter.penalise('shop.test', 0.4)
+        started = time.monotonic()
+        limiter.acquire('shop.test')
+        limiter.release('shop.test')
+        self.assertGreaterEqual(time.monotonic() - started, 0.4)
+
+    def test_adaptive_limiter_backs_off_on_every_throttled_attempt(self):
+        self.metrics = CrawlMetrics(progress_interval=0)
+        limiter = AdaptiveHostLimiter(max_rate=10, initial_rate=8, min_rate=0.1, backoff=0.5, retries=3,
+                                      backoff_factor=0.01, metrics=self.metrics)
+        request = FakeRequest(FakeResponse(429), FakeResponse(503), FakeResponse(200))
+        self.assertEqual(limiter.call(self.url, request).status_code, 200)
+
+        self.assertEqual(self.metrics.counters['retries'], 2)
+        self.assertAlmostEqual(limiter.rate('shop.test'), 8 * 0.5 * 0.5 + limiter.rate_increase)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import heapq
+from collections import deque
+
+from url_dedup import ExactSet
+
+
+class UrlFrontier(object):
+    """
+    Queue of links waiting to be scraped.
+    Push, pop and duplicate checks are O(1): records are kept in FIFO buckets per priority and
+    only the (small) set of distinct priorities is kept in a heap. Lower priorities are popped first.
+    Keys ever pushed are kept in a visited set of url_dedup.
+    """
+
+    def __init__(self, priority_key=None, visited_set_factory=ExactSet):
+        """
+        :param priority_key: function record -> priority, None for plain FIFO order
+        :param visited_set_factory: function returning an empty visited set (ExactSet, FingerprintSet...)
+        """
+        self._priority_key = priority_key
+        self._visited_set_factory = visited_set_factory
+        self.clear()
+
+    def clear(self):
+        self._buckets = dict()
+        self._priorities = list()
+        self._seen = self._visited_set_factory()
+        self._pending = 0
+
+    def __len__(self):
+        return self._pending
+
+    def __bool__(self):
+        return self._pending > 0
+
+    def __contains__(self, key):
+        return key in self._seen
+
+    @property
+    def size(self) -> int:
+        """Number of unique links ever pushed to the frontier"""
+        return len(self._seen)
+
+    @property
+    def pending(self) -> int:
+        """Number of links waiting to be popped"""
+        return self._pending
+
+    def pending_counts(self) -> dict:
+        """Number of pending links per priority"""
+        return {priority: len(bucket) for priority, bucket in self._buckets.items() if bucket}
+
+    def push(self, key, record) -> bool:
+        """
+        Adds the record to the frontier unless the key has been seen before
+        :return: True if the record has been queued
+        """
+        if not self._seen.add(key):
+            return False
+        self._enqueue(record)
+        return True
+
+    def mark_seen(self, key):
+        """Registers the key as known without queueing anything (e.g. already scraped links)"""
+        self._seen.add(key)
+
+    def pop(self) -> dict or None:
+        while self._priorities:
+            priority = self._priorities[0]
+            bucket = self._buckets[priority]
+            if bucket:
+                self._pending -= 1
+                return bucket.popleft()
+            heapq.heappop(self._priorities)
+            del self._buckets[priority]
+        return None
+
+    def _enqueue(self, record):
+        priority = self._priority_key(record) if self._priority_key is not None else 0
+        bucket = self._buckets.get(priority)
+        if bucket is None:
+            bucket = self._buckets[priority] = deque()
+            heapq.heappush(self._priorities, priority)
+        bucket.append(record)
+        self._pending += 1
@@ -0,0 +1,30 @@
+from abc_results_writer import ABCResultsWriter
+
+
+class XlsxResultsWriter(ABCResultsWriter):
+    """
+    Excel results writer, rows are flushed to disk as they are written (xlsxwriter constant_memory mode).
+    The file is complete only after close().
+    """
+
+    def __init__(self, file_name: str, additional_fields: list, **kvargs):
+        """
+        :param kvargs: sheet_name
+        """
+        super().__init__(file_name, additional_fields, **kvargs)
+        # Imported here, so that crawls exporting other formats don't load it
+        import xlsxwriter
+        self._workbook = xlsxwriter.Workbook(file_name, {'constant_memory': True})
+        self._worksheet = self._workbook.add_worksheet(name=kvargs.get('sheet_name'))
+
+        # Add a bold format to use to highlight row headers.
+        bold_format = self._workbook.add_format({'bold': True})
+        self._worksheet.write_row(0, 0, self.columns, bold_format)
+
+    def write_row(self, values: list):
+        self._worksheet.write_row(self.rows_written + 1, 0, values)
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None